@@ -0,0 +1,494 @@
+# async_server.py - АСИНХРОННЫЙ РЕЖИМ: ASGI, HTTP СЕРВЕР И MQTT НА ОДНОМ ЦИКЛЕ СОБЫТИЙ
+import asyncio
+import concurrent.futures
+import http
+import io
+import logging
+import socket
+import sys
+import threading
+from urllib.parse import unquote
+
+import web_server
+from web_server import app, storage, Config, LOCAL_IP
+from change_feed import AsyncSubscription
+
+# Внешний ASGI сервер, если установлен (pip install uvicorn)
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+logger = logging.getLogger(__name__)
+
+
+# ========== ASGI ПРИЛОЖЕНИЕ ==========
+
+def build_environ(scope, body):
+    """WSGI environ по ASGI scope (для вызова Flask приложения)"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Вызов WSGI приложения целиком: (статус, заголовки ASGI, тело)"""
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [int(status.split(' ', 1)[0]),
+                       [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response[0], response[1], body
+
+
+class AsgiApp:
+    """ASGI приложение поверх маршрутов Flask.
+
+    Обычные запросы выполняются Flask приложением прямо в цикле событий: обработчики
+    читают память и кэш ответов и не блокируются. POST запросы (публикация команд
+    с ограничением частоты) и GET маршруты из offload_paths (чтение сегментов
+    телеметрии с диска) уходят в пул потоков. /api/stream обслуживается
+    асинхронно: клиент SSE - это подписка в цикле событий, а не поток.
+    """
+
+    def __init__(self, wsgi_app, stream_path='/api/stream', offload_paths=(), workers=8):
+        self.wsgi_app = wsgi_app
+        self.stream_path = stream_path
+        self.offload_paths = tuple(offload_paths)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-worker')
+
+        self.request_count = 0
+        self.offloaded_count = 0
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        self.request_count += 1
+        if scope['path'] == self.stream_path:
+            await self._stream(receive, send)
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        environ = build_environ(scope, body)
+        if scope['method'] in ('GET', 'HEAD') and not scope['path'].endswith(self.offload_paths):
+            status, headers, content = call_wsgi(self.wsgi_app, environ)
+        else:
+            self.offloaded_count += 1
+            loop = asyncio.get_running_loop()
+            status, headers, content = await loop.run_in_executor(self.executor, call_wsgi, self.wsgi_app, environ)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _stream(self, receive, send):
+        """Поток изменений устройств (SSE) без отдельного потока на клиента"""
+        subscription = AsyncSubscription(storage.feed.max_queue, asyncio.get_running_loop())
+        storage.feed.subscribe(subscription)
+        self.streams += 1
+
+        async def pump():
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')
+            ]})
+            await send({'type': 'http.response.body', 'body': web_server.build_stream_snapshot(), 'more_body': True})
+            while True:
+                if subscription.resync:
+                    subscription.resync = False
+                    message = web_server.build_stream_snapshot()
+                else:
+                    message = await subscription.get(timeout=Config.STREAM_KEEPALIVE)
+                await send({'type': 'http.response.body', 'body': message if message is not None else b": keepalive\n\n",
+                            'more_body': True})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_disconnect())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            storage.feed.unsubscribe(subscription)
+            self.streams -= 1
+
+    def get_stats(self):
+        return {
+            'requests': self.request_count,
+            'offloaded': self.offloaded_count,
+            'streams': self.streams
+        }
+
+
+# ========== ВСТРОЕННЫЙ HTTP СЕРВЕР ==========
+
+class HttpServer:
+    """Минимальный HTTP/1.1 сервер для ASGI приложения на asyncio.
+
+    Поддерживает keep-alive, тело запроса по Content-Length и потоковые ответы
+    (chunked). Используется, если uvicorn не установлен.
+    """
+
+    def __init__(self, app, host, port, max_header=64 * 1024, max_body=1024 * 1024, keepalive_timeout=75):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.max_header = max_header
+        self.max_body = max_body
+        self.keepalive_timeout = keepalive_timeout
+        self.server = None
+
+        self.connections = 0
+        self.total_connections = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port,
+            limit=self.max_header, backlog=1024, reuse_address=True
+        )
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    @staticmethod
+    def _error(writer, status):
+        phrase = http.HTTPStatus(status).phrase
+        writer.write(f"HTTP/1.1 {status} {phrase}\r\ncontent-length: 0\r\nconnection: close\r\n\r\n".encode('latin-1'))
+
+    async def _serve_connection(self, reader, writer):
+        self.connections += 1
+        self.total_connections += 1
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = writer.get_extra_info('peername')
+        client = tuple(peer[:2]) if isinstance(peer, tuple) else None
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except asyncio.LimitOverrunError:
+                    self._error(writer, 431)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                try:
+                    request_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+                    method, target, version = request_line.split(' ')
+                    headers = []
+                    for line in header_lines:
+                        name, value = line.split(':', 1)
+                        headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+                except ValueError:
+                    self._error(writer, 400)
+                    break
+
+                header_map = dict(headers)
+                length = int(header_map.get(b'content-length', b'0') or 0)
+                if length > self.max_body:
+                    self._error(writer, 413)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                connection = header_map.get(b'connection', b'').lower()
+                keep_alive = connection != b'close' if version == 'HTTP/1.1' else connection == b'keep-alive'
+
+                path, _, query = target.partition('?')
+                scope = {
+                    'type': 'http',
+                    'asgi': {'version': '3.0'},
+                    'http_version': version[5:],
+                    'method': method,
+                    'scheme': 'http',
+                    'path': unquote(path),
+                    'raw_path': path.encode('latin-1'),
+                    'query_string': query.encode('latin-1'),
+                    'root_path': '',
+                    'headers': headers,
+                    'client': client,
+                    'server': (self.host, self.port)
+                }
+                if not await self._run_app(scope, body, reader, writer, keep_alive) or not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _run_app(self, scope, body, reader, writer, keep_alive):
+        """Один запрос через ASGI приложение; False - соединение нужно закрыть"""
+        state = {'status': 500, 'headers': [], 'started': False, 'chunked': False, 'finished': False}
+        request_read = False
+
+        async def receive():
+            nonlocal request_read
+            if not request_read:
+                request_read = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Тело уже передано - ждем закрытия соединения клиентом (потоковые ответы)
+            while await reader.read(4096):
+                pass
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                state['headers'] = list(message.get('headers', []))
+                return
+            if message['type'] != 'http.response.body' or state['finished']:
+                return
+
+            content = message.get('body', b'')
+            more = message.get('more_body', False)
+            if scope['method'] == 'HEAD':
+                content = b''
+            out = []
+            if not state['started']:
+                state['started'] = True
+                headers = state['headers']
+                names = {name for name, _ in headers}
+                if b'content-length' not in names:
+                    if more:
+                        state['chunked'] = True
+                        headers.append((b'transfer-encoding', b'chunked'))
+                    else:
+                        headers.append((b'content-length', str(len(content)).encode()))
+                headers.append((b'connection', b'keep-alive' if keep_alive else b'close'))
+                phrase = http.HTTPStatus(state['status']).phrase
+                out.append(f"HTTP/1.1 {state['status']} {phrase}\r\n".encode('latin-1'))
+                out.extend(name + b': ' + value + b'\r\n' for name, value in headers)
+                out.append(b'\r\n')
+
+            if state['chunked']:
+                if content:
+                    out.append(b'%x\r\n' % len(content) + content + b'\r\n')
+                if not more:
+                    out.append(b'0\r\n\r\n')
+            else:
+                out.append(content)
+            if not more:
+                state['finished'] = True
+
+            writer.write(b''.join(out))
+            await writer.drain()
+
+        try:
+            await self.app(scope, receive, send)
+        except (ConnectionError, asyncio.CancelledError):
+            return False
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки запроса {scope['method']} {scope['path']}: {e}")
+            if not state['started']:
+                self._error(writer, 500)
+            return False
+
+        if not state['finished']:
+            # Приложение не завершило ответ - соединение в неопределенном состоянии
+            if not state['started']:
+                self._error(writer, 500)
+            return False
+        return True
+
+
+# ========== MQTT НА ЦИКЛЕ СОБЫТИЙ ==========
+
+class AsyncioMqtt:
+    """paho клиент на цикле событий asyncio вместо потока loop_forever.
+
+    Чтение и запись сокета брокера выполняются обработчиками add_reader/add_writer,
+    служебные действия (keepalive, повторы) - задачей раз в секунду. Публикации
+    из других потоков (пул запросов, воркеры) передаются в цикл через
+    call_soon_threadsafe.
+    """
+
+    def __init__(self, loop, client, reconnect_delay=5.0):
+        self.loop = loop
+        self.client = client
+        self.reconnect_delay = reconnect_delay
+        self._misc_task = None
+        self._thread_id = None
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_disconnect = self._on_disconnect
+
+    def _call(self, fn, *args):
+        """Выполнение в потоке цикла событий (напрямую, если уже в нем)"""
+        if threading.get_ident() == self._thread_id:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self._attach, sock)
+
+    def _attach(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc_task is None:
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            logger.warning(f"⚠️ MQTT соединение потеряно (код {rc}), повтор через {self.reconnect_delay:.0f} с")
+            self.loop.call_later(self.reconnect_delay, self._reconnect)
+
+    def _reconnect(self):
+        try:
+            self.client.reconnect()
+        except Exception as e:
+            logger.error(f"❌ Ошибка переподключения MQTT: {e}")
+            self.loop.call_later(self.reconnect_delay, self._reconnect)
+
+    async def _misc_loop(self):
+        while True:
+            self.client.loop_misc()
+            await asyncio.sleep(1)
+
+    def connect(self, host, port, keepalive):
+        """Подключение к брокеру (вызывается в потоке цикла событий)"""
+        self._thread_id = threading.get_ident()
+        self.client.connect(host, port, keepalive)
+
+    def stop(self):
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+# ========== ЗАПУСК ==========
+
+asgi_app = AsgiApp(
+    app,
+    offload_paths=Config.ASYNC_OFFLOAD_PATHS,
+    workers=Config.ASYNC_WORKER_THREADS
+)
+
+
+async def serve(host=None, port=None, with_mqtt=True):
+    """Фоновые службы, MQTT клиент и HTTP сервер на текущем цикле событий"""
+    host = host or Config.WEB_HOST
+    port = port or Config.WEB_PORT
+    loop = asyncio.get_running_loop()
+
+    web_server.start_services()
+
+    mqtt_helper = None
+    if with_mqtt:
+        mqtt_helper = AsyncioMqtt(loop, web_server.create_mqtt_client())
+        try:
+            logger.info(f"🔄 Подключение к MQTT брокеру: {Config.MQTT_BROKER_HOST}:{Config.MQTT_BROKER_PORT}")
+            mqtt_helper.connect(Config.MQTT_BROKER_HOST, Config.MQTT_BROKER_PORT, Config.MQTT_KEEPALIVE)
+            logger.info("✅ MQTT клиент запущен в цикле событий")
+        except Exception as e:
+            logger.error(f"❌ Ошибка подключения MQTT: {e}")
+            storage.count_error()
+
+    logger.info(f"🚀 Запуск асинхронного веб-сервера ({Config.ASYNC_HTTP_SERVER})...")
+    logger.info(f"🌐 Веб-интерфейс будет доступен по адресу: http://{LOCAL_IP}:{port}")
+    storage.log_event("Веб-сервер запущен (asyncio)")
+
+    try:
+        if Config.ASYNC_HTTP_SERVER == 'uvicorn' and uvicorn is not None:
+            server = uvicorn.Server(uvicorn.Config(asgi_app, host=host, port=port, log_level='warning', lifespan='off'))
+            await server.serve()
+        else:
+            if Config.ASYNC_HTTP_SERVER == 'uvicorn':
+                logger.warning("⚠️ uvicorn не установлен, используется встроенный HTTP сервер")
+            await HttpServer(asgi_app, host, port).serve_forever()
+    finally:
+        if mqtt_helper is not None:
+            mqtt_helper.stop()
+
+
+def start_async_server():
+    """Запуск веб-сервера в асинхронном режиме (аналог web_server.start_web_server)"""
+    try:
+        asyncio.run(serve())
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска асинхронного веб-сервера: {e}")
+        return False
+
+
+# Запуск при прямом выполнении
+if __name__ == '__main__':
+    start_async_server()
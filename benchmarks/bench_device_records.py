@@ -0,0 +1,111 @@
+# bench_device_records.py - СРАВНЕНИЕ ПАМЯТИ: СЛОВАРИ VS DeviceRecord
+"""Сравнение расхода памяти на запись устройства.
+
+Старый формат DeviceStorage (словарь + вложенный словарь attributes) против
+DeviceRecord/DeviceAttributes со слотами и таблицей общих строк.
+
+Запуск: python benchmarks/bench_device_records.py [количество_устройств]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_manager import DeviceRecord, DeviceAttributes, intern_string
+
+
+def status_attributes(index):
+    """Атрибуты статуса, как их собирает on_mqtt_message (значения "приходят" из JSON)"""
+    return {
+        'mac': f"5C:CF:7F:{index >> 16 & 0xFF:02X}:{index >> 8 & 0xFF:02X}:{index & 0xFF:02X}",
+        'rssi': -40 - index % 50,
+        'free_heap': 30000 + index % 5000,
+        'uptime': 1000 * index,
+        # json.loads создает новые строки на каждое сообщение
+        'version': ''.join(['2', '.0']),
+        'firmware': ''.join(['AutoID_', 'WiFiManager']),
+        'config_mode': False,
+        'mqtt_broker': ''.join(['192.168.1.', '10']),
+        'led_state': True,
+        'action_button_pressed': False,
+        'led_on': True,
+        'rgb_color': ''.join(['0,0,', '0']),
+        'available': True
+    }
+
+
+def build_dict(index):
+    """Запись в старом формате DeviceStorage.add_device"""
+    attributes = status_attributes(index)
+    device_data = {
+        'id': f"ESP_{index:06X}",
+        'type': ''.join(['rgb_', 'controller']),
+        'ip': f"192.168.{index >> 8 & 0xFF}.{index & 0xFF}",
+        'status': 'connected',
+        'last_seen': time.time(),
+        'attributes': attributes,
+        'created_at': datetime.now().isoformat(),
+        'action_button_pressed': False,
+        'led_on': True,
+        'rgb_color': '0,0,0',
+        'available': True
+    }
+    for key in ('action_button_pressed', 'led_on', 'rgb_color', 'available'):
+        device_data[key] = attributes[key]
+    return device_data
+
+
+def build_record(index):
+    """Запись в формате DeviceRecord"""
+    attributes = status_attributes(index)
+    now = time.time()
+    return DeviceRecord(
+        device_id=f"ESP_{index:06X}",
+        device_type=intern_string(''.join(['rgb_', 'controller'])),
+        ip_address=f"192.168.{index >> 8 & 0xFF}.{index & 0xFF}",
+        status='connected',
+        last_seen=now,
+        attributes=DeviceAttributes.from_dict(attributes),
+        created_at=now,
+        action_button_pressed=attributes['action_button_pressed'],
+        led_on=attributes['led_on'],
+        rgb_color=intern_string(attributes['rgb_color']),
+        available=attributes['available']
+    )
+
+
+def measure(builder, count):
+    """Байт на запись (без учета словаря-контейнера с id устройств)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    devices = [builder(index) for index in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # Вычитаем сам список
+    allocated -= sys.getsizeof(devices)
+    return allocated / count, devices
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    dict_bytes, dict_devices = measure(build_dict, count)
+    record_bytes, record_devices = measure(build_record, count)
+
+    # Форматы должны совпадать с тем, что отдает /api/devices
+    sample = record_devices[0].to_dict()
+    assert set(sample) == set(dict_devices[0]), "Формат DeviceRecord.to_dict() отличается от словаря"
+
+    print(f"Устройств: {count}")
+    print(f"dict:         {dict_bytes:8.0f} байт/устройство, {dict_bytes * count / 1024 / 1024:7.1f} МБ всего")
+    print(f"DeviceRecord: {record_bytes:8.0f} байт/устройство, {record_bytes * count / 1024 / 1024:7.1f} МБ всего")
+    print(f"Экономия:     {(1 - record_bytes / dict_bytes) * 100:7.1f} %")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+# bench_fleet.py - СКВОЗНОЙ НАГРУЗОЧНЫЙ ТЕСТ: ВИРТУАЛЬНЫЙ ПАРК, ПРИЕМ, КОМАНДЫ, API ДАШБОРДОВ
+"""Емкость сервера на виртуальном парке ESP (fleet_simulator.py) без железа и брокера.
+
+Сервер (web_server в потоковом режиме), брокер в памяти и парк работают в
+этом процессе, дашборды - в отдельном процессе (генератор нагрузки из
+bench_http_runtime.py), чтобы не делить с сервером GIL. Этапы:
+
+  регистрация - DISCOVER от сервера, все устройства присылают статус;
+                время до регистрации всего парка и память сервера на устройство
+                (прирост RSS; объекты парка созданы до замера)
+  прием       - парк публикует без пауз; сообщений в секунду до опустошения
+                очередей, потери в очередях брокера и конвейера
+  нагрузка    - парк с интервалами из скетчей, дашборды опрашивают API и держат
+                /api/stream, поток команд через /api/device/<id>/command:
+                задержка доставки брокером, прием (submit -> применение),
+                сквозная задержка data (публикация устройством -> хранилище),
+                команда -> подтверждение устройства, p50/p99 API
+
+Результаты сохраняются в JSON (по умолчанию benchmarks/results/) для сравнения
+с прошлыми прогонами: --compare <файл> печатает изменения и завершается с кодом
+1, если ключевая метрика ухудшилась больше допуска.
+
+Запуск: python benchmarks/bench_fleet.py [устройств] [секунд] [опрашивающих] [потоков_sse]
+        [--status с] [--data с] [--button с] [--commands в_секунду] [--wemos доля]
+        [--save файл] [--compare файл] [--tolerance доля]
+"""
+import asyncio
+import gc
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+sys.path.insert(0, ROOT)
+
+from fleet_simulator import InProcessBroker, BrokerClient, Fleet
+
+# Ключевые метрики для сравнения: (путь в результатах, подпись, больше - лучше)
+KEY_METRICS = (
+    ('ingest.messages_per_second', 'прием, сообщ/с', True),
+    ('registration.seconds', 'регистрация парка, с', False),
+    ('registration.memory_per_device_bytes', 'память на устройство, байт', False),
+    ('latency.ingest_p99_ms', 'прием p99, мс', False),
+    ('latency.e2e_p99_ms', 'data сквозная p99, мс', False),
+    ('latency.command_p99_ms', 'команда -> ack p99, мс', False),
+    ('api.rps', 'API, запр/с', True),
+    ('api.p99_ms', 'API p99, мс', False),
+)
+
+
+def percentile_ms(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 3)
+
+
+def rss_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def wait_until(condition, timeout, step=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(step)
+    return condition()
+
+
+# ========== ДАШБОРДЫ (дочерний процесс) ==========
+
+def dashboards(port, server_pid, seconds, pollers, streams):
+    from bench_http_runtime import load
+    result = asyncio.run(load(port, server_pid, seconds, pollers, streams))
+    print(json.dumps(result))
+
+
+# ========== ЗАМЕРЫ В СЕРВЕРЕ ==========
+
+class IngestProbe:
+    """Обертка обработчика конвейера: задержки после применения пачки к хранилищу.
+
+    ingest - от постановки в конвейер (on_message) до применения,
+    e2e - для data: от публикации устройством (Fleet.data_sent_at) до применения.
+    """
+
+    def __init__(self, handler, data_sent_at):
+        self.handler = handler
+        self.data_sent_at = data_sent_at
+        self.enabled = False
+        self.ingest = []
+        self.e2e = []
+
+    def __call__(self, groups):
+        self.handler(groups)
+        if not self.enabled:
+            return
+        now = time.time()
+        for device_id, messages in groups.items():
+            for message_type, _, received_at in messages:
+                self.ingest.append(now - received_at)
+                if message_type == 'data':
+                    sent_at = self.data_sent_at.get(device_id)
+                    if sent_at is not None:
+                        self.e2e.append(now - sent_at)
+
+
+class CommandLoad:
+    """Поток команд через HTTP API со случайными устройствами; время до применения подтверждения"""
+
+    def __init__(self, port, devices, rate):
+        self.port = port
+        self.devices = devices
+        self.rate = rate
+        self.sent_at = {}
+        self.acked_at = {}
+        self.http_latencies = []
+        self.rejected = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def on_ack(self, command_id):
+        self.acked_at.setdefault(command_id, time.perf_counter())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bench-commands", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        rng = random.Random(7)
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        interval = 1.0 / self.rate
+        next_at = time.perf_counter()
+        while not self._stop_event.is_set():
+            device = rng.choice(self.devices)
+            command = 'SET_COLOR' if device.device_type == 'rgb_controller' else 'STATUS'
+            started = time.perf_counter()
+            try:
+                connection.request('POST', f"/api/device/{device.device_id}/command",
+                                   json.dumps({'command': command}), {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                body = json.loads(response.read())
+                self.http_latencies.append(time.perf_counter() - started)
+                if response.status == 200:
+                    self.sent_at[body['command_id']] = started
+                else:
+                    self.rejected += 1
+            except (OSError, http.client.HTTPException, ValueError):
+                self.rejected += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                self._stop_event.wait(delay)
+            else:
+                next_at = time.perf_counter()
+        connection.close()
+
+    def round_trips(self):
+        return [self.acked_at[command_id] - sent for command_id, sent in self.sent_at.items()
+                if command_id in self.acked_at]
+
+
+# ========== ПРОГОН ==========
+
+def run(devices, seconds, pollers, streams, options):
+    os.chdir(tempfile.mkdtemp(prefix='bench_fleet_'))
+    import web_server
+    logging.getLogger().setLevel(logging.WARNING)
+    from werkzeug.serving import make_server
+
+    broker = InProcessBroker()
+    fleet = Fleet(broker, devices, wemos_share=options['wemos'], status_interval=options['status'],
+                  data_interval=options['data'], button_interval=options['button'])
+    fleet.connect()
+
+    web_server.start_services()
+    web_server.create_mqtt_client()
+    probe = IngestProbe(web_server.ingest.handler, fleet.data_sent_at)
+    web_server.ingest.handler = probe
+
+    http_server = make_server('127.0.0.1', 0, web_server.app, threaded=True)
+    port = http_server.server_port
+    threading.Thread(target=http_server.serve_forever, name="bench-http", daemon=True).start()
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ingest_workers': web_server.Config.INGEST_WORKERS
+        },
+        'config': {'devices': devices, 'seconds': seconds, 'pollers': pollers, 'streams': streams, **options}
+    }
+
+    # Регистрация: подключение сервера к брокеру рассылает DISCOVER
+    gc.collect()
+    rss_before = rss_bytes()
+    client = BrokerClient(broker)
+    client.on_connect = web_server.on_mqtt_connect
+    client.on_message = web_server.on_mqtt_message
+    web_server.mqtt_client = client
+    started = time.perf_counter()
+    client.connect()
+    registered = wait_until(lambda: len(web_server.storage.devices) >= devices, timeout=60)
+    registration_seconds = time.perf_counter() - started
+    wait_until(lambda: broker.backlog() == 0 and web_server.ingest.get_queue_depth() == 0, timeout=30)
+    gc.collect()
+    rss_after = rss_bytes()
+    results['registration'] = {
+        'registered': len(web_server.storage.devices),
+        'complete': registered,
+        'seconds': round(registration_seconds, 3),
+        'rss_before_mb': round(rss_before / 2 ** 20, 1),
+        'rss_after_mb': round(rss_after / 2 ** 20, 1),
+        'memory_per_device_bytes': round((rss_after - rss_before) / devices)
+    }
+    print(f"Регистрация: {len(web_server.storage.devices)}/{devices} за {registration_seconds:.2f} с, "
+          f"{results['registration']['memory_per_device_bytes']} байт на устройство")
+
+    # Прием: публикация без пауз, затем ожидание опустошения очередей
+    session = client.session
+    ingest_before = web_server.ingest.get_stats()
+    broker_dropped = session.dropped_count
+    started = time.perf_counter()
+    published = fleet.flood(options['flood'])
+    publish_seconds = time.perf_counter() - started
+    drained = wait_until(lambda: broker.backlog() == 0 and web_server.ingest.get_queue_depth() == 0, timeout=120)
+    elapsed = time.perf_counter() - started
+    ingest_after = web_server.ingest.get_stats()
+    processed = ingest_after['processed_count'] - ingest_before['processed_count']
+    results['ingest'] = {
+        'published': published,
+        'publish_per_second': round(published / publish_seconds),
+        'processed': processed,
+        'seconds': round(elapsed, 3),
+        'drained': drained,
+        'messages_per_second': round(processed / elapsed),
+        'broker_dropped': session.dropped_count - broker_dropped,
+        'ingest_dropped': ingest_after['dropped_count'] - ingest_before['dropped_count'],
+        'avg_batch_size': ingest_after['avg_batch_size']
+    }
+    print(f"Прием: {results['ingest']['messages_per_second']} сообщ/с ({processed} из {published} за {elapsed:.2f} с), "
+          f"потеряно брокером {results['ingest']['broker_dropped']}, конвейером {results['ingest']['ingest_dropped']}")
+
+    # Нагрузка: парк с интервалами из скетчей, дашборды и команды
+    commands = CommandLoad(port, fleet.devices, options['commands'])
+    acknowledge = web_server.acknowledge_command
+
+    def acknowledge_command(device_id, data):
+        commands.on_ack(data['command_id'])
+        return acknowledge(device_id, data)
+
+    web_server.acknowledge_command = acknowledge_command
+    probe.enabled = True
+    session.lags = []
+    fleet.start()
+    if options['commands'] > 0:
+        commands.start()
+
+    loader = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--dashboards', str(port), str(os.getpid()),
+         str(seconds), str(pollers), str(streams)],
+        capture_output=True, text=True
+    )
+    commands.stop()
+    # Подтверждения последних команд
+    wait_until(lambda: len(commands.round_trips()) >= len(commands.sent_at), timeout=5)
+    fleet.stop()
+    probe.enabled = False
+    lags = session.lags
+    session.lags = None
+
+    try:
+        api = json.loads(loader.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        print(f"❌ Генератор нагрузки дашбордов завершился с ошибкой:\n{loader.stderr}", file=sys.stderr)
+        api = {}
+
+    round_trips = commands.round_trips()
+    results['latency'] = {
+        'steady_rate': round(fleet.expected_rate(), 1),
+        'broker_p50_ms': percentile_ms(lags, 0.50),
+        'broker_p99_ms': percentile_ms(lags, 0.99),
+        'ingest_p50_ms': percentile_ms(probe.ingest, 0.50),
+        'ingest_p99_ms': percentile_ms(probe.ingest, 0.99),
+        'e2e_samples': len(probe.e2e),
+        'e2e_p50_ms': percentile_ms(probe.e2e, 0.50),
+        'e2e_p99_ms': percentile_ms(probe.e2e, 0.99),
+        'commands_sent': len(commands.sent_at),
+        'commands_acked': len(round_trips),
+        'commands_rejected': commands.rejected,
+        'command_http_p99_ms': percentile_ms(commands.http_latencies, 0.99),
+        'command_p50_ms': percentile_ms(round_trips, 0.50),
+        'command_p99_ms': percentile_ms(round_trips, 0.99)
+    }
+    results['api'] = {
+        'rps': round(api.get('rps', 0.0), 1),
+        'p50_ms': round(api.get('p50', 0.0), 3),
+        'p99_ms': round(api.get('p99', 0.0), 3),
+        'errors': api.get('errors'),
+        'sse_events': api.get('events'),
+        'threads': api.get('threads'),
+        'rss': api.get('rss')
+    }
+    results['fleet'] = fleet.get_stats()
+    results['server'] = {
+        'rss_mb': round(rss_bytes() / 2 ** 20, 1),
+        'threads': threading.active_count(),
+        'commands': web_server.command_tracker.get_stats()
+    }
+
+    latency = results['latency']
+    print(f"Задержки: брокер p99 {latency['broker_p99_ms']} мс, прием p50/p99 {latency['ingest_p50_ms']}/"
+          f"{latency['ingest_p99_ms']} мс, data сквозная p50/p99 {latency['e2e_p50_ms']}/{latency['e2e_p99_ms']} мс "
+          f"({latency['e2e_samples']} изм.)")
+    print(f"Команды: {latency['commands_acked']}/{latency['commands_sent']} подтверждено, "
+          f"p50/p99 {latency['command_p50_ms']}/{latency['command_p99_ms']} мс, отказов API {latency['commands_rejected']}")
+    print(f"API ({pollers} дашбордов, {streams} SSE): {results['api']['rps']} запр/с, "
+          f"p50/p99 {results['api']['p50_ms']}/{results['api']['p99_ms']} мс, ошибок {results['api']['errors']}")
+
+    http_server.shutdown()
+    client.disconnect()
+    return results
+
+
+# ========== СОХРАНЕНИЕ И СРАВНЕНИЕ ==========
+
+def lookup(results, path):
+    value = results
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """Таблица изменений ключевых метрик: число ухудшений сверх допуска"""
+    print(f"\nСравнение с прогоном {baseline.get('created_at')} (допуск {tolerance:.0%}):")
+    print(f"{'метрика':>30} {'было':>12} {'стало':>12} {'изменение':>10}")
+    regressions = 0
+    for path, label, higher_is_better in KEY_METRICS:
+        old = lookup(baseline, path)
+        new = lookup(results, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        mark = ''
+        if worse > tolerance:
+            regressions += 1
+            mark = ' ⚠️'
+        print(f"{label:>30} {old:>12} {new:>12} {change:>+10.1%}{mark}")
+    if baseline.get('config') != results.get('config'):
+        print("⚠️ Параметры прогонов отличаются, сравнение приблизительное")
+    return regressions
+
+
+def parse_args(argv):
+    positional = []
+    options = {'status': 10.0, 'data': 10.0, 'button': 120.0, 'commands': 20.0, 'wemos': 0.3, 'flood': 3.0,
+               'save': None, 'compare': None, 'tolerance': 0.10}
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg.startswith('--'):
+            name = arg[2:]
+            if name not in options or index + 1 >= len(argv):
+                raise SystemExit(f"Неизвестный или неполный параметр: {arg}")
+            value = argv[index + 1]
+            options[name] = value if name in ('save', 'compare') else float(value)
+            index += 2
+        else:
+            positional.append(arg)
+            index += 1
+    return positional, options
+
+
+def main():
+    positional, options = parse_args(sys.argv[1:])
+    devices = int(positional[0]) if len(positional) > 0 else 1000
+    seconds = float(positional[1]) if len(positional) > 1 else 10.0
+    pollers = int(positional[2]) if len(positional) > 2 else 16
+    streams = int(positional[3]) if len(positional) > 3 else 50
+
+    save_path = options.pop('save')
+    compare_path = options.pop('compare')
+    tolerance = options.pop('tolerance')
+
+    print(f"Устройств: {devices}, {seconds:.0f} с нагрузки, дашбордов: {pollers}, SSE: {streams}")
+    results = run(devices, seconds, pollers, streams, options)
+
+    if save_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        save_path = os.path.join(RESULTS_DIR, f"fleet_{devices}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(save_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {save_path}")
+
+    if compare_path is not None:
+        with open(compare_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--dashboards':
+        dashboards(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]), int(sys.argv[6]))
+    else:
+        main()
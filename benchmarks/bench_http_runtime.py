@@ -0,0 +1,241 @@
+# bench_http_runtime.py - НАГРУЗОЧНЫЙ ТЕСТ: ПОТОКОВЫЙ РЕЖИМ (FLASK), ASYNCIO И МНОГОПРОЦЕССНЫЙ
+"""Сравнение режимов веб-сервера под нагрузкой дашбордов.
+
+Сервер запускается в отдельном процессе в одном из режимов:
+
+  threaded - werkzeug с потоком на соединение (как app.run(threaded=True))
+  asyncio  - async_server: ASGI приложение и встроенный HTTP сервер на одном цикле
+  multiprocess - multiprocess_server: процесс приема и HTTP воркеры (по числу ядер)
+
+В сервере создается парк устройств, фоновый поток меняет цвета части устройств
+(поток изменений рассылает дельты). Генератор нагрузки держит N открытых
+/api/stream (SSE) и C клиентов, опрашивающих /api/devices и /api/system/status
+по keep-alive соединениям. Выводятся запросы в секунду, p50/p99 задержки,
+число событий SSE, потоков и память сервера (для multiprocess - только процесса
+приема). Выигрыш многопроцессного режима виден только на машине с несколькими ядрами.
+
+Запуск: python benchmarks/bench_http_runtime.py [секунд] [устройств] [опрашивающих] [потоков_sse,...]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ========== СЕРВЕР (дочерний процесс) ==========
+
+def serve(runtime, port, devices):
+    import logging
+    import random
+    import threading
+
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix='bench_http_'))
+    import web_server
+    logging.getLogger().setLevel(logging.WARNING)
+
+    storage = web_server.storage
+    device_ids = [f"ESP_{index:06X}" for index in range(devices)]
+    storage.apply_updates([
+        (device_id, 'add', {'device_type': 'rgb_controller', 'ip_address': '192.168.1.10',
+                            'attributes': {'rgb_color': '0,0,0'}})
+        for device_id in device_ids
+    ])
+    storage.feed.start()
+
+    def churn():
+        # 20 изменений цвета каждые 50 мс
+        while True:
+            storage.apply_updates([
+                (device_id, 'add', {'device_type': 'rgb_controller', 'ip_address': '192.168.1.10',
+                                    'attributes': {'rgb_color': f"{random.randrange(256)},0,0"}})
+                for device_id in random.sample(device_ids, 20)
+            ])
+            time.sleep(0.05)
+
+    threading.Thread(target=churn, daemon=True).start()
+
+    if runtime == 'multiprocess':
+        import multiprocess_server
+        web_server.Config.WORKER_IPC_ADDRESS = ('127.0.0.1', port + 1000)
+        multiprocess_server.serve('127.0.0.1', port, with_mqtt=False)
+    elif runtime == 'asyncio':
+        import async_server
+        asyncio.run(async_server.HttpServer(async_server.asgi_app, '127.0.0.1', port).serve_forever())
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, web_server.app, threaded=True).serve_forever()
+
+
+# ========== ГЕНЕРАТОР НАГРУЗКИ ==========
+
+async def read_response(reader):
+    """Чтение ответа: (статус, keep-alive)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return status, False
+
+    keep_alive = headers.get('connection') != 'close' and lines[0].startswith('HTTP/1.1')
+    return status, keep_alive
+
+
+async def poller(port, paths, deadline, latencies, errors):
+    reader = writer = None
+    index = 0
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 22)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: identity\r\n\r\n".encode())
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            if status != 200:
+                errors.append(status)
+            latencies.append(time.perf_counter() - started)
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def stream_client(port, stop, counters):
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 22)
+        writer.write(b"GET /api/stream HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        while not stop.is_set():
+            try:
+                data = await asyncio.wait_for(reader.read(65536), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                break
+            counters['bytes'] += len(data)
+            counters['events'] += data.count(b'event: ')
+        writer.close()
+    except OSError:
+        counters['failed'] += 1
+
+
+def process_info(pid):
+    info = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Threads', 'VmRSS'):
+                info[name] = value.strip()
+    return info
+
+
+async def load(port, pid, duration, pollers, streams):
+    stop = asyncio.Event()
+    counters = {'bytes': 0, 'events': 0, 'failed': 0}
+    stream_tasks = [asyncio.ensure_future(stream_client(port, stop, counters)) for _ in range(streams)]
+    await asyncio.sleep(1.0 + streams / 200)
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    paths = ['/api/devices', '/api/system/status', '/api/devices/query?type=rgb_controller&limit=20']
+    started = time.perf_counter()
+    await asyncio.gather(*(poller(port, paths, deadline, latencies, errors) for _ in range(pollers)))
+    elapsed = time.perf_counter() - started
+    info = process_info(pid)
+
+    stop.set()
+    await asyncio.gather(*stream_tasks)
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(0.50),
+        'p99': percentile(0.99),
+        'errors': len(errors),
+        'events': counters['events'],
+        'stream_failed': counters['failed'],
+        'threads': info.get('Threads'),
+        'rss': info.get('VmRSS')
+    }
+
+
+def wait_port(port, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    pollers = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+    stream_counts = [int(value) for value in sys.argv[4].split(',')] if len(sys.argv) > 4 else [0, 200]
+
+    print(f"Устройств: {devices}, опрашивающих клиентов: {pollers}, {duration:.0f} с на прогон")
+    print(f"{'режим':>12} {'SSE':>5} {'запр/с':>8} {'p50, мс':>8} {'p99, мс':>8} {'ошибок':>7} "
+          f"{'событий':>8} {'потоков':>8} {'RSS':>10}")
+
+    port = 5800
+    for streams in stream_counts:
+        for runtime in ('threaded', 'asyncio', 'multiprocess'):
+            port += 1
+            server = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--serve', runtime, str(port), str(devices)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                if not wait_port(port):
+                    print(f"{runtime:>12}: сервер не запустился")
+                    continue
+                result = asyncio.run(load(port, server.pid, duration, pollers, streams))
+                print(f"{runtime:>12} {streams:>5} {result['rps']:>8.0f} {result['p50']:>8.2f} {result['p99']:>8.2f} "
+                      f"{result['errors']:>7} {result['events']:>8} {result['threads']:>8} {result['rss']:>10}")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main()
@@ -0,0 +1,130 @@
+# bench_ingest_logging.py - СКОРОСТЬ ОБРАБОТКИ СООБЩЕНИЙ С ЛОГИРОВАНИЕМ И БЕЗ
+"""Влияние логирования на обработку входящих MQTT сообщений.
+
+Пачки status/data сообщений прогоняются через process_ingest_batch (разбор и
+применение к хранилищу, без брокера) в трех режимах:
+
+  sync-info  - как раньше: три INFO записи на сообщение, синхронный вывод
+  queue      - очередь + QueueListener, записи по сообщениям на DEBUG (выключены)
+  queue-all  - очередь, DEBUG записи по сообщениям включены с выборкой по топикам
+
+Вывод логов направляется в os.devnull, чтобы измерять форматирование и запись,
+а не скорость терминала.
+
+Запуск: python benchmarks/bench_ingest_logging.py [сообщений]
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Хранилища телеметрии и журнала создают каталоги в текущей папке
+os.chdir(tempfile.mkdtemp(prefix='bench_logging_'))
+
+import web_server
+from log_pipeline import LogPipeline, TopicSampler
+
+
+def build_batches(count, devices=500, batch_size=256):
+    messages = []
+    for index in range(count):
+        device_id = f"ESP_{index % devices:06X}"
+        if index % 3:
+            payload = {'t': 'rgb_controller', 'ip': '192.168.1.10', 'rssi': -60, 'heap': 30000,
+                       'up': index, 'ver': '2.0', 'fw': 'AutoID_WiFiManager', 'rgb': '0,0,0'}
+            messages.append((device_id, 'status', json.dumps(payload).encode()))
+        else:
+            payload = {'sensor_value': index % 1024, 'voltage': 3.1, 'temperature': 24.5, 'timestamp': index}
+            messages.append((device_id, 'data', json.dumps(payload).encode()))
+
+    batches = []
+    for start in range(0, count, batch_size):
+        groups = {}
+        for device_id, message_type, payload in messages[start:start + batch_size]:
+            groups.setdefault(device_id, []).append((message_type, payload, time.time()))
+        batches.append(groups)
+    return batches
+
+
+def sync_info_logging(devnull):
+    """Старое поведение: INFO по каждому сообщению, обработчик пишет в вызывающем потоке"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    root.addHandler(handler)
+
+    logger = web_server.message_logger
+    original = web_server.decode_device_message
+
+    def decode_with_info(device_id, message_type, payload):
+        logger.info(f"🔍 MQTT сообщение: [devices/{device_id}/{message_type}] {payload.decode('utf-8')}")
+        logger.info(f"📨 Обработка: устройство={device_id}, тип={message_type}")
+        update = original(device_id, message_type, payload)
+        logger.info(f"✅ Обработано: {device_id}")
+        return update
+
+    web_server.decode_device_message = decode_with_info
+    return lambda: setattr(web_server, 'decode_device_message', original)
+
+
+def run(batches, count):
+    started = time.perf_counter()
+    for groups in batches:
+        web_server.process_ingest_batch(groups)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    batches = build_batches(count)
+    devnull = open(os.devnull, 'w')
+    logger = web_server.message_logger
+
+    web_server.log_pipeline.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+    for sampler in list(logger.filters):
+        logger.removeFilter(sampler)
+
+    # Прогрев: устройства создаются один раз
+    run(batches, count)
+    results = []
+
+    # 1. Синхронный INFO на каждое сообщение
+    logger.setLevel(logging.INFO)
+    restore = sync_info_logging(devnull)
+    results.append(('sync-info', run(batches, count)))
+    restore()
+
+    # 2. Очередь, записи по сообщениям выключены (значение по умолчанию)
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    pipeline = LogPipeline(handlers=[handler])
+    pipeline.start()
+    logger.setLevel(logging.INFO)
+    results.append(('queue', run(batches, count)))
+
+    # 3. Очередь, DEBUG по сообщениям с выборкой по топикам
+    sampler = TopicSampler(every=web_server.Config.LOG_TOPIC_SAMPLING, rate=web_server.Config.LOG_TOPIC_RATE)
+    logger.addFilter(sampler)
+    logger.setLevel(logging.DEBUG)
+    results.append(('queue-all', run(batches, count)))
+    pipeline.stop()
+
+    print(f"Сообщений: {count}")
+    baseline = results[0][1]
+    for name, rate in results:
+        print(f"{name:>10}: {rate:>9.0f} сообщ/с  (x{rate / baseline:.2f})")
+    print(f"Подавлено выборкой: {sampler.suppressed}, потеряно очередью: {pipeline.queue_handler.dropped}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# bench_journal.py - ПРОПУСКНАЯ СПОСОБНОСТЬ ЖУРНАЛА И ВРЕМЯ ВОССТАНОВЛЕНИЯ
+"""Нагрузка на DeviceJournal постоянным потоком изменений устройств.
+
+Поток-источник с заданной частотой регистрирует новые версии записей (как
+статусы от устройств), журнал фиксирует их группами с fsync. Для каждого
+интервала групповой фиксации выводится реальная частота, число fsync,
+средняя длительность fsync и объем записи, затем - время восстановления
+(снимок + доигрывание журнала) для того же парка.
+
+Запуск: python benchmarks/bench_journal.py [устройств] [сообщений_в_секунду] [секунд]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_manager import DeviceRecord, DeviceAttributes
+from device_journal import DeviceJournal
+
+
+def build_fleet(count):
+    now = time.time()
+    return {
+        f"ESP_{index:06X}": DeviceRecord(
+            device_id=f"ESP_{index:06X}",
+            device_type='rgb_controller',
+            ip_address=f"192.168.{index >> 8 & 0xFF}.{index & 0xFF}",
+            status='connected',
+            last_seen=now,
+            attributes=DeviceAttributes(rssi=-40 - index % 50, free_heap=30000 + index % 5000),
+            created_at=now
+        )
+        for index in range(count)
+    }
+
+
+def run(directory, fleet, rate, duration, sync_interval):
+    journal = DeviceJournal(
+        directory,
+        sync_interval=sync_interval,
+        snapshot_interval=3600,
+        state_provider=lambda: {'devices': {d: r.to_state() for d, r in fleet.items()}, 'events': [], 'counters': {}}
+    )
+    journal.snapshot()
+    journal.start()
+
+    device_ids = list(fleet)
+    sent = 0
+    stop = threading.Event()
+
+    def producer():
+        nonlocal sent
+        started = time.perf_counter()
+        while not stop.is_set():
+            # Догоняем расписание пачками по 1 мс
+            due = int((time.perf_counter() - started) * rate)
+            while sent < due:
+                device_id = device_ids[sent % len(device_ids)]
+                record = fleet[device_id].evolve(last_seen=time.time())
+                fleet[device_id] = record
+                journal.record_device(device_id, record)
+                sent += 1
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=producer)
+    started = time.perf_counter()
+    thread.start()
+    time.sleep(duration)
+    stop.set()
+    thread.join()
+    journal.stop()
+    elapsed = time.perf_counter() - started
+
+    stats = journal.get_stats()
+    return {
+        'rate': sent / elapsed,
+        'commits': stats['commit_count'],
+        'records': stats['records_written'],
+        'avg_sync_ms': stats['avg_sync_ms'],
+        'mb_per_s': stats['bytes_written'] / elapsed / 1024 / 1024
+    }
+
+
+def measure_recovery(directory, count):
+    started = time.perf_counter()
+    state = DeviceJournal(directory).load()
+    records = {device_id: DeviceRecord.from_state(data) for device_id, data in state['devices'].items()}
+    elapsed = (time.perf_counter() - started) * 1000
+    assert len(records) == count
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rate = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+
+    print(f"Устройств: {count}, целевая частота: {rate} сообщ/с, {duration:.0f} с на прогон")
+    print(f"{'интервал':>9} {'сообщ/с':>9} {'fsync':>7} {'записей':>9} {'fsync, мс':>10} {'МБ/с':>7}")
+
+    for sync_interval in (0.01, 0.05, 0.2):
+        directory = tempfile.mkdtemp(prefix='bench_journal_')
+        try:
+            result = run(directory, build_fleet(count), rate, duration, sync_interval)
+            print(f"{sync_interval:>9.2f} {result['rate']:>9.0f} {result['commits']:>7} {result['records']:>9} "
+                  f"{result['avg_sync_ms']:>10.3f} {result['mb_per_s']:>7.2f}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    # Восстановление: снимок всего парка + журнал без снимка при остановке
+    directory = tempfile.mkdtemp(prefix='bench_journal_')
+    try:
+        fleet = build_fleet(count)
+        journal = DeviceJournal(directory, state_provider=lambda: {
+            'devices': {d: r.to_state() for d, r in fleet.items()}, 'events': [], 'counters': {}})
+        journal.snapshot()
+        for device_id, record in fleet.items():
+            journal.record_device(device_id, record.evolve(last_seen=time.time()))
+        journal.commit()
+        print(f"Восстановление {count} устройств (снимок + журнал): {measure_recovery(directory, count):.1f} мс")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
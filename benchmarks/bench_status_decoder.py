@@ -0,0 +1,119 @@
+# bench_status_decoder.py - СКОРОСТЬ РАЗБОРА СТАТУСОВ: ВЛОЖЕННЫЕ get() VS СХЕМА
+"""Сравнение разбора status сообщений на payload из скетчей.
+
+  nested-get  - как раньше: decode('utf-8'), json.loads и 13 вложенных
+                data.get('short', data.get('long', default))
+  schema-json - json.loads из bytes + сгенерированная функция STATUS_SCHEMA
+                (с проверкой типов и учетом неизвестных ключей)
+  schema      - STATUS_SCHEMA.decode_bytes (orjson, если установлен)
+  binary      - тот же статус в бинарном формате (топик .../status/bin),
+                BINARY_LAYOUTS['status'].decode_bytes; размер - в колонке bin
+
+Payload соответствуют sendStatus() в NodeMCU_Sketch.txt (компактный статус и
+закомментированный полный вариант) и Wemos_Sketch.txt.
+
+Запуск: python benchmarks/bench_status_decoder.py [итераций]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payload_schema
+from payload_schema import STATUS_SCHEMA, BINARY_LAYOUTS
+
+PAYLOADS = {
+    # NodeMCU: текущий компактный статус
+    'nodemcu-short': {"id": "ESP_A1B2C3", "t": "rgb_controller", "ip": "192.168.1.57", "rssi": -63, "up": 1234567},
+    # NodeMCU: полный статус с длинными именами
+    'nodemcu-full': {
+        "device_id": "ESP_A1B2C3", "type": "rgb_controller", "ip": "192.168.1.57", "mac": "5C:CF:7F:A1:B2:C3",
+        "rssi": -63, "free_heap": 31240, "uptime": 1234567, "led_state": True, "version": "2.0",
+        "firmware": "AutoID_WiFiManager", "mqtt_broker": "192.168.1.10", "config_mode": False,
+        "action_button_pressed": False, "led_on": True, "rgb_color": "255,128,0", "available": True
+    },
+    # Wemos D1 Mini
+    'wemos': {
+        "device_id": "WEMOS_D4E5F6", "type": "sensor", "ip": "192.168.1.58", "mac": "BC:DD:C2:D4:E5:F6",
+        "rssi": -71, "free_heap": 28760, "uptime": 7654321, "board": "Wemos D1 Mini", "version": "3.0"
+    }
+}
+
+
+def nested_get(payload):
+    """Разбор в прежнем виде (ветка status в on_mqtt_message)"""
+    data = json.loads(payload.decode('utf-8'))
+    device_type = data.get('t', data.get('type', 'unknown'))
+    ip_address = data.get('ip', 'unknown')
+    attributes = {
+        'mac': data.get('mac', ''),
+        'rssi': data.get('rssi', 0),
+        'free_heap': data.get('heap', data.get('free_heap', 0)),
+        'uptime': data.get('up', data.get('uptime', 0)),
+        'version': data.get('ver', data.get('version', 'unknown')),
+        'firmware': data.get('fw', data.get('firmware', 'unknown')),
+        'config_mode': data.get('cfg', data.get('config_mode', False)),
+        'mqtt_broker': data.get('mqtt', data.get('mqtt_broker', '')),
+        'led_state': data.get('led_s', data.get('led_state', True)),
+        'action_button_pressed': data.get('btn', data.get('action_button_pressed', False)),
+        'led_on': data.get('led', data.get('led_on', True)),
+        'rgb_color': data.get('rgb', data.get('rgb_color', '0,0,0')),
+        'available': data.get('avail', data.get('available', True))
+    }
+    return device_type, ip_address, attributes
+
+
+def schema(payload):
+    attributes = STATUS_SCHEMA.decode_bytes(payload)
+    return attributes.pop('device_type'), attributes.pop('ip_address'), attributes
+
+
+def schema_json(payload):
+    attributes = STATUS_SCHEMA.decode(json.loads(payload))
+    return attributes.pop('device_type'), attributes.pop('ip_address'), attributes
+
+
+def binary(payload):
+    attributes = BINARY_LAYOUTS['status'].decode_bytes(payload)
+    return attributes.pop('device_type'), attributes.pop('ip_address'), attributes
+
+
+def measure(decoder, payload, iterations, repeats=5):
+    """Лучшее время из нескольких прогонов, мкс на сообщение"""
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            decoder(payload)
+        elapsed = (time.perf_counter() - started) / iterations * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"Итераций: {iterations}, парсер схемы: {'orjson' if payload_schema.orjson else 'json'}")
+    print(f"{'payload':>14} {'байт':>5} {'bin':>4} {'nested-get':>11} {'schema-json':>12} {'schema':>8} "
+          f"{'binary':>7} {'ускорение':>10}  (мкс)")
+    for name, data in PAYLOADS.items():
+        payload = json.dumps(data).encode('utf-8')
+        # Результаты должны совпадать, бинарный статус несет те же значения
+        assert nested_get(payload) == schema(payload) == schema_json(payload), name
+        packed = BINARY_LAYOUTS['status'].encode(STATUS_SCHEMA.decode(data))
+        assert binary(packed) == schema(payload), name
+
+        old = measure(nested_get, payload, iterations)
+        same_parser = measure(schema_json, payload, iterations)
+        new = measure(schema, payload, iterations)
+        compact = measure(binary, packed, iterations)
+        print(f"{name:>14} {len(payload):>5} {len(packed):>4} {old:>11.2f} {same_parser:>12.2f} {new:>8.2f} "
+              f"{compact:>7.2f} {old / new:>5.2f}x/{old / compact:.2f}x")
+
+    print(f"Неизвестные ключи: {STATUS_SCHEMA.unknown_keys}, неверные поля: {STATUS_SCHEMA.invalid_fields}")
+
+
+if __name__ == '__main__':
+    main()
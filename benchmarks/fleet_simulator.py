@@ -0,0 +1,521 @@
+# fleet_simulator.py - ВИРТУАЛЬНЫЙ ПАРК ESP УСТРОЙСТВ И MQTT БРОКЕР В ПРОЦЕССЕ
+"""Генератор нагрузки для сервера без железа и без mosquitto.
+
+InProcessBroker - заменитель брокера: подписки с масками + и #, у каждого
+подключения своя очередь и поток доставки (как сетевой поток paho).
+BrokerClient - подмножество paho.mqtt.client.Client, которое использует
+web_server (on_connect, on_message, subscribe, publish, is_connected).
+Fleet - N виртуальных устройств с топиками и payload из NodeMCU_Sketch.txt
+(rgb_controller, короткий статус, ESP_xxxxxx) и Wemos_Sketch.txt (sensor,
+полный статус, WEMOS_<mac>): периодические status, data и button, ответы на
+адресные и групповые команды, DISCOVER и подтверждения (devices/<id>/ack).
+"""
+import heapq
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from paho.mqtt.client import topic_matches_sub
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payload_schema
+
+
+class BrokerMessage:
+    """Сообщение в формате paho MQTTMessage (поля, которые читает сервер)"""
+
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'properties', 'timestamp')
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = None
+        self.timestamp = time.perf_counter()
+
+
+class BrokerSession:
+    """Подключение к брокеру: подписки и поток доставки входящих сообщений"""
+
+    def __init__(self, broker, client_id, on_message, max_queued):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_message = on_message
+        self.max_queued = max_queued
+        self.subscriptions = set()
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self.connected = False
+
+        self.delivered_count = 0
+        self.dropped_count = 0
+        # Задержки доставки (публикация -> вызов on_message), секунды; список - запись включена
+        self.lags = None
+
+    def subscribe(self, pattern):
+        self.subscriptions.add(pattern)
+        self.broker.invalidate_routes()
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        return self.broker.publish(topic, payload, qos, retain)
+
+    def deliver(self, message):
+        if self._queue.qsize() >= self.max_queued:
+            self.dropped_count += 1
+            return
+        self._queue.put(message)
+
+    def start(self):
+        self.connected = True
+        self._thread = threading.Thread(target=self._deliver_loop, name=f"broker-{self.client_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.connected = False
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def backlog(self):
+        return self._queue.qsize()
+
+    def _deliver_loop(self):
+        get = self._queue.get
+        perf_counter = time.perf_counter
+        while True:
+            message = get()
+            if message is None:
+                break
+            lags = self.lags
+            if lags is not None:
+                lags.append(perf_counter() - message.timestamp)
+            try:
+                self.on_message(message)
+            except Exception as e:
+                print(f"❌ Ошибка обработки сообщения {message.topic} в {self.client_id}: {e}", file=sys.stderr)
+            self.delivered_count += 1
+
+
+class InProcessBroker:
+    """MQTT брокер в памяти процесса (QoS 0, без retain-хранилища и сессий)"""
+
+    def __init__(self, max_queued=200000):
+        self.max_queued = max_queued
+        self._sessions = []
+        # Топик -> подключения с подходящей подпиской (сбрасывается при подписке)
+        self._routes = {}
+        self._lock = threading.Lock()
+        self.published_count = 0
+
+    def connect(self, client_id, on_message):
+        session = BrokerSession(self, client_id, on_message, self.max_queued)
+        with self._lock:
+            self._sessions.append(session)
+            self._routes = {}
+        session.start()
+        return session
+
+    def disconnect(self, session):
+        session.stop()
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            self._routes = {}
+
+    def invalidate_routes(self):
+        with self._lock:
+            self._routes = {}
+
+    def _match(self, topic):
+        routes = self._routes
+        sessions = routes.get(topic)
+        if sessions is None:
+            with self._lock:
+                sessions = tuple(session for session in self._sessions
+                                 if any(topic_matches_sub(pattern, topic) for pattern in session.subscriptions))
+                self._routes[topic] = sessions
+        return sessions
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif payload is None:
+            payload = b''
+        self.published_count += 1
+        sessions = self._match(topic)
+        if sessions:
+            message = BrokerMessage(topic, payload, qos, retain)
+            for session in sessions:
+                session.deliver(message)
+        return len(sessions)
+
+    def backlog(self):
+        return sum(session.backlog() for session in self._sessions)
+
+    def get_stats(self):
+        return {
+            'published_count': self.published_count,
+            'sessions': {
+                session.client_id: {
+                    'delivered_count': session.delivered_count,
+                    'dropped_count': session.dropped_count,
+                    'backlog': session.backlog()
+                } for session in self._sessions
+            }
+        }
+
+
+class _PublishInfo:
+    __slots__ = ('rc', 'mid')
+
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+
+class BrokerClient:
+    """Клиент InProcessBroker с интерфейсом paho Client (VERSION1 колбэки) для web_server"""
+
+    def __init__(self, broker, client_id='server'):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_message = None
+        self.session = None
+        self._mid = 0
+        self._disconnected = threading.Event()
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self.session = self.broker.connect(self.client_id, self._handle_message)
+        self._disconnected.clear()
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return 0
+
+    def _handle_message(self, message):
+        if self.on_message is not None:
+            self.on_message(self, None, message)
+
+    def subscribe(self, topic, qos=0):
+        self.session.subscribe(topic)
+        self._mid += 1
+        return 0, self._mid
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self._mid += 1
+        if self.session is None or not self.session.connected:
+            return _PublishInfo(4, self._mid)  # MQTT_ERR_NO_CONN
+        self.session.publish(topic, payload, qos, retain)
+        return _PublishInfo(0, self._mid)
+
+    def is_connected(self):
+        return self.session is not None and self.session.connected
+
+    def loop_forever(self):
+        self._disconnected.wait()
+
+    def disconnect(self):
+        if self.session is not None:
+            self.broker.disconnect(self.session)
+            self.session = None
+        self._disconnected.set()
+
+
+# ========== ВИРТУАЛЬНЫЕ УСТРОЙСТВА ==========
+
+class VirtualDevice:
+    """Состояние одного устройства и payload сообщений, как их формирует скетч"""
+
+    __slots__ = ('device_id', 'board', 'device_type', 'ip', 'mac', 'booted_at', 'rng',
+                 'red', 'green', 'blue', 'led_on', 'led_state', 'button_pressed', 'binary',
+                 'last_command_id', 'topic_base')
+
+    def __init__(self, index, board, rng, booted_at):
+        mac_bytes = bytes((0x5C, 0xCF, 0x7F, (index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF))
+        self.mac = ':'.join(f"{byte:02X}" for byte in mac_bytes)
+        compact = mac_bytes.hex().upper()
+        self.board = board
+        if board == 'wemos':
+            self.device_id = f"WEMOS_{compact}"
+            self.device_type = 'sensor'
+        else:
+            # NodeMCU: ESP_ + последние 3 байта MAC
+            self.device_id = f"ESP_{compact[6:]}"
+            self.device_type = 'rgb_controller'
+        self.ip = f"10.{(index >> 16) & 0xFF}.{(index >> 8) & 0xFF}.{index & 0xFF or 1}"
+        self.booted_at = booted_at
+        self.rng = rng
+        self.red = self.green = self.blue = 1
+        self.led_on = True
+        self.led_state = False
+        self.button_pressed = False
+        self.binary = False
+        self.last_command_id = ''
+        self.topic_base = f"devices/{self.device_id}/"
+
+    def millis(self):
+        return int((time.time() - self.booted_at) * 1000) & 0xFFFFFFFF
+
+    def status(self):
+        """(топик, payload) статуса: короткий JSON NodeMCU, бинарный после SET_FORMAT bin, полный Wemos"""
+        rssi = -45 - self.rng.randrange(40)
+        if self.board == 'wemos':
+            return self.topic_base + 'status', json.dumps({
+                'device_id': self.device_id, 'type': self.device_type, 'ip': self.ip, 'mac': self.mac,
+                'rssi': rssi, 'free_heap': 30000 + self.rng.randrange(8000), 'uptime': self.millis(),
+                'board': 'Wemos D1 Mini', 'version': '3.0'
+            }).encode()
+        if self.binary:
+            return self.topic_base + 'status/bin', payload_schema.encode_status({
+                'device_type': self.device_type, 'ip_address': self.ip, 'mac': self.mac, 'rssi': rssi,
+                'free_heap': 30000 + self.rng.randrange(8000), 'uptime': self.millis(),
+                'rgb_color': f"{self.red},{self.green},{self.blue}", 'led_state': self.led_state,
+                'led_on': self.led_on, 'action_button_pressed': self.button_pressed,
+                'available': not self.button_pressed, 'version': '2.0', 'firmware': 'AutoID_WiFiManager'
+            })
+        return self.topic_base + 'status', json.dumps({
+            'id': self.device_id, 't': self.device_type, 'ip': self.ip, 'rssi': rssi, 'up': self.millis()
+        }).encode()
+
+    def data(self):
+        sensor_value = self.rng.randrange(1024)
+        return self.topic_base + 'data', json.dumps({
+            'sensor_value': sensor_value,
+            'voltage': sensor_value * (3.3 / 1024.0),
+            'temperature': self.rng.randrange(200, 300) / 10.0,
+            'humidity': self.rng.randrange(400, 800) / 10.0,
+            'timestamp': self.millis()
+        }).encode()
+
+    def button(self):
+        """Нажатие кнопки действия: светодиод гаснет, сервер получает состояние кнопки"""
+        self.button_pressed = True
+        self.led_on = False
+        self.red = self.green = self.blue = 0
+        return self.topic_base + 'button', json.dumps({
+            'device_id': self.device_id, 'action_button_pressed': True, 'led_on': False, 'timestamp': self.millis()
+        }).encode()
+
+    def ack(self, command_id, ok=True, error=''):
+        if not command_id:
+            return None
+        payload = {'cid': command_id, 'ok': ok}
+        if not ok:
+            payload['err'] = error
+        return self.topic_base + 'ack', json.dumps(payload).encode()
+
+    def handle_command(self, payload):
+        """Выполнение команды как в callback() скетча: список исходящих (топик, payload)"""
+        try:
+            command_data = json.loads(payload)
+        except ValueError as e:
+            return [(self.topic_base + 'error', json.dumps({
+                'device_id': self.device_id, 'error': f"JSON parse error: {e}", 'timestamp': self.millis()
+            }).encode())]
+
+        command = command_data.get('command', '')
+        command_id = command_data.get('cid', '')
+
+        # Повтор выполненной команды (подтверждение потерялось) - только подтверждение
+        if command_id and command_id == self.last_command_id:
+            return [self.ack(command_id)]
+        self.last_command_id = command_id
+
+        out = []
+        if command in ('STATUS', 'RESET', 'GET_CONFIG', 'DISCOVER', 'MIX_COLORS'):
+            out.append(self.status())
+        elif command == 'RESTART':
+            out.append(self.status())
+            out.append(self.ack(command_id))
+            self.booted_at = time.time()
+            return [item for item in out if item]
+        elif command in ('LED_ON', 'LED_OFF'):
+            self.led_state = command == 'LED_ON'
+            out.append(self.status())
+        elif command == 'LED_TOGGLE':
+            self.led_state = not self.led_state
+            out.append(self.status())
+        elif command == 'SET_FORMAT':
+            # Бинарный статус есть только в прошивке NodeMCU
+            self.binary = self.board != 'wemos' and command_data.get('format', 'json') == 'bin'
+            out.append(self.status())
+        elif command == 'CONFIG_MODE':
+            return [item for item in (self.ack(command_id),) if item]
+        elif command == 'SET_COLOR':
+            self.red = int(command_data.get('red', 0))
+            self.green = int(command_data.get('green', 0))
+            self.blue = int(command_data.get('blue', 0))
+            self.led_on = self.red > 0 or self.green > 0 or self.blue > 0
+            out.append(self.status())
+        elif command == 'RESET_BUTTON':
+            self.button_pressed = False
+            out.append(self.status())
+        elif command:
+            out.append((self.topic_base + 'error', json.dumps({
+                'device_id': self.device_id, 'error': f"Unknown command: {command}", 'timestamp': self.millis()
+            }).encode()))
+            out.append(self.ack(command_id, False, f"Unknown command: {command}"))
+            return [item for item in out if item]
+
+        out.append(self.ack(command_id))
+        return [item for item in out if item]
+
+
+class Fleet:
+    """Парк виртуальных устройств на одном подключении к брокеру.
+
+    Периодические сообщения планируются по куче сроков с равномерно
+    распределенной начальной фазой (устройства включались не одновременно).
+    Интервал 0 отключает поток сообщений. Команды обрабатываются в потоке
+    доставки брокера, как callback() в loop() скетча.
+    """
+
+    STREAMS = ('status', 'data', 'button')
+
+    def __init__(self, broker, devices=100, wemos_share=0.3, status_interval=10.0, data_interval=10.0,
+                 button_interval=120.0, seed=1):
+        self.broker = broker
+        self.intervals = {'status': status_interval, 'data': data_interval, 'button': button_interval}
+        rng = random.Random(seed)
+        booted_at = time.time()
+        wemos_count = int(devices * wemos_share)
+        self.devices = [VirtualDevice(index, 'wemos' if index < wemos_count else 'nodemcu',
+                                      random.Random(rng.random()), booted_at - rng.randrange(3600))
+                        for index in range(devices)]
+        self.by_id = {device.device_id: device for device in self.devices}
+        self.rng = rng
+
+        self.session = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        self.sent_counts = dict.fromkeys(self.STREAMS + ('ack', 'error'), 0)
+        self.command_count = 0
+        self.discover_count = 0
+        # Время (time.time) последней отправки data по устройству - для сквозной задержки
+        self.data_sent_at = {}
+
+    def _publish(self, topic, payload, kind):
+        self.session.publish(topic, payload)
+        self.sent_counts[kind] += 1
+
+    def connect(self):
+        """Подключение к брокеру и подписки, как в reconnect() скетча (плюс devices/discovery)"""
+        self.session = self.broker.connect('fleet', self._on_message)
+        self.session.subscribe('devices/+/command')
+        self.session.subscribe('devices/group/+/command')
+        self.session.subscribe('devices/discovery')
+
+    def announce(self):
+        """Статус всех устройств (подключение парка после перезапуска сервера)"""
+        for device in self.devices:
+            self._publish(*device.status(), 'status')
+
+    def _on_message(self, message):
+        parts = message.topic.split('/')
+        if parts[1] == 'discovery':
+            self.discover_count += 1
+            targets = self.devices
+        elif parts[1] == 'group':
+            group = parts[2]
+            targets = [device for device in self.devices if group == 'all' or device.device_type == group]
+        else:
+            device = self.by_id.get(parts[1])
+            if device is None:
+                return
+            targets = (device,)
+
+        for device in targets:
+            self.command_count += 1
+            for topic, payload in device.handle_command(message.payload):
+                kind = topic[len(device.topic_base):].partition('/')[0]
+                self._publish(topic, payload, kind)
+
+    # ========== ПЕРИОДИЧЕСКИЕ СООБЩЕНИЯ ==========
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._schedule_loop, name="fleet-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _emit(self, device, stream):
+        """Одно периодическое сообщение устройства: False, если у устройства нет такого потока"""
+        if stream == 'status':
+            self._publish(*device.status(), 'status')
+        elif stream == 'data':
+            topic, payload = device.data()
+            self.data_sent_at[device.device_id] = time.time()
+            self._publish(topic, payload, 'data')
+        elif device.board != 'wemos':
+            # Кнопка действия есть только у RGB контроллеров NodeMCU
+            self._publish(*device.button(), 'button')
+        else:
+            return False
+        return True
+
+    def _schedule_loop(self):
+        now = time.monotonic()
+        heap = []
+        for index, device in enumerate(self.devices):
+            for stream, interval in self.intervals.items():
+                if interval > 0:
+                    heap.append((now + self.rng.random() * interval, index, stream))
+        heapq.heapify(heap)
+
+        while heap and not self._stop_event.is_set():
+            due, index, stream = heap[0]
+            now = time.monotonic()
+            if due > now:
+                self._stop_event.wait(min(due - now, 0.1))
+                continue
+            heapq.heapreplace(heap, (due + self.intervals[stream], index, stream))
+            self._emit(self.devices[index], stream)
+
+    def flood(self, seconds, mix=(('status', 3), ('data', 6), ('button', 1))):
+        """Публикация без пауз в течение seconds из текущего потока: число отправленных сообщений"""
+        streams = [stream for stream, weight in mix for _ in range(weight)]
+        devices = self.devices
+        position = 0
+        count = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            # Проверка времени раз в 256 сообщений
+            for _ in range(256):
+                count += self._emit(devices[position % len(devices)], streams[position % len(streams)])
+                position += 1
+        return count
+
+    def expected_rate(self):
+        """Сообщений в секунду от парка при заданных интервалах"""
+        rate = 0.0
+        nodemcu = sum(1 for device in self.devices if device.board != 'wemos')
+        for stream, interval in self.intervals.items():
+            if interval > 0:
+                rate += (nodemcu if stream == 'button' else len(self.devices)) / interval
+        return rate
+
+    def get_stats(self):
+        return {
+            'devices': len(self.devices),
+            'wemos': sum(1 for device in self.devices if device.board == 'wemos'),
+            'sent': dict(self.sent_counts),
+            'commands_received': self.command_count,
+            'discover_received': self.discover_count,
+            'intervals': dict(self.intervals)
+        }
@@ -0,0 +1,185 @@
+# change_feed.py - РАССЫЛКА ИЗМЕНЕНИЙ УСТРОЙСТВ ДЛЯ ПОТОКОВЫХ КЛИЕНТОВ (SSE)
+import asyncio
+import json
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event, payload):
+    """Кодирование события в формат Server-Sent Events"""
+    return f"event: {event}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class Subscription:
+    """Очередь готовых SSE сообщений одного клиента"""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        # Клиент не успевал читать - нужно отправить ему свежий снимок
+        self.resync = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.resync = True
+            # Освобождаем очередь: после снимка старые изменения не нужны
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def get(self, timeout):
+        """Следующее сообщение или None по таймауту"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """Подписка клиента asyncio: поток рассылки передает сообщения в цикл событий"""
+
+    def __init__(self, max_queue, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.resync = False
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Цикл событий уже закрыт - клиент будет отписан при завершении
+            pass
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.resync = True
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+
+    async def get(self, timeout):
+        """Следующее сообщение или None по таймауту"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeFeed:
+    """Объединение изменений устройств за короткое окно и рассылка подписчикам.
+
+    Изменения одного устройства за окно сливаются в одну запись, пакет кодируется
+    в JSON один раз и раздается всем клиентам. Нагрузка зависит от частоты изменений,
+    а не от количества открытых вкладок.
+    """
+
+    def __init__(self, window=0.25, max_queue=256, stats_provider=None):
+        self.window = window
+        self.max_queue = max_queue
+        self.stats_provider = stats_provider
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.sequence = 0
+        self.delivered_count = 0
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def publish(self, device_id, fields=None, removed=False):
+        """Регистрация изменения устройства (fields - измененные поля в формате /api/devices)"""
+        if not self._subscribers:
+            return
+
+        with self._lock:
+            change = self._pending.get(device_id)
+            if removed:
+                self._pending[device_id] = {'id': device_id, 'op': 'remove'}
+            elif change is None or change['op'] == 'remove':
+                self._pending[device_id] = {'id': device_id, 'op': 'upsert', 'device': dict(fields)}
+            else:
+                change['device'].update(fields)
+
+    def subscribe(self, subscription=None):
+        """Новый подписчик (subscription - готовая подписка, например AsyncSubscription)"""
+        if subscription is None:
+            subscription = Subscription(self.max_queue)
+        with self._subscribers_lock:
+            self._subscribers = self._subscribers | {subscription}
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._subscribers_lock:
+            self._subscribers = self._subscribers - {subscription}
+
+    def flush(self):
+        """Отправка накопленных изменений всем подписчикам"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            changes = list(self._pending.values())
+            self._pending = {}
+
+        self.sequence += 1
+        payload = {
+            'sequence': self.sequence,
+            'changes': changes,
+            'timestamp': time.time()
+        }
+        if self.stats_provider is not None:
+            payload['stats'] = self.stats_provider()
+
+        message = format_sse('delta', json.dumps(payload))
+        for subscription in self._subscribers:
+            subscription.deliver(message)
+            self.delivered_count += 1
+
+        return len(changes)
+
+    # ========== ФОНОВАЯ РАССЫЛКА ==========
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="change-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка рассылки изменений: {e}")
+
+    def get_stats(self):
+        return {
+            'subscribers': len(self._subscribers),
+            'pending_changes': len(self._pending),
+            'window': self.window,
+            'sequence': self.sequence,
+            'delivered_count': self.delivered_count
+        }
@@ -0,0 +1,164 @@
+# color_ops.py - ГРУППОВЫЕ ОПЕРАЦИИ С ЦВЕТАМИ RGB КОНТРОЛЛЕРОВ
+import random
+import threading
+
+# Векторные операции, если установлен numpy (pip install numpy).
+# Без него используются списки кортежей с тем же результатом.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def parse_rgb(value):
+    """Разбор строки "r,g,b" в кортеж (0, 0, 0 при ошибке)"""
+    try:
+        red, green, blue = (max(0, min(255, int(part))) for part in value.split(','))
+        return red, green, blue
+    except (ValueError, AttributeError):
+        return 0, 0, 0
+
+
+class ColorTable:
+    """Упакованная таблица текущих цветов: строка slot - (r, g, b) устройства.
+
+    С numpy цвета лежат в массиве N x 3 uint8, без него - в bytearray по 3 байта
+    на устройство. Строка разбирается один раз при изменении цвета, а не при
+    каждой групповой операции. Удаленное устройство замещается последним.
+    """
+
+    def __init__(self, capacity=256):
+        self._slots = {}
+        self._ids = []
+        self._lock = threading.Lock()
+        if np is not None:
+            self._colors = np.zeros((capacity, 3), dtype=np.uint8)
+        else:
+            self._colors = bytearray(capacity * 3)
+
+    @property
+    def backend(self):
+        return 'numpy' if np is not None else 'python'
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, device_id):
+        return device_id in self._slots
+
+    def _grow(self):
+        if np is not None:
+            colors = np.zeros((len(self._colors) * 2, 3), dtype=np.uint8)
+            colors[:len(self._colors)] = self._colors
+            self._colors = colors
+        else:
+            self._colors.extend(bytes(len(self._colors)))
+
+    def set(self, device_id, color):
+        """Запись цвета устройства (r, g, b)"""
+        with self._lock:
+            slot = self._slots.get(device_id)
+            if slot is None:
+                slot = len(self._ids)
+                if slot >= len(self._colors) // (1 if np is not None else 3):
+                    self._grow()
+                self._slots[device_id] = slot
+                self._ids.append(device_id)
+
+            if np is not None:
+                self._colors[slot] = color
+            else:
+                self._colors[slot * 3:slot * 3 + 3] = bytes(color)
+
+    def discard(self, device_id):
+        with self._lock:
+            slot = self._slots.pop(device_id, None)
+            if slot is None:
+                return
+
+            last = len(self._ids) - 1
+            last_id = self._ids.pop()
+            if slot != last:
+                self._ids[slot] = last_id
+                self._slots[last_id] = slot
+                if np is not None:
+                    self._colors[slot] = self._colors[last]
+                else:
+                    self._colors[slot * 3:slot * 3 + 3] = self._colors[last * 3:last * 3 + 3]
+
+    def gather(self, device_ids):
+        """Цвета указанных устройств в их порядке (неизвестные - черный)"""
+        with self._lock:
+            slots = [self._slots.get(device_id, -1) for device_id in device_ids]
+            if np is not None:
+                index = np.array(slots, dtype=np.intp)
+                colors = self._colors[np.maximum(index, 0)]
+                colors[index < 0] = 0
+                return colors
+
+            data = self._colors
+            return [tuple(data[slot * 3:slot * 3 + 3]) if slot >= 0 else (0, 0, 0) for slot in slots]
+
+
+# ========== ОПЕРАЦИИ (ВСЕ ЦВЕТА ЗА ОДИН ШАГ) ==========
+
+def solid(count, color):
+    """Один цвет для всех устройств"""
+    if np is not None:
+        return np.tile(np.array(color, dtype=np.uint8), (count, 1))
+    return [tuple(color)] * count
+
+
+def rotate(colors, shift=1):
+    """Циклический сдвиг цветов между устройствами"""
+    count = len(colors)
+    if count == 0:
+        return colors
+    shift %= count
+    if np is not None:
+        return np.roll(colors, shift, axis=0)
+    return colors[count - shift:] + colors[:count - shift]
+
+
+def gradient(count, start, end):
+    """Линейный градиент от start до end по порядку устройств"""
+    if np is not None:
+        steps = np.linspace(0.0, 1.0, count)[:, None] if count > 1 else np.zeros((count, 1))
+        start = np.array(start, dtype=np.float64)
+        end = np.array(end, dtype=np.float64)
+        return np.rint(start + (end - start) * steps).astype(np.uint8)
+
+    colors = []
+    for i in range(count):
+        t = i / (count - 1) if count > 1 else 0.0
+        colors.append(tuple(int(round(a + (b - a) * t)) for a, b in zip(start, end)))
+    return colors
+
+
+def scale_brightness(colors, factor):
+    """Умножение яркости (с ограничением 0..255)"""
+    if np is not None:
+        return np.clip(np.rint(colors.astype(np.float64) * factor), 0, 255).astype(np.uint8)
+    return [tuple(max(0, min(255, int(round(c * factor)))) for c in color) for color in colors]
+
+
+def random_palette(count, palette=None, seed=None):
+    """Случайные цвета из палитры (или полностью случайные, если палитра не задана)"""
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        if palette:
+            palette = np.array(palette, dtype=np.uint8)
+            return palette[rng.integers(0, len(palette), count)]
+        return rng.integers(0, 256, (count, 3), dtype=np.uint8)
+
+    rng = random.Random(seed)
+    if palette:
+        return [tuple(rng.choice(palette)) for _ in range(count)]
+    return [(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(count)]
+
+
+def to_rows(colors):
+    """Цвета как список [r, g, b] с обычными int (для публикации)"""
+    if np is not None and isinstance(colors, np.ndarray):
+        return colors.tolist()
+    return [list(color) for color in colors]
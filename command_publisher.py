@@ -0,0 +1,440 @@
+# command_publisher.py - ПАКЕТНАЯ ОТПРАВКА КОМАНД УСТРОЙСТВАМ ЧЕРЕЗ MQTT
+import json
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Статусы результата адресной команды, означающие, что команда принята к отправке
+ACCEPTED_STATUSES = frozenset(('sent', 'queued'))
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, не более burst накопленных"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, count=1):
+        """Взять токены без ожидания"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= count:
+                self.tokens -= count
+                return True
+            return False
+
+    def acquire(self, count=1):
+        """Взять токены, при необходимости дождавшись их накопления"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def wait_time(self, count=1):
+        """Секунды до накопления count токенов (0 - доступны сейчас)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (count - self.tokens) / self.rate)
+
+
+class OutboundCommand:
+    """Команда в очереди устройства"""
+
+    __slots__ = ('command_id', 'device_id', 'command', 'topic', 'payload', 'qos', 'update', 'queued_at')
+
+    def __init__(self, command_id, device_id, command, topic, payload, qos, update):
+        self.command_id = command_id
+        self.device_id = device_id
+        self.command = command
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.update = update
+        self.queued_at = time.monotonic()
+
+
+class OutboundScheduler:
+    """Планировщик исходящих адресных команд: очередь и ограничение скорости на устройство.
+
+    Команда уходит сразу, если у устройства нет очереди и есть токен; иначе
+    встает в очередь устройства. Для команд из coalesce (идемпотентные, например
+    SET_COLOR) в очереди остается только последняя: новая заменяет ожидающую и
+    встает в конец. Поток отправки обходит устройства с очередями по кругу и за
+    проход берет не больше одной команды на устройство, поэтому одно "шумное"
+    устройство не задерживает остальные. Переполнение очереди устройства -
+    отказ новой команды (dropped).
+
+    dispatch(command) -> bool публикует команду (вызывается без блокировки планировщика).
+    """
+
+    def __init__(self, dispatch, rate=10, burst=5, max_queue=32, coalesce=('SET_COLOR',)):
+        self.dispatch = dispatch
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.coalesce = frozenset(coalesce)
+
+        self._buckets = {}
+        self._queues = {}
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.backlog = 0
+        self.max_backlog = 0
+        self.submitted_count = 0
+        self.immediate_count = 0
+        self.queued_count = 0
+        self.dispatched_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+        self.failed_count = 0
+        self.wait_total = 0.0
+
+    def _bucket(self, device_id):
+        bucket = self._buckets.get(device_id)
+        if bucket is None:
+            bucket = self._buckets[device_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def submit(self, command):
+        """Постановка команды: 'sent', 'queued', 'dropped' или 'error' (не удалось опубликовать сразу)"""
+        device_id = command.device_id
+        with self._lock:
+            self.submitted_count += 1
+            queue = self._queues.get(device_id)
+
+            if queue is None and self._bucket(device_id).try_acquire():
+                self.immediate_count += 1
+                immediate = True
+            else:
+                immediate = False
+                if queue is None:
+                    queue = self._queues[device_id] = deque()
+                    self._ready.append(device_id)
+
+                if command.command in self.coalesce:
+                    for queued in queue:
+                        if queued.command == command.command:
+                            # Ожидающая команда устарела: уходит только последняя
+                            queue.remove(queued)
+                            self.backlog -= 1
+                            self.coalesced_count += 1
+                            break
+
+                if len(queue) >= self.max_queue:
+                    self.dropped_count += 1
+                    return 'dropped'
+
+                queue.append(command)
+                self.queued_count += 1
+                self.backlog += 1
+                if self.backlog > self.max_backlog:
+                    self.max_backlog = self.backlog
+
+        if immediate:
+            if self.dispatch(command):
+                return 'sent'
+            self.failed_count += 1
+            return 'error'
+
+        self._wakeup.set()
+        return 'queued'
+
+    def pop_ready(self):
+        """Команды, которые можно отправить сейчас (по одной на устройство), и ожидание до следующей"""
+        ready = []
+        wait = None
+        with self._lock:
+            for _ in range(len(self._ready)):
+                device_id = self._ready.popleft()
+                queue = self._queues.get(device_id)
+                if not queue:
+                    self._queues.pop(device_id, None)
+                    continue
+
+                bucket = self._buckets[device_id]
+                if bucket.try_acquire():
+                    ready.append(queue.popleft())
+                    self.backlog -= 1
+                    if not queue:
+                        del self._queues[device_id]
+                        continue
+                else:
+                    delay = bucket.wait_time()
+                    wait = delay if wait is None else min(wait, delay)
+                self._ready.append(device_id)
+
+            if ready and self._ready:
+                # Отправленные устройства получат токен не раньше следующего прохода
+                wait = 0.0 if wait is None else wait
+        return ready, wait
+
+    def depth(self, device_id):
+        with self._lock:
+            queue = self._queues.get(device_id)
+            return len(queue) if queue else 0
+
+    # ========== ПОТОК ОТПРАВКИ ==========
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._dispatch_loop, name="command-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _dispatch_loop(self):
+        while not self._stop_event.is_set():
+            ready, wait = self.pop_ready()
+
+            now = time.monotonic()
+            for command in ready:
+                self.wait_total += now - command.queued_at
+                try:
+                    if self.dispatch(command):
+                        self.dispatched_count += 1
+                    else:
+                        self.failed_count += 1
+                except Exception as e:
+                    self.failed_count += 1
+                    logger.error(f"❌ Ошибка отправки команды из очереди {command.device_id}: {e}")
+
+            if not ready:
+                self._wakeup.wait(1.0 if wait is None else wait)
+                self._wakeup.clear()
+
+    # ========== СТАТИСТИКА ==========
+
+    def get_backlog(self, limit=20):
+        """Устройства с самыми длинными очередями: [(device_id, глубина, команды)]"""
+        with self._lock:
+            deepest = sorted(self._queues.items(), key=lambda item: len(item[1]), reverse=True)[:limit]
+            return [(device_id, len(queue), [command.command for command in queue]) for device_id, queue in deepest]
+
+    def get_stats(self):
+        return {
+            'backlog': self.backlog,
+            'max_backlog': self.max_backlog,
+            'devices_waiting': len(self._queues),
+            'submitted_count': self.submitted_count,
+            'immediate_count': self.immediate_count,
+            'queued_count': self.queued_count,
+            'dispatched_count': self.dispatched_count,
+            'coalesced_count': self.coalesced_count,
+            'dropped_count': self.dropped_count,
+            'failed_count': self.failed_count,
+            'avg_queue_wait_ms': round(self.wait_total / self.dispatched_count * 1000, 3) if self.dispatched_count else 0.0,
+            'device_rate': self.rate,
+            'device_burst': self.burst,
+            'max_queue': self.max_queue,
+            'coalesce': sorted(self.coalesce)
+        }
+
+
+class CommandPublisher:
+    """Отправка команд пачками: общие payload кодируются один раз, публикация ограничена по скорости.
+
+    client_getter возвращает текущий paho клиент (он создается при запуске сервера).
+    Каждая публикация получает id команды (поле cid); адресные команды ставятся
+    в ожидание подтверждения в tracker (CommandTracker), если он задан.
+    device_rate > 0 включает OutboundScheduler: адресные команды проходят через
+    очереди устройств с ограничением скорости на устройство. publish_latency -
+    гистограмма (observe) длительности вызова publish().
+    """
+
+    def __init__(self, client_getter, topic_prefix, rate=5000, burst=1000, default_qos=0, tracker=None,
+                 device_rate=0, device_burst=5, device_queue=32, coalesce=('SET_COLOR',), publish_latency=None):
+        self.client_getter = client_getter
+        self.topic_prefix = topic_prefix
+        self.default_qos = default_qos
+        self.bucket = TokenBucket(rate, burst)
+        self.tracker = tracker
+        self.publish_latency = publish_latency
+        self.scheduler = OutboundScheduler(self._dispatch, device_rate, device_burst, device_queue,
+                                           coalesce) if device_rate else None
+
+        self.published_count = 0
+        self.error_count = 0
+        self.encoded_count = 0
+
+    def command_topic(self, device_id):
+        return f"{self.topic_prefix}/{device_id}/command"
+
+    def group_topic(self, group):
+        return f"{self.topic_prefix}/group/{group}/command"
+
+    def encode(self, command, args=None, source='web', timestamp=None):
+        """JSON payload команды в формате, который понимают скетчи ESP"""
+        self.encoded_count += 1
+        payload = {'command': command}
+        if args:
+            payload.update(args)
+        payload['timestamp'] = timestamp if timestamp is not None else time.time()
+        payload['source'] = source
+        return json.dumps(payload)
+
+    @staticmethod
+    def with_id(payload, command_id):
+        """Добавление cid в закодированный payload (общая часть кодируется один раз на пачку)"""
+        return f'{payload[:-1]}, "cid": "{command_id}"}}'
+
+    def next_id(self):
+        return self.tracker.next_id() if self.tracker is not None else f"{time.time_ns():x}"
+
+    def _publish(self, client, topic, payload, qos):
+        self.bucket.acquire()
+        started = time.perf_counter()
+        info = client.publish(topic, payload, qos=qos)
+        if self.publish_latency is not None:
+            self.publish_latency.observe(time.perf_counter() - started)
+        if info.rc != 0:
+            self.error_count += 1
+            return {'status': 'error', 'mid': info.mid, 'error': f"MQTT rc={info.rc}"}
+        self.published_count += 1
+        return {'status': 'sent', 'mid': info.mid}
+
+    def _dispatch(self, command):
+        """Публикация адресной команды и ожидание подтверждения (сразу или из очереди планировщика)"""
+        client = self.client_getter()
+        if client is None:
+            self.error_count += 1
+            return False
+
+        # В ожидание до публикации: подтверждение может прийти раньше, чем вернется publish()
+        if self.tracker is not None:
+            self.tracker.track(command.command_id, command.device_id, command.command, command.topic,
+                               command.payload, command.qos, command.update)
+        try:
+            sent = self._publish(client, command.topic, command.payload, command.qos)['status'] == 'sent'
+        except Exception as e:
+            self.error_count += 1
+            logger.error(f"❌ Ошибка публикации команды {command.command} для {command.device_id}: {e}")
+            sent = False
+        if not sent and self.tracker is not None:
+            self.tracker.discard(command.command_id)
+        return sent
+
+    def start(self):
+        """Запуск потока отправки очередей устройств"""
+        if self.scheduler is not None:
+            self.scheduler.start()
+
+    def republish(self, topic, payload, qos):
+        """Повторная публикация команды без подтверждения (вызывается из CommandTracker)"""
+        client = self.client_getter()
+        if client is None:
+            return False
+        try:
+            return self._publish(client, topic, payload, qos)['status'] == 'sent'
+        except Exception as e:
+            self.error_count += 1
+            logger.error(f"❌ Ошибка повторной публикации в {topic}: {e}")
+            return False
+
+    def publish_many(self, items, qos=None, source='bulk', updates=None):
+        """Отправка списка команд [{device_id, command, args}], результат для каждого устройства.
+
+        Одинаковые команды с одинаковыми аргументами кодируются один раз на вызов.
+        updates - список той же длины: изменения записи устройства (или None),
+        которые применяются, когда устройство подтвердит команду.
+        """
+        client = self.client_getter()
+        qos = self.default_qos if qos is None else qos
+        timestamp = time.time()
+        encoded = {}
+        results = []
+
+        for position, item in enumerate(items):
+            device_id = item['device_id']
+            command = item['command']
+            args = item.get('args') or {}
+            result = {'device_id': device_id, 'command': command}
+
+            if client is None:
+                result.update(status='error', error='MQTT client not started')
+                results.append(result)
+                continue
+
+            try:
+                key = (command, tuple(sorted(args.items())))
+                payload = encoded.get(key)
+                if payload is None:
+                    payload = encoded[key] = self.encode(command, args, source, timestamp)
+            except TypeError:
+                # Нехэшируемые аргументы - кодируем отдельно
+                payload = self.encode(command, args, source, timestamp)
+
+            command_id = result['command_id'] = self.next_id()
+            outbound = OutboundCommand(command_id, device_id, command, self.command_topic(device_id),
+                                       self.with_id(payload, command_id), qos,
+                                       updates[position] if updates is not None else None)
+            if self.scheduler is not None:
+                status = self.scheduler.submit(outbound)
+            else:
+                status = 'sent' if self._dispatch(outbound) else 'error'
+
+            result['status'] = status
+            if status == 'dropped':
+                result['error'] = 'Device command queue is full'
+            elif status == 'error':
+                result['error'] = 'MQTT publish failed'
+            results.append(result)
+
+        return results
+
+    def publish_group(self, group, command, args=None, qos=None, source='bulk'):
+        """Одна публикация в групповой топик вместо N адресных (без ожидания подтверждений)"""
+        client = self.client_getter()
+        qos = self.default_qos if qos is None else qos
+        result = {'group': group, 'command': command}
+
+        if client is None:
+            result.update(status='error', error='MQTT client not started')
+            return result
+
+        try:
+            command_id = result['command_id'] = self.next_id()
+            payload = self.with_id(self.encode(command, args, source), command_id)
+            result.update(self._publish(client, self.group_topic(group), payload, qos))
+        except Exception as e:
+            self.error_count += 1
+            result.update(status='error', error=str(e))
+        return result
+
+    def get_stats(self):
+        return {
+            'published_count': self.published_count,
+            'error_count': self.error_count,
+            'encoded_count': self.encoded_count,
+            'rate_limit': self.bucket.rate,
+            'burst': self.bucket.burst,
+            'default_qos': self.default_qos,
+            'scheduler': self.scheduler.get_stats() if self.scheduler is not None else None
+        }
@@ -0,0 +1,404 @@
+# command_tracker.py - ПОДТВЕРЖДЕНИЕ КОМАНД УСТРОЙСТВАМИ, ПОВТОРЫ И ГИСТОГРАММЫ ЗАДЕРЖЕК
+import bisect
+import heapq
+import itertools
+import logging
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными границами корзин (в секундах)"""
+
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Верхняя граница корзины, в которую попадает доля fraction наблюдений (последняя - максимум)"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'max_ms': round(self.max * 1000, 3),
+            'p50_ms': round(self.percentile(0.50) * 1000, 3),
+            'p90_ms': round(self.percentile(0.90) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            # [граница в мс, число наблюдений]; последняя корзина - все, что больше
+            'buckets': [[bound * 1000 if bound is not None else None, count] for bound, count in zip(self.BOUNDS + (None,), self.counts)]
+        }
+
+
+class DeviceCommandStats:
+    """Счетчики команд одного устройства"""
+
+    __slots__ = ('sent', 'acked', 'rejected', 'failed', 'unconfirmed', 'retries', 'latency')
+
+    def __init__(self):
+        self.sent = 0
+        self.acked = 0
+        self.rejected = 0
+        self.failed = 0
+        self.unconfirmed = 0
+        self.retries = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        finished = self.acked + self.rejected + self.failed
+        return {
+            'sent': self.sent,
+            'acked': self.acked,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'unconfirmed': self.unconfirmed,
+            'retries': self.retries,
+            'failure_rate': round(self.failed / finished, 4) if finished else 0.0,
+            'latency': self.latency.to_dict()
+        }
+
+
+class PendingCommand:
+    """Команда, ожидающая подтверждения"""
+
+    __slots__ = ('command_id', 'device_id', 'command', 'topic', 'payload', 'qos', 'update',
+                 'sent_at', 'attempts', 'deadline', 'sequence', 'replaced')
+
+    def __init__(self, command_id, device_id, command, topic, payload, qos, update, sent_at, deadline, sequence):
+        self.command_id = command_id
+        self.device_id = device_id
+        self.command = command
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        # Локальные изменения записи устройства, которые применяются после подтверждения
+        self.update = update
+        self.sent_at = sent_at
+        self.attempts = 1
+        self.deadline = deadline
+        # Порядок постановки: подтверждение более старой команды не откатывает более новую
+        self.sequence = sequence
+        # Замененная этой командой ожидающая команда (возвращается, если публикация не удалась)
+        self.replaced = None
+
+
+class CommandTracker:
+    """Таблица команд в пути: подтверждения по id, повторы с экспоненциальной задержкой.
+
+    Устройство отвечает на команду с полем cid сообщением devices/<id>/ack
+    {"cid": ..., "ok": true | false, "err": ...}. Пока подтверждения нет,
+    команда публикуется повторно с тем же cid (устройство не выполняет ее
+    второй раз) через timeout, timeout * backoff, ... но не реже max_timeout.
+    После max_retries повторов команда считается недоставленной.
+
+    Прошивки без подтверждений (старые NodeMCU, Wemos) не распознают повтор и
+    выполнили бы команду еще раз. Поэтому устройству, от которого еще не было ни
+    одного подтверждения, повторяются только команды из retry_always
+    (идемпотентные), а команда без подтверждения считается неподтвержденной
+    (unconfirmed), а не недоставленной.
+
+    Для команд из supersede (SET_COLOR и другие, где важно только последнее
+    значение) новая команда снимает с ожидания прежнюю команду того же вида для
+    того же устройства: устаревшая команда больше не повторяется, а ее позднее
+    подтверждение не считается. Обновление записи применяется, только если оно
+    новее последнего примененного для этого устройства и вида команды.
+
+    Задержка считается от первой публикации до подтверждения, то есть включает
+    повторы. publish(topic, payload, qos) -> bool выполняет повторную публикацию.
+    """
+
+    def __init__(self, publish, timeout=2.0, max_retries=3, backoff=2.0, max_timeout=30.0,
+                 max_pending=10000, on_failed=None, supersede=(), retry_always=()):
+        self.publish = publish
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_timeout = max_timeout
+        self.max_pending = max_pending
+        # on_failed(pending) вызывается из потока повторов без блокировки таблицы
+        self.on_failed = on_failed
+        self.supersede = frozenset(supersede)
+        self.retry_always = frozenset(retry_always)
+
+        # Префикс отличает id этого запуска сервера от подтверждений команд прошлого запуска
+        self._prefix = secrets.token_hex(2)
+        self._ids = itertools.count(1)
+        self._sequence = itertools.count(1)
+        self._pending = {}
+        self._latest = {}   # (device_id, команда) -> id последней команды из supersede
+        self._applied = {}  # (device_id, команда) -> sequence последнего примененного обновления
+        self._acking = set()  # устройства, приславшие хотя бы одно подтверждение
+        self._heap = []
+        self._devices = {}
+        self._fleet = LatencyHistogram()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.tracked_count = 0
+        self.acked_count = 0
+        self.rejected_count = 0
+        self.failed_count = 0
+        self.unconfirmed_count = 0
+        self.retry_count = 0
+        self.unmatched_count = 0
+        self.overflow_count = 0
+        self.superseded_count = 0
+        self.stale_count = 0
+
+    def next_id(self):
+        """Новый id команды (короткий - payload читает ESP8266)"""
+        return f"{self._prefix}{next(self._ids):x}"
+
+    def _device_stats(self, device_id):
+        stats = self._devices.get(device_id)
+        if stats is None:
+            stats = self._devices[device_id] = DeviceCommandStats()
+        return stats
+
+    def track(self, command_id, device_id, command, topic, payload, qos=0, update=None):
+        """Постановка команды в ожидание подтверждения (до публикации). False - таблица переполнена"""
+        now = time.monotonic()
+        with self._lock:
+            stats = self._device_stats(device_id)
+            stats.sent += 1
+            if len(self._pending) >= self.max_pending:
+                self.overflow_count += 1
+                return False
+            previous = None
+            if command in self.supersede:
+                previous = self._pending.pop(self._latest.get((device_id, command)), None)
+                if previous is not None:
+                    # Запись в куче удалится при всплытии
+                    previous.replaced = None
+                    self.superseded_count += 1
+                self._latest[(device_id, command)] = command_id
+            deadline = now + self.timeout
+            pending = self._pending[command_id] = PendingCommand(command_id, device_id, command, topic, payload,
+                                                                 qos, update, now, deadline, next(self._sequence))
+            pending.replaced = previous
+            heapq.heappush(self._heap, (deadline, command_id))
+            self.tracked_count += 1
+            earliest = self._heap[0][1] == command_id
+        if earliest:
+            # Поток повторов спит до прежнего ближайшего дедлайна
+            self._wakeup.set()
+        return True
+
+    def discard(self, command_id):
+        """Снятие команды, которую не удалось опубликовать (запись в куче удалится при всплытии).
+
+        Замененная ею команда возвращается в ожидание: она по-прежнему последняя
+        доставленная и должна повторяться до подтверждения.
+        """
+        with self._lock:
+            pending = self._pending.pop(command_id, None)
+            if pending is None:
+                return
+            self._devices[pending.device_id].sent -= 1
+            self.tracked_count -= 1
+
+            previous = pending.replaced
+            key = (pending.device_id, pending.command)
+            if previous is not None and self._latest.get(key) == command_id:
+                pending.replaced = None
+                self._latest[key] = previous.command_id
+                self._pending[previous.command_id] = previous
+                self.superseded_count -= 1
+                # Прежняя запись в куче могла уже всплыть и пропасть
+                heapq.heappush(self._heap, (previous.deadline, previous.command_id))
+
+    def acknowledge(self, device_id, command_id, ok=True):
+        """Подтверждение от устройства: завершенная команда или None (повтор, чужой, старый или замененный id).
+
+        update у возвращенной команды сбрасывается в None, если для этого устройства
+        уже применено обновление более новой команды того же вида.
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Любое подтверждение (даже на команду прошлого запуска) значит, что прошивка их поддерживает
+            self._acking.add(device_id)
+            pending = self._pending.get(command_id)
+            if pending is None or pending.device_id != device_id:
+                self.unmatched_count += 1
+                return None
+            del self._pending[command_id]
+
+            stats = self._device_stats(device_id)
+            latency = now - pending.sent_at
+            stats.latency.observe(latency)
+            self._fleet.observe(latency)
+            if ok:
+                stats.acked += 1
+                self.acked_count += 1
+                if pending.update:
+                    key = (device_id, pending.command)
+                    if self._applied.get(key, 0) > pending.sequence:
+                        pending.update = None
+                        self.stale_count += 1
+                    else:
+                        self._applied[key] = pending.sequence
+            else:
+                stats.rejected += 1
+                self.rejected_count += 1
+        return pending
+
+    def pop_expired(self, now=None):
+        """Команды с истекшим ожиданием: (повторить, недоставленные). Повторяемые получают новый дедлайн"""
+        if now is None:
+            now = time.monotonic()
+
+        retry = []
+        failed = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                deadline, command_id = heapq.heappop(heap)
+                pending = self._pending.get(command_id)
+                if pending is None or pending.deadline != deadline:
+                    # Подтверждена или переназначена
+                    continue
+
+                stats = self._device_stats(pending.device_id)
+                acking = pending.device_id in self._acking
+                if pending.attempts > self.max_retries or not (acking or pending.command in self.retry_always):
+                    del self._pending[command_id]
+                    if acking:
+                        stats.failed += 1
+                        self.failed_count += 1
+                        failed.append(pending)
+                    else:
+                        stats.unconfirmed += 1
+                        self.unconfirmed_count += 1
+                    continue
+
+                pending.deadline = now + min(self.max_timeout, self.timeout * self.backoff ** pending.attempts)
+                pending.attempts += 1
+                stats.retries += 1
+                self.retry_count += 1
+                heapq.heappush(heap, (pending.deadline, command_id))
+                retry.append(pending)
+
+        return retry, failed
+
+    def has_acked(self, device_id):
+        """Устройство хотя бы раз подтверждало команду (прошивка с подтверждениями)"""
+        return device_id in self._acking
+
+    def next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._pending)
+
+    # ========== ФОНОВЫЕ ПОВТОРЫ ==========
+
+    def start(self):
+        """Запуск потока повторов"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._retry_loop, name="command-retry", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _retry_loop(self):
+        while not self._stop_event.is_set():
+            retry, failed = self.pop_expired()
+
+            for pending in retry:
+                try:
+                    self.publish(pending.topic, pending.payload, pending.qos)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка повторной отправки команды {pending.command_id}: {e}")
+
+            for pending in failed:
+                logger.warning(f"⚠️ Команда {pending.command} ({pending.command_id}) не подтверждена "
+                               f"устройством {pending.device_id} после {pending.attempts} попыток")
+                if self.on_failed is not None:
+                    try:
+                        self.on_failed(pending)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки недоставленной команды: {e}")
+
+            deadline = self.next_deadline()
+            wait = 1.0 if deadline is None else min(1.0, max(0.0, deadline - time.monotonic()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    # ========== СТАТИСТИКА ==========
+
+    def get_latency(self, device_id=None, limit=100):
+        """Гистограммы задержек: по всему парку и по устройствам (сначала худшие по отказам и p99)"""
+        with self._lock:
+            if device_id is not None:
+                stats = self._devices.get(device_id)
+                devices = {device_id: stats.to_dict()} if stats is not None else {}
+            else:
+                ranked = sorted(self._devices.items(),
+                                key=lambda item: (item[1].failed, item[1].latency.percentile(0.99)), reverse=True)
+                devices = {device_id: stats.to_dict() for device_id, stats in ranked[:limit]}
+            fleet = self._fleet.to_dict()
+
+        return {
+            'fleet': fleet,
+            'devices': devices,
+            'device_count': len(self._devices),
+            'pending': len(self._pending)
+        }
+
+    def get_stats(self):
+        finished = self.acked_count + self.rejected_count + self.failed_count
+        return {
+            'pending': len(self._pending),
+            'tracked_count': self.tracked_count,
+            'acked_count': self.acked_count,
+            'rejected_count': self.rejected_count,
+            'failed_count': self.failed_count,
+            'unconfirmed_count': self.unconfirmed_count,
+            'retry_count': self.retry_count,
+            'unmatched_count': self.unmatched_count,
+            'overflow_count': self.overflow_count,
+            'superseded_count': self.superseded_count,
+            'stale_count': self.stale_count,
+            'failure_rate': round(self.failed_count / finished, 4) if finished else 0.0,
+            'latency_p50_ms': round(self._fleet.percentile(0.50) * 1000, 3),
+            'latency_p99_ms': round(self._fleet.percentile(0.99) * 1000, 3),
+            'acking_devices': len(self._acking),
+            'ack_timeout': self.timeout,
+            'max_retries': self.max_retries
+        }
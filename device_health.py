@@ -0,0 +1,274 @@
+# device_health.py - СКОЛЬЗЯЩАЯ СТАТИСТИКА ПОКАЗАТЕЛЕЙ УСТРОЙСТВ (RSSI, ПАМЯТЬ, АПТАЙМ)
+import heapq
+import math
+import threading
+
+# Разрешения окон агрегации: имя -> длина окна в секундах
+RESOLUTIONS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+
+
+class LogSketch:
+    """Гистограмма с логарифмическими корзинами для квантилей с относительной точностью.
+
+    Значение попадает в корзину ceil(log_gamma(|v|)), поэтому добавление - O(1),
+    а ошибка квантиля не превышает accuracy от значения. Отрицательные значения
+    (RSSI) хранятся в отдельном наборе корзин.
+    """
+
+    __slots__ = ('gamma', 'log_gamma', 'positive', 'negative', 'zero', 'count')
+
+    def __init__(self, accuracy=0.02):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value == 0:
+            self.zero += 1
+            return
+        buckets = self.positive if value > 0 else self.negative
+        index = math.ceil(math.log(abs(value)) / self.log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Приближенный квантиль q (0..1), None для пустого набора"""
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive)) if self.positive else 0.0
+
+
+class WindowStats:
+    """Агрегаты одного окна: количество, сумма, минимум, максимум и скетч квантилей"""
+
+    __slots__ = ('start', 'count', 'total', 'min', 'max', 'sketch')
+
+    def __init__(self, start, accuracy):
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sketch = LogSketch(accuracy)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.sketch.add(value)
+
+    def to_dict(self):
+        return {
+            'start': self.start,
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.sketch.quantile(0.5),
+            'p95': self.sketch.quantile(0.95)
+        }
+
+
+class MetricStats:
+    """Последнее значение, EWMA и окна 1m/1h/1d (текущее и предыдущее) одного показателя"""
+
+    __slots__ = ('last', 'ewma', 'windows')
+
+    def __init__(self):
+        self.last = None
+        self.ewma = None
+        # имя разрешения -> [текущее окно, предыдущее окно]
+        self.windows = {name: [None, None] for name, _ in RESOLUTIONS}
+
+    def update(self, value, timestamp, alpha, accuracy):
+        self.last = value
+        self.ewma = value if self.ewma is None else self.ewma + alpha * (value - self.ewma)
+
+        for name, seconds in RESOLUTIONS:
+            pair = self.windows[name]
+            start = timestamp - timestamp % seconds
+            current = pair[0]
+            if current is None or current.start != start:
+                if current is not None and current.start < start:
+                    pair[1] = current
+                current = pair[0] = WindowStats(start, accuracy)
+            current.add(value)
+
+    def to_dict(self):
+        return {
+            'last': self.last,
+            'ewma': self.ewma,
+            'windows': {
+                name: {
+                    'current': pair[0].to_dict() if pair[0] is not None else None,
+                    'previous': pair[1].to_dict() if pair[1] is not None else None
+                }
+                for name, pair in self.windows.items()
+            }
+        }
+
+
+class _DeviceState:
+    __slots__ = ('metrics', 'last_uptime', 'restart_count', 'last_restart', 'updated_at')
+
+    def __init__(self):
+        self.metrics = {}
+        self.last_uptime = None
+        self.restart_count = 0
+        self.last_restart = None
+        self.updated_at = None
+
+
+class DeviceHealth:
+    """Потоковые агрегаты показателей устройств и рейтинги по парку.
+
+    Каждое сообщение обновляет агрегаты за O(1). Для ранжируемых показателей
+    (самый слабый WiFi, меньше всего памяти) поддерживается куча с ленивым удалением
+    устаревших записей - запрос top-k не обходит весь парк.
+    """
+
+    def __init__(self, metrics=('rssi', 'free_heap', 'uptime'), ranked=('rssi', 'free_heap'),
+                 alpha=0.2, accuracy=0.02, on_restart=None):
+        self.metrics = tuple(metrics)
+        self.alpha = alpha
+        self.accuracy = accuracy
+        # on_restart(device_id, previous_uptime, uptime, timestamp) - аптайм пошел назад
+        self.on_restart = on_restart
+
+        self._devices = {}
+        self._heaps = {name: [] for name in ranked}
+        self._current = {name: {} for name in ranked}  # device_id -> (значение, номер записи)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self.restart_total = 0
+
+    def observe(self, device_id, timestamp, values):
+        self.observe_many(((device_id, timestamp, values),))
+
+    def observe_many(self, samples):
+        """Учет пачки показателей (device_id, timestamp, {показатель: значение})"""
+        restarts = []
+
+        # Одна блокировка на пачку: get_device и discard из потоков HTTP не видят
+        # записи устройства посередине изменения
+        with self._lock:
+            for device_id, timestamp, values in samples:
+                state = self._devices.get(device_id)
+                if state is None:
+                    state = self._devices[device_id] = _DeviceState()
+                state.updated_at = timestamp
+
+                for name in self.metrics:
+                    value = values.get(name)
+                    if not isinstance(value, (int, float)) or isinstance(value, bool):
+                        continue
+
+                    stats = state.metrics.get(name)
+                    if stats is None:
+                        stats = state.metrics[name] = MetricStats()
+                    stats.update(value, timestamp, self.alpha, self.accuracy)
+
+                    if name == 'uptime':
+                        if state.last_uptime is not None and value < state.last_uptime:
+                            state.restart_count += 1
+                            state.last_restart = timestamp
+                            restarts.append((device_id, state.last_uptime, value, timestamp))
+                        state.last_uptime = value
+                    if name in self._heaps:
+                        self._push(name, device_id, value)
+
+            self.restart_total += len(restarts)
+
+        if self.on_restart is not None:
+            for restart in restarts:
+                self.on_restart(*restart)
+
+    def _push(self, name, device_id, value):
+        current = self._current[name]
+        previous = current.get(device_id)
+        if previous is not None and previous[0] == value:
+            return
+
+        self._sequence += 1
+        current[device_id] = (value, self._sequence)
+        heap = self._heaps[name]
+        heapq.heappush(heap, (value, self._sequence, device_id))
+
+        # Слишком много устаревших записей - перестраиваем кучу
+        if len(heap) > 2 * len(current) + 64:
+            heap[:] = [(v, seq, d) for d, (v, seq) in current.items()]
+            heapq.heapify(heap)
+
+    def discard(self, device_id):
+        """Забыть устройство (удалено из системы)"""
+        with self._lock:
+            self._devices.pop(device_id, None)
+            for current in self._current.values():
+                current.pop(device_id, None)
+
+    def lowest(self, name, k=10, predicate=None):
+        """k устройств с наименьшим текущим значением показателя: [(device_id, значение)].
+
+        predicate(device_id) позволяет пропустить устройства (например, offline),
+        не удаляя их из рейтинга.
+        """
+        result = []
+        keep = []
+        with self._lock:
+            heap = self._heaps[name]
+            current = self._current[name]
+            while heap and len(result) < k:
+                entry = heapq.heappop(heap)
+                value, sequence, device_id = entry
+                if current.get(device_id, (None, None))[1] != sequence:
+                    continue  # устаревшая запись
+                keep.append(entry)
+                if predicate is None or predicate(device_id):
+                    result.append((device_id, value))
+            for entry in keep:
+                heapq.heappush(heap, entry)
+        return result
+
+    def get_device(self, device_id):
+        """Агрегаты устройства или None"""
+        with self._lock:
+            state = self._devices.get(device_id)
+            if state is None:
+                return None
+            return {
+                'metrics': {name: stats.to_dict() for name, stats in state.metrics.items()},
+                'restart_count': state.restart_count,
+                'last_restart': state.last_restart,
+                'updated_at': state.updated_at
+            }
+
+    def get_stats(self):
+        return {
+            'devices': len(self._devices),
+            'restart_total': self.restart_total,
+            'ranked': {name: {'devices': len(self._current[name]), 'heap_size': len(heap)}
+                       for name, heap in self._heaps.items()}
+        }
@@ -0,0 +1,81 @@
+# device_index.py - ВТОРИЧНЫЕ ИНДЕКСЫ УСТРОЙСТВ
+import threading
+
+_MISSING = object()
+
+
+class DeviceIndex:
+    """Индексы "поле -> значение -> множество device_id" для быстрых выборок.
+
+    update() вызывается при каждом изменении записи устройства и трогает только
+    поля, значение которых действительно изменилось. find() пересекает множества,
+    начиная с самого маленького, поэтому стоимость выборки зависит от размера
+    результата, а не от размера парка.
+    """
+
+    def __init__(self, fields):
+        # fields: имя поля -> функция извлечения значения из записи устройства
+        self.fields = dict(fields)
+        self._index = {name: {} for name in self.fields}
+        self._lock = threading.Lock()
+
+    def update(self, device_id, old, new):
+        """Обновление индексов по старой и новой версии записи (None - нет записи)"""
+        changes = []
+        for name, getter in self.fields.items():
+            old_value = getter(old) if old is not None else _MISSING
+            new_value = getter(new) if new is not None else _MISSING
+            if old_value != new_value or type(old_value) is not type(new_value):
+                changes.append((name, old_value, new_value))
+
+        if not changes:
+            return
+
+        with self._lock:
+            for name, old_value, new_value in changes:
+                values = self._index[name]
+                if old_value is not _MISSING:
+                    ids = values.get(old_value)
+                    if ids is not None:
+                        ids.discard(device_id)
+                        if not ids:
+                            del values[old_value]
+                if new_value is not _MISSING:
+                    ids = values.get(new_value)
+                    if ids is None:
+                        ids = values[new_value] = set()
+                    ids.add(device_id)
+
+    def find(self, **criteria):
+        """Множество id устройств, у которых все указанные поля равны заданным значениям"""
+        for name in criteria:
+            if name not in self._index:
+                raise KeyError(f"Поле {name} не индексируется")
+
+        with self._lock:
+            candidates = sorted(
+                (self._index[name].get(value, ()) for name, value in criteria.items()),
+                key=len
+            )
+            if not candidates:
+                return set()
+
+            result = set(candidates[0])
+            for ids in candidates[1:]:
+                if not result:
+                    break
+                result &= ids
+            return result
+
+    def count(self, **criteria):
+        """Количество устройств, подходящих под условия"""
+        if len(criteria) == 1:
+            (name, value), = criteria.items()
+            with self._lock:
+                return len(self._index[name].get(value, ()))
+        return len(self.find(**criteria))
+
+    def values(self, name):
+        """Распределение значений поля: значение -> количество устройств"""
+        with self._lock:
+            return {value: len(ids) for value, ids in self._index[name].items()}
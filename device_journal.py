@@ -0,0 +1,234 @@
+# device_journal.py - ЖУРНАЛ ИЗМЕНЕНИЙ И СНИМКИ СОСТОЯНИЯ ДЛЯ БЫСТРОГО ПЕРЕЗАПУСКА
+import json
+import os
+import threading
+import time
+import logging
+
+from response_cache import encode_json
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot.json'
+JOURNAL_FILE = 'journal.log'
+
+
+class DeviceJournal:
+    """Журнал изменений устройств с групповой фиксацией и периодическими снимками.
+
+    Изменения только регистрируются в памяти (последнее состояние каждого устройства
+    за интервал), фоновый поток раз в sync_interval пишет их одной строкой JSON
+    и делает один fsync на всю группу. Периодически пишется полный снимок, после
+    чего журнал начинается заново. При запуске load() читает снимок и доигрывает
+    строки журнала с номером больше номера снимка; недописанная последняя строка
+    (сбой во время записи) пропускается.
+    """
+
+    def __init__(self, directory, sync_interval=0.05, snapshot_interval=300.0,
+                 snapshot_bytes=64 * 1024 * 1024, state_provider=None, counters_provider=None):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_bytes = snapshot_bytes
+        # state_provider() -> {'devices': {id: состояние}, 'events': [...], 'counters': {...}}
+        self.state_provider = state_provider
+        self.counters_provider = counters_provider
+
+        self._devices = {}  # device_id -> запись или None (удаление), последнее за интервал
+        self._events = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._file = None
+        self._journal_size = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.sequence = 0
+        self.last_snapshot_time = None
+        self.commit_count = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self.sync_time = 0.0
+        self.snapshot_count = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ========== РЕГИСТРАЦИЯ ИЗМЕНЕНИЙ ==========
+
+    def record_device(self, device_id, record):
+        """Новое состояние устройства (None - удалено). Повторные изменения за интервал сливаются"""
+        with self._pending_lock:
+            self._devices[device_id] = record
+
+    def record_event(self, seq, timestamp, message, level):
+        with self._pending_lock:
+            self._events.append((seq, timestamp, message, level))
+
+    # ========== ЗАПИСЬ ==========
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self._path(JOURNAL_FILE), 'ab')
+            self._journal_size = self._file.tell()
+
+    def commit(self):
+        """Групповая фиксация: все накопленные изменения - одна запись и один fsync"""
+        with self._write_lock:
+            with self._pending_lock:
+                devices = self._devices
+                events = self._events
+                self._devices = {}
+                self._events = []
+            if not devices and not events:
+                return 0
+
+            self.sequence += 1
+            entry = {
+                's': self.sequence,
+                'd': {device_id: record.to_state() if record is not None else None
+                      for device_id, record in devices.items()},
+                'e': events
+            }
+            if self.counters_provider is not None:
+                entry['c'] = self.counters_provider()
+            line = encode_json(entry) + b'\n'
+
+            self._open()
+            started = time.perf_counter()
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.sync_time += time.perf_counter() - started
+
+            self._journal_size += len(line)
+            self.commit_count += 1
+            self.records_written += len(devices) + len(events)
+            self.bytes_written += len(line)
+            return len(devices) + len(events)
+
+    def snapshot(self):
+        """Полный снимок состояния и начало нового журнала"""
+        if self.state_provider is None:
+            return False
+
+        with self._write_lock:
+            # Снимок покрывает все зафиксированные строки журнала
+            state = self.state_provider()
+            state['journal_seq'] = self.sequence
+            state['created_at'] = time.time()
+
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self._path(SNAPSHOT_FILE + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(encode_json(state))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(SNAPSHOT_FILE))
+
+            # Строки журнала до снимка больше не нужны
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self._path(JOURNAL_FILE), 'wb')
+            self._journal_size = 0
+
+            self.last_snapshot_time = time.time()
+            self.snapshot_count += 1
+            return True
+
+    # ========== ВОССТАНОВЛЕНИЕ ==========
+
+    def load(self):
+        """Состояние из снимка и журнала: {'devices', 'events', 'counters', 'replayed'}"""
+        state = {'devices': {}, 'events': [], 'counters': {}, 'journal_seq': 0}
+        snapshot_path = self._path(SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, 'rb') as f:
+                    state.update(json.loads(f.read()))
+            except (OSError, ValueError) as e:
+                logger.error(f"❌ Не удалось прочитать снимок состояния: {e}")
+
+        devices = state['devices']
+        events = state['events']
+        last_event = events[-1][0] if events else 0
+        sequence = state['journal_seq']
+        replayed = 0
+
+        journal_path = self._path(JOURNAL_FILE)
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.warning("⚠️ Пропущена недописанная запись журнала")
+                        break
+                    if entry['s'] <= sequence:
+                        continue
+                    sequence = entry['s']
+                    for device_id, record in entry['d'].items():
+                        if record is None:
+                            devices.pop(device_id, None)
+                        else:
+                            devices[device_id] = record
+                    for event in entry['e']:
+                        if event[0] > last_event:
+                            events.append(event)
+                            last_event = event[0]
+                    if 'c' in entry:
+                        state['counters'] = entry['c']
+                    replayed += 1
+
+        self.sequence = sequence
+        state['replayed'] = replayed
+        return state
+
+    # ========== ФОНОВАЯ ФИКСАЦИЯ ==========
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self.last_snapshot_time = self.last_snapshot_time or time.time()
+        self._thread = threading.Thread(target=self._commit_loop, name="device-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка с последней фиксацией и снимком"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self.commit()
+        self.snapshot()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _commit_loop(self):
+        while not self._stop_event.wait(self.sync_interval):
+            try:
+                self.commit()
+                if (time.time() - self.last_snapshot_time >= self.snapshot_interval or
+                        self._journal_size >= self.snapshot_bytes):
+                    self.snapshot()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи журнала: {e}")
+
+    def get_stats(self):
+        return {
+            'directory': self.directory,
+            'sequence': self.sequence,
+            'commit_count': self.commit_count,
+            'records_written': self.records_written,
+            'bytes_written': self.bytes_written,
+            'journal_size': self._journal_size,
+            'avg_sync_ms': round(self.sync_time / self.commit_count * 1000, 3) if self.commit_count else 0,
+            'snapshot_count': self.snapshot_count,
+            'last_snapshot_time': self.last_snapshot_time,
+            'pending_devices': len(self._devices)
+        }
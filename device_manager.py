@@ -1,10 +1,34 @@
 import time
 import json
-from typing import Dict, List
-from dataclasses import dataclass
+from typing import Dict, List, Optional
+from dataclasses import dataclass, replace, fields as dataclass_fields
+from datetime import datetime
 from collections import defaultdict
 
-@dataclass
+# Таблица повторяющихся строк (типы, версии, прошивки) - одна копия на весь парк.
+# Размер ограничен: значения, которые присылает устройство, не должны расти без предела
+_STRING_TABLE: Dict[str, str] = {}
+MAX_INTERNED_STRINGS = 4096
+
+# Поля с малым числом различных значений, строки которых имеет смысл делить
+INTERNED_ATTRIBUTES = frozenset(('version', 'firmware'))
+
+def intern_string(value):
+    """Возвращает общий экземпляр строки из таблицы (не строки и строки сверх лимита - как есть)"""
+    if type(value) is not str:
+        return value
+    shared = _STRING_TABLE.get(value)
+    if shared is not None:
+        return shared
+    if len(_STRING_TABLE) >= MAX_INTERNED_STRINGS:
+        return value
+    return _STRING_TABLE.setdefault(value, value)
+
+def interned_count() -> int:
+    """Количество строк в таблице"""
+    return len(_STRING_TABLE)
+
+@dataclass(slots=True)
 class Device:
     device_id: str
     device_type: str
@@ -13,6 +37,122 @@ class Device:
     last_seen: float
     attributes: dict
 
+@dataclass(slots=True)
+class DeviceAttributes:
+    """Атрибуты из статуса устройства (вместо вложенного словаря)"""
+    mac: str = ''
+    rssi: int = 0
+    free_heap: int = 0
+    uptime: int = 0
+    version: str = 'unknown'
+    firmware: str = 'unknown'
+    config_mode: bool = False
+    mqtt_broker: str = ''
+    led_state: bool = True
+    action_button_pressed: bool = False
+    led_on: bool = True
+    rgb_color: str = '0,0,0'
+    available: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DeviceAttributes':
+        """Создание из словаря атрибутов (неизвестные ключи игнорируются)"""
+        attributes = cls()
+        for name in cls.__slots__:
+            if name in data:
+                value = data[name]
+                setattr(attributes, name, intern_string(value) if name in INTERNED_ATTRIBUTES else value)
+        return attributes
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+@dataclass(slots=True)
+class DeviceRecord(Device):
+    """Компактная запись устройства для DeviceStorage.
+
+    Записи неизменяемы по соглашению: изменения делаются через evolve(), который
+    возвращает копию. Время создания хранится числом и форматируется при выдаче.
+    """
+    created_at: float = 0.0
+    action_button_pressed: bool = False
+    led_on: bool = True
+    rgb_color: str = '0,0,0'  # формат: "red,green,blue"
+    available: bool = True    # доступно для перемешивания
+    last_data: Optional[dict] = None
+    last_data_time: Optional[float] = None
+    last_button_time: Optional[float] = None
+    restored: bool = False    # поднято из журнала, статуса после перезапуска еще не было
+
+    def evolve(self, **changes) -> 'DeviceRecord':
+        """Копия записи с измененными полями"""
+        return replace(self, **changes)
+
+    def to_state(self) -> dict:
+        """Полное состояние записи без форматирования (для журнала и снимков)"""
+        state = {field.name: getattr(self, field.name) for field in dataclass_fields(self)}
+        state['attributes'] = self.attributes.to_dict()
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'DeviceRecord':
+        """Восстановление записи из to_state() (неизвестные ключи игнорируются)"""
+        data = {field.name: state[field.name] for field in dataclass_fields(cls) if field.name in state}
+        data['attributes'] = DeviceAttributes.from_dict(state.get('attributes') or {})
+        for name in ('device_type', 'status'):
+            if name in data:
+                data[name] = intern_string(data[name])
+        return cls(**data)
+
+    def to_dict(self, fields=None) -> dict:
+        """JSON-представление в формате /api/devices (fields - проекция на часть ключей)"""
+        if fields is not None:
+            return {key: RECORD_JSON_FIELDS[key](self) for key in fields if key in RECORD_JSON_FIELDS}
+
+        data = {
+            'id': self.device_id,
+            'type': self.device_type,
+            'ip': self.ip_address,
+            'status': self.status,
+            'last_seen': self.last_seen,
+            'attributes': self.attributes.to_dict(),
+            'created_at': datetime.fromtimestamp(self.created_at).isoformat(),
+            'action_button_pressed': self.action_button_pressed,
+            'led_on': self.led_on,
+            'rgb_color': self.rgb_color,
+            'available': self.available
+        }
+
+        # Необязательные поля появляются только после соответствующих сообщений
+        if self.last_data is not None:
+            data['last_data'] = self.last_data
+            data['last_data_time'] = self.last_data_time
+        if self.last_button_time is not None:
+            data['last_button_time'] = self.last_button_time
+        if self.restored:
+            data['restored'] = True
+
+        return data
+
+# Ключ JSON -> извлечение значения из DeviceRecord (для проекции полей в API)
+RECORD_JSON_FIELDS = {
+    'id': lambda device: device.device_id,
+    'type': lambda device: device.device_type,
+    'ip': lambda device: device.ip_address,
+    'status': lambda device: device.status,
+    'last_seen': lambda device: device.last_seen,
+    'attributes': lambda device: device.attributes.to_dict(),
+    'created_at': lambda device: datetime.fromtimestamp(device.created_at).isoformat(),
+    'action_button_pressed': lambda device: device.action_button_pressed,
+    'led_on': lambda device: device.led_on,
+    'rgb_color': lambda device: device.rgb_color,
+    'available': lambda device: device.available,
+    'last_data': lambda device: device.last_data,
+    'last_data_time': lambda device: device.last_data_time,
+    'last_button_time': lambda device: device.last_button_time,
+    'restored': lambda device: device.restored
+}
+
 class DeviceManager:
     def __init__(self):
         self.devices: Dict[str, Device] = {}
@@ -0,0 +1,271 @@
+# device_registry.py - ПОТОКОБЕЗОПАСНЫЙ РЕЕСТР УСТРОЙСТВ
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+class RegistrySnapshot(Mapping):
+    """Неизменяемый снимок реестра на момент версии version"""
+
+    __slots__ = ('_devices', 'version')
+
+    def __init__(self, devices, version):
+        self._devices = devices
+        self.version = version
+
+    def __getitem__(self, device_id):
+        return self._devices[device_id]
+
+    def __contains__(self, device_id):
+        return device_id in self._devices
+
+    def __iter__(self):
+        return iter(self._devices)
+
+    def __len__(self):
+        return len(self._devices)
+
+
+class _Stripe:
+    """Шард реестра: своя блокировка для писателей и опубликованный словарь для читателей"""
+
+    __slots__ = ('lock', 'devices', 'version')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Опубликованный словарь никогда не изменяется на месте:
+        # писатель копирует его, вносит изменения и подменяет ссылку
+        self.devices = {}
+        self.version = 0
+
+
+class DeviceRegistry(Mapping):
+    """Реестр устройств с блокировками по шардам (device_id) и copy-on-write чтением.
+
+    Писатели блокируют только свой шард. Читатели не берут блокировок вообще:
+    они читают опубликованные словари шардов, которые после публикации не меняются.
+    Записи устройств тоже считаются неизменяемыми - изменения делаются через копию
+    (evolve() у DeviceRecord).
+    """
+
+    def __init__(self, stripes=16, on_change=None):
+        self._stripes = [_Stripe() for _ in range(max(1, int(stripes)))]
+        self._snapshot = None
+        # on_change(device_id, old, new) вызывается под блокировкой шарда для каждой
+        # измененной записи сразу после публикации шарда - так производные индексы
+        # видят изменения в порядке записи и никогда не опережают читателей
+        self.on_change = on_change
+
+    def _stripe(self, device_id):
+        return self._stripes[hash(device_id) % len(self._stripes)]
+
+    @property
+    def version(self):
+        """Монотонно растущая версия реестра (сумма версий шардов)"""
+        return sum(stripe.version for stripe in self._stripes)
+
+    # ========== ЧТЕНИЕ (БЕЗ БЛОКИРОВОК) ==========
+
+    def __getitem__(self, device_id):
+        return self._stripe(device_id).devices[device_id]
+
+    def __contains__(self, device_id):
+        return device_id in self._stripe(device_id).devices
+
+    def get(self, device_id, default=None):
+        return self._stripe(device_id).devices.get(device_id, default)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return sum(len(stripe.devices) for stripe in self._stripes)
+
+    def snapshot(self):
+        """Согласованный снимок всех устройств (кэшируется до следующей записи)"""
+        version = self.version
+        cached = self._snapshot
+        if cached is not None and cached.version == version:
+            return cached
+
+        devices = {}
+        for stripe in self._stripes:
+            devices.update(stripe.devices)
+
+        snapshot = RegistrySnapshot(devices, version)
+        self._snapshot = snapshot
+        return snapshot
+
+    # ========== ЗАПИСЬ ==========
+
+    def apply_many(self, operations):
+        """Применение пачки операций с одной публикацией на каждый затронутый шард.
+
+        operations - последовательность (device_id, fn), где fn(old) возвращает новую
+        запись, None для удаления или old без изменений. old равен None, если устройства нет.
+        Возвращает список (device_id, old, new) в порядке операций внутри шардов.
+        """
+        by_stripe = {}
+        for device_id, fn in operations:
+            stripe = self._stripe(device_id)
+            items = by_stripe.get(id(stripe))
+            if items is None:
+                items = by_stripe[id(stripe)] = (stripe, [])
+            items[1].append((device_id, fn))
+
+        results = []
+        on_change = self.on_change
+        for stripe, items in by_stripe.values():
+            with stripe.lock:
+                current = stripe.devices
+                updated = None
+                changed = []
+
+                for device_id, fn in items:
+                    source = updated if updated is not None else current
+                    old = source.get(device_id)
+                    record = fn(old)
+
+                    if record is old:
+                        results.append((device_id, old, old))
+                        continue
+
+                    if updated is None:
+                        updated = dict(current)
+                    if record is None:
+                        updated.pop(device_id, None)
+                    else:
+                        updated[device_id] = record
+                    changed.append((device_id, old, record))
+                    results.append((device_id, old, record))
+
+                if updated is not None:
+                    stripe.devices = updated
+                    stripe.version += 1
+
+                    if on_change is not None:
+                        for device_id, old, record in changed:
+                            on_change(device_id, old, record)
+
+        return results
+
+    def apply(self, device_id, fn):
+        """Применение одной операции, возвращает (old, new)"""
+        _, old, new = self.apply_many(((device_id, fn),))[0]
+        return old, new
+
+    def put(self, device_id, record):
+        """Добавление или замена записи устройства"""
+        return self.apply(device_id, lambda old: record)[0]
+
+    def update(self, device_id, changes):
+        """Обновление полей существующего устройства через копию записи"""
+        def merge(old):
+            if old is None:
+                return None
+            return old.evolve(**changes)
+
+        return self.apply(device_id, merge)[1]
+
+    def remove(self, device_id):
+        """Удаление устройства, возвращает удаленную запись"""
+        return self.apply(device_id, lambda old: None)[0]
+
+
+class ChangeLog:
+    """Журнал версий изменений устройств для запросов "что изменилось с версии N".
+
+    Для каждого устройства хранится только версия последнего изменения, записи
+    упорядочены по версии, поэтому выборка изменений стоит O(количества изменений).
+    Удаленные устройства остаются в журнале до вытеснения (max_removed).
+    """
+
+    def __init__(self, max_removed=10000):
+        self.max_removed = max_removed
+        self.version = 0
+        # Версия, раньше которой история неполна (вытеснены удаления)
+        self.floor = 0
+        self._entries = OrderedDict()  # device_id -> (version, removed)
+        self._removed_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, device_id, removed=False):
+        """Регистрация изменения, возвращает новую версию"""
+        with self._lock:
+            self.version += 1
+            previous = self._entries.pop(device_id, None)
+            if previous is not None and previous[1]:
+                self._removed_count -= 1
+
+            self._entries[device_id] = (self.version, removed)
+            if removed:
+                self._removed_count += 1
+                if self._removed_count > self.max_removed:
+                    self._evict_removed()
+
+            return self.version
+
+    def _evict_removed(self):
+        """Вытеснение самых старых удалений (сдвигает floor)"""
+        for device_id, (version, removed) in list(self._entries.items()):
+            if self._removed_count <= self.max_removed // 2:
+                break
+            if removed:
+                del self._entries[device_id]
+                self._removed_count -= 1
+                self.floor = version
+
+    def version_of(self, device_id):
+        """Версия последнего изменения устройства (0, если изменений не было)"""
+        entry = self._entries.get(device_id)
+        return entry[0] if entry is not None else 0
+
+    def changes_since(self, since):
+        """(версия, измененные id, удаленные id) после версии since или None, если история неполна"""
+        with self._lock:
+            if since < self.floor:
+                return None
+
+            changed = []
+            removed = []
+            for device_id in reversed(self._entries):
+                version, is_removed = self._entries[device_id]
+                if version <= since:
+                    break
+                (removed if is_removed else changed).append(device_id)
+
+            return self.version, changed, removed
+
+
+class MirroredChangeLog(ChangeLog):
+    """Копия журнала версий другого процесса (HTTP воркер многопроцессного режима).
+
+    Версии не растут при record(): их задает mirror() по данным процесса приема,
+    поэтому ETag и ?since= у всех воркеров совпадают с версиями владельца состояния.
+    """
+
+    def record(self, device_id, removed=False):
+        return self.version
+
+    def mirror(self, version, changed, removed, reset=False):
+        """Применение версий владельца: changed/removed - {device_id: версия изменения}"""
+        items = sorted([(device_version, device_id, False) for device_id, device_version in changed.items()] +
+                       [(device_version, device_id, True) for device_id, device_version in removed.items()])
+        with self._lock:
+            if reset:
+                # Полная копия: история удалений до этой версии неизвестна
+                self._entries.clear()
+                self._removed_count = 0
+                self.floor = version
+
+            for device_version, device_id, is_removed in items:
+                previous = self._entries.pop(device_id, None)
+                if previous is not None and previous[1]:
+                    self._removed_count -= 1
+                self._entries[device_id] = (device_version, is_removed)
+                if is_removed:
+                    self._removed_count += 1
+
+            if self._removed_count > self.max_removed:
+                self._evict_removed()
+            self.version = version if reset else max(self.version, version)
@@ -0,0 +1,112 @@
+# event_log.py - КОЛЬЦЕВОЙ ЖУРНАЛ СИСТЕМНЫХ СОБЫТИЙ
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class EventLog:
+    """Журнал событий фиксированной емкости с номерами событий и индексами по уровням.
+
+    Событие с номером seq лежит в ячейке seq % capacity заранее выделенных списков,
+    поэтому запись - O(1) без перевыделений. Время хранится как float и форматируется
+    только при чтении. Индекс уровня - очередь номеров событий этого уровня, что
+    позволяет выбрать, например, только ошибки без обхода всего журнала.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = int(capacity)
+        self._timestamps = [0.0] * self.capacity
+        self._messages = [None] * self.capacity
+        self._levels = [None] * self.capacity
+        self._by_level = {}  # уровень -> deque номеров событий
+        self._lock = threading.Lock()
+        self.last_seq = 0  # номер последнего записанного события (0 - событий не было)
+        self.level_counts = {}
+
+    def __len__(self):
+        return min(self.last_seq, self.capacity)
+
+    @property
+    def first_seq(self):
+        """Номер самого старого события, которое еще хранится"""
+        return max(1, self.last_seq - self.capacity + 1)
+
+    def append(self, message, level='info', timestamp=None):
+        """Запись события, возвращает его номер"""
+        with self._lock:
+            return self._append(self.last_seq + 1, message, level, timestamp)
+
+    def _append(self, seq, message, level, timestamp):
+        """Запись события с заданным номером (вызывается под блокировкой)"""
+        self.last_seq = seq
+        slot = seq % self.capacity
+        self._timestamps[slot] = timestamp if timestamp is not None else time.time()
+        self._messages[slot] = message
+        self._levels[slot] = level
+
+        index = self._by_level.get(level)
+        if index is None:
+            index = self._by_level[level] = deque(maxlen=self.capacity)
+        index.append(seq)
+        self.level_counts[level] = self.level_counts.get(level, 0) + 1
+        return seq
+
+    def export(self, after=0):
+        """Хранимые события с номером больше after как [seq, время, сообщение, уровень] (для снимков и копий)"""
+        with self._lock:
+            return [[seq, self._timestamps[seq % self.capacity], self._messages[seq % self.capacity],
+                     self._levels[seq % self.capacity]]
+                    for seq in range(max(self.first_seq, after + 1), self.last_seq + 1)]
+
+    def restore(self, events):
+        """Восстановление событий из export() с исходными номерами (после перезапуска)"""
+        with self._lock:
+            for seq, timestamp, message, level in events[-self.capacity:]:
+                if seq > self.last_seq:
+                    self._append(seq, message, level, timestamp)
+
+    def _event(self, seq):
+        slot = seq % self.capacity
+        timestamp = self._timestamps[slot]
+        return {
+            'seq': seq,
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'time': timestamp,
+            'message': self._messages[slot],
+            'level': self._levels[slot]
+        }
+
+    def read(self, after=None, level=None, limit=50):
+        """События по возрастанию номера.
+
+        after=None - последние limit событий; иначе - первые limit событий с номером
+        больше after (для чтения "хвоста" журнала). level ограничивает выборку уровнем.
+        """
+        with self._lock:
+            first = self.first_seq
+            if level is None:
+                start = first if after is None else max(first, after + 1)
+                end = self.last_seq + 1
+                if after is None:
+                    start = max(start, end - limit)
+                seqs = range(start, min(end, start + limit))
+            else:
+                seqs = []
+                for seq in reversed(self._by_level.get(level, ())):
+                    if seq < first or (after is not None and seq <= after):
+                        break
+                    seqs.append(seq)
+                seqs.reverse()
+                seqs = seqs[-limit:] if after is None else seqs[:limit]
+
+            return [self._event(seq) for seq in seqs]
+
+    def get_stats(self):
+        return {
+            'capacity': self.capacity,
+            'size': len(self),
+            'first_seq': self.first_seq,
+            'last_seq': self.last_seq,
+            'levels': dict(self.level_counts)
+        }
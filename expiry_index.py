@@ -0,0 +1,112 @@
+# expiry_index.py - ИНДЕКС СРОКОВ ЖИЗНИ УСТРОЙСТВ
+import heapq
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryIndex:
+    """Куча дедлайнов (last_seen + timeout) с ленивым обновлением и фоновым "жнецом".
+
+    touch() только переписывает дедлайн в словаре - в куче у каждого устройства не
+    больше одной записи. Когда запись всплывает, а дедлайн был продлен, она
+    возвращается в кучу с актуальным сроком. Размер кучи не превышает число устройств.
+    """
+
+    def __init__(self, on_expire, timeout, resolution=1.0):
+        # on_expire(device_ids, now) вызывается из потока жнеца без блокировок индекса
+        self.on_expire = on_expire
+        self.timeout = timeout
+        self.resolution = resolution
+
+        self._deadlines = {}
+        self._queued = set()
+        self._heap = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.expired_count = 0
+
+    def touch(self, device_id, last_seen):
+        """Продление срока жизни устройства"""
+        deadline = last_seen + self.timeout
+        with self._lock:
+            self._deadlines[device_id] = deadline
+            if device_id not in self._queued:
+                self._queued.add(device_id)
+                heapq.heappush(self._heap, (deadline, device_id))
+
+    def discard(self, device_id):
+        """Снятие устройства с контроля (запись в куче удалится при всплытии)"""
+        with self._lock:
+            self._deadlines.pop(device_id, None)
+
+    def pop_expired(self, now=None):
+        """Извлечение устройств, чей срок истек к моменту now"""
+        if now is None:
+            now = time.time()
+
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, device_id = heapq.heappop(heap)
+                self._queued.discard(device_id)
+
+                deadline = self._deadlines.get(device_id)
+                if deadline is None:
+                    continue
+                if deadline > now:
+                    # Срок был продлен после постановки в кучу
+                    self._queued.add(device_id)
+                    heapq.heappush(heap, (deadline, device_id))
+                    continue
+
+                del self._deadlines[device_id]
+                expired.append(device_id)
+
+        return expired
+
+    def next_deadline(self):
+        """Ближайший дедлайн в куче или None"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    # ========== ФОНОВЫЙ ЖНЕЦ ==========
+
+    def start(self):
+        """Запуск фонового потока, переводящего просроченные устройства в offline"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._reaper_loop, name="expiry-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка фонового потока"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def _reaper_loop(self):
+        while not self._stop_event.is_set():
+            now = time.time()
+            expired = self.pop_expired(now)
+
+            if expired:
+                self.expired_count += len(expired)
+                try:
+                    self.on_expire(expired, now)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработки просроченных устройств: {e}")
+
+            deadline = self.next_deadline()
+            wait = self.resolution if deadline is None else min(self.resolution, max(0.0, deadline - time.time()))
+            self._stop_event.wait(wait)
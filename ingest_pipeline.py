@@ -0,0 +1,176 @@
+# ingest_pipeline.py - КОНВЕЙЕР ОБРАБОТКИ ВХОДЯЩИХ MQTT СООБЩЕНИЙ
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки воркера
+_STOP = object()
+
+
+class IngestPipeline:
+    """Ограниченная очередь входящих сообщений и пул воркеров, обрабатывающих их пачками.
+
+    Колбэк paho только кладет сообщение в очередь. Очередь разбита на шарды по
+    device_id, поэтому сообщения одного устройства всегда обрабатывает один и тот же
+    воркер и порядок их применения сохраняется.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=10000, batch_size=256, batch_wait=0.0):
+        # handler(groups) получает dict: device_id -> [(message_type, payload, received_at), ...]
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = batch_wait
+        self.queue_size = max(self.workers, int(queue_size))
+
+        per_worker = self.queue_size // self.workers
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self.threads = []
+        self.is_running = False
+
+        # Счетчики потока paho (пишет только один поток)
+        self.received_count = 0
+        self.dropped_count = 0
+
+        # Счетчики воркеров - у каждого своя ячейка, блокировки не нужны
+        self._processed = [0] * self.workers
+        self._batches = [0] * self.workers
+        self._errors = [0] * self.workers
+        self._max_batch = [0] * self.workers
+        self._max_depth = [0] * self.workers
+
+    def start(self):
+        """Запуск воркеров"""
+        if self.is_running:
+            return
+
+        self.is_running = True
+        self.threads = []
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                args=(index,),
+                name=f"ingest-worker-{index}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+        logger.info(f"✅ Конвейер обработки MQTT запущен: воркеров={self.workers}, очередь={self.queue_size}")
+
+    def stop(self, timeout=5):
+        """Остановка воркеров с дообработкой уже принятых сообщений"""
+        if not self.is_running:
+            return
+
+        self.is_running = False
+        for q in self.queues:
+            try:
+                q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+        self.threads = []
+
+    def submit(self, device_id, message_type, payload):
+        """Постановка сообщения в очередь (вызывается из потока paho, не блокирует)"""
+        self.received_count += 1
+        index = hash(device_id) % self.workers
+
+        try:
+            self.queues[index].put_nowait((device_id, message_type, payload, time.time()))
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            # Не засоряем лог при длительной перегрузке
+            if self.dropped_count == 1 or self.dropped_count % 1000 == 0:
+                logger.warning(f"⚠️ Очередь обработки MQTT переполнена, отброшено сообщений: {self.dropped_count}")
+            return False
+
+    def _worker_loop(self, index):
+        """Цикл воркера: забираем все, что накопилось в шарде, и обрабатываем одной пачкой"""
+        q = self.queues[index]
+
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.batch_wait
+
+            while len(batch) < self.batch_size:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = q.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            depth = q.qsize() + len(batch)
+            if depth > self._max_depth[index]:
+                self._max_depth[index] = depth
+
+            self._dispatch(index, batch)
+
+            if stop:
+                break
+
+    def _dispatch(self, index, batch):
+        """Группировка пачки по устройствам и передача обработчику"""
+        groups = {}
+        for device_id, message_type, payload, received_at in batch:
+            messages = groups.get(device_id)
+            if messages is None:
+                messages = groups[device_id] = []
+            messages.append((message_type, payload, received_at))
+
+        try:
+            self.handler(groups)
+        except Exception as e:
+            self._errors[index] += 1
+            logger.error(f"❌ Ошибка обработки пачки MQTT сообщений: {e}")
+
+        self._processed[index] += len(batch)
+        self._batches[index] += 1
+        if len(batch) > self._max_batch[index]:
+            self._max_batch[index] = len(batch)
+
+    def get_queue_depth(self):
+        """Текущее количество сообщений в очереди"""
+        return sum(q.qsize() for q in self.queues)
+
+    def get_stats(self):
+        """Метрики конвейера"""
+        processed = sum(self._processed)
+        batches = sum(self._batches)
+
+        return {
+            'running': self.is_running,
+            'workers': self.workers,
+            'queue_capacity': self.queue_size,
+            'queue_depth': self.get_queue_depth(),
+            'max_queue_depth': max(self._max_depth),
+            'received_count': self.received_count,
+            'dropped_count': self.dropped_count,
+            'processed_count': processed,
+            'batch_count': batches,
+            'avg_batch_size': round(processed / batches, 2) if batches else 0,
+            'max_batch_size': max(self._max_batch),
+            'handler_errors': sum(self._errors)
+        }
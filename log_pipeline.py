@@ -0,0 +1,115 @@
+# log_pipeline.py - НЕБЛОКИРУЮЩЕЕ ЛОГИРОВАНИЕ С ВЫБОРКОЙ ПО ТОПИКАМ
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+from command_publisher import TokenBucket
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не блокирует поток при переполненной очереди, а считает потери.
+
+    Запись форматируется не здесь, а в потоке QueueListener - вызывающий поток
+    только кладет запись в очередь.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Трассировку исключения превращаем в текст сразу: exc_info нельзя передавать между потоками надолго
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TopicSampler(logging.Filter):
+    """Фильтр выборки записей по топику (extra={'topic': ...}).
+
+    every - словарь топик -> "пропускать каждую N-ю запись" (1 - все записи),
+    rate - не более rate записей в секунду на топик. Предупреждения и ошибки
+    проходят всегда.
+    """
+
+    def __init__(self, every=None, rate=None, default_every=1):
+        super().__init__()
+        self.every = dict(every or {})
+        self.default_every = default_every
+        self.rate = rate
+        self._counters = {}
+        self._buckets = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        topic = getattr(record, 'topic', None)
+        count = self._counters.get(topic, 0) + 1
+        self._counters[topic] = count
+
+        every = self.every.get(topic, self.default_every)
+        passed = every <= 1 or count % every == 0
+        if passed and self.rate:
+            bucket = self._buckets.get(topic)
+            if bucket is None:
+                bucket = self._buckets[topic] = TokenBucket(self.rate, self.rate)
+            passed = bucket.try_acquire()
+
+        if not passed:
+            self.suppressed[topic] = self.suppressed.get(topic, 0) + 1
+        return passed
+
+
+class LogPipeline:
+    """Логирование через очередь: обработчики (консоль) работают в отдельном потоке"""
+
+    def __init__(self, level=logging.INFO, fmt='%(asctime)s - %(levelname)s - %(message)s',
+                 queue_size=10000, handlers=None):
+        self.level = level
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        if handlers is None:
+            console = logging.StreamHandler(sys.stderr)
+            console.setFormatter(logging.Formatter(fmt))
+            handlers = [console]
+        self.handlers = handlers
+        self.listener = None
+
+    def start(self):
+        """Подключение к корневому логгеру вместо прямых обработчиков"""
+        if self.listener is not None:
+            return
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Вывод оставшихся записей и остановка потока"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def get_stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.queue_handler.dropped,
+            'running': self.listener is not None
+        }
@@ -5,18 +5,31 @@ import time
 import atexit
 import signal
 from mqtt_broker import MQTTBroker
-from web_server import start_web_server
+from web_server import start_web_server, restore_state, save_state, Config as ServerConfig
 import threading
 from config import Config  # Импортируем автоматический конфиг
 
 class SystemLauncher:
-    def __init__(self):
+    def __init__(self, runtime=None):
         self.mqtt_broker = MQTTBroker()
         self.is_running = False
+        # 'threaded' (Flask + поток paho), 'asyncio' (async_server.py) или 'multiprocess' (multiprocess_server.py)
+        self.runtime = runtime or ServerConfig.SERVER_RUNTIME
+    
+    def get_server_runner(self):
+        """Функция запуска веб-сервера для выбранного режима"""
+        if self.runtime == 'asyncio':
+            from async_server import start_async_server
+            return start_async_server
+        if self.runtime == 'multiprocess':
+            from multiprocess_server import start_multiprocess_server
+            return start_multiprocess_server
+        return start_web_server
         
     def cleanup(self):
         """Очистка ресурсов при завершении"""
         print("\n🧹 Завершение работы системы...")
+        save_state()
         self.mqtt_broker.stop_broker()
         self.is_running = False
         print("✅ Система остановлена")
@@ -51,6 +64,10 @@ class SystemLauncher:
         atexit.register(self.cleanup)
         signal.signal(signal.SIGINT, lambda s, f: self.cleanup())
         
+        # Восстанавливаем устройства и события из журнала - дашборд сразу видит весь парк
+        restored = restore_state()
+        print(f"💾 Восстановлено устройств из журнала: {restored}")
+        
         # Запускаем MQTT брокер
         if not self.mqtt_broker.start_broker():
             print("❌ Не удалось запустить MQTT брокер")
@@ -62,8 +79,8 @@ class SystemLauncher:
             return
         
         # Запускаем веб-сервер в отдельном потоке
-        print("🌐 Запуск веб-интерфейса...")
-        web_thread = threading.Thread(target=start_web_server, daemon=True)
+        print(f"🌐 Запуск веб-интерфейса (режим {self.runtime})...")
+        web_thread = threading.Thread(target=self.get_server_runner(), daemon=True)
         web_thread.start()
         
         print("✅ Система успешно запущена!")
@@ -81,5 +98,8 @@ class SystemLauncher:
             self.cleanup()
 
 if __name__ == "__main__":
-    launcher = SystemLauncher()
+    # python main_launcher.py --asyncio - асинхронный режим сервера, --multiprocess - процесс приема и HTTP воркеры
+    runtime = ('asyncio' if '--asyncio' in sys.argv else 'multiprocess' if '--multiprocess' in sys.argv
+               else 'threaded' if '--threaded' in sys.argv else None)
+    launcher = SystemLauncher(runtime)
     launcher.start()
\ No newline at end of file
@@ -0,0 +1,271 @@
+# metrics.py - СЧЕТЧИКИ И ГИСТОГРАММЫ ДЛЯ /metrics (ТЕКСТОВЫЙ ФОРМАТ PROMETHEUS)
+import bisect
+import math
+import threading
+
+# Границы гистограмм длительностей по умолчанию, секунды
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Ячейки завершившихся потоков сворачиваются в общую сумму, когда их становится больше
+_FOLD_THRESHOLD = 64
+
+
+class _Sharded:
+    """Значение, разложенное по ячейкам потоков.
+
+    Каждый поток пишет только в свою ячейку (список), поэтому увеличение не
+    требует блокировки и новых объектов. Блокировка берется при первой записи
+    потока и при чтении, которое суммирует ячейки. Ячейки завершившихся
+    потоков (поток на HTTP запрос) складываются в _base.
+    """
+
+    __slots__ = ('_local', '_cells', '_base', '_lock', '_width')
+
+    def __init__(self, width):
+        self._local = threading.local()
+        self._cells = []
+        self._base = [0] * width
+        self._lock = threading.Lock()
+        self._width = width
+
+    def _new_cell(self):
+        cell = [0] * self._width
+        with self._lock:
+            if len(self._cells) >= _FOLD_THRESHOLD:
+                self._fold()
+            self._cells.append((threading.current_thread(), cell))
+        self._local.cell = cell
+        return cell
+
+    def _fold(self):
+        alive = []
+        base = self._base
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                for index, value in enumerate(cell):
+                    base[index] += value
+        self._cells = alive
+
+    def _snapshot(self):
+        with self._lock:
+            self._fold()
+            total = list(self._base)
+            for _, cell in self._cells:
+                for index, value in enumerate(cell):
+                    total[index] += value
+        return total
+
+
+class Counter(_Sharded):
+    """Монотонный счетчик"""
+
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            self._new_cell()[0] += amount
+
+    @property
+    def value(self):
+        return self._snapshot()[0]
+
+    def set(self, value):
+        """Установка значения (восстановление после перезапуска)"""
+        with self._lock:
+            self._fold()
+            self._base[0] = value - sum(cell[0] for _, cell in self._cells)
+
+
+class Histogram(_Sharded):
+    """Гистограмма: счетчики корзин и сумма наблюдений в ячейке потока"""
+
+    __slots__ = ('buckets',)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Корзины, переполнение (+Inf) и сумма
+        super().__init__(len(self.buckets) + 2)
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self):
+        """(счетчики корзин с +Inf, сумма, количество)"""
+        total = self._snapshot()
+        counts = total[:-1]
+        return counts, total[-1], sum(counts)
+
+
+class Family:
+    """Метрика с метками: дочерние счетчики или гистограммы по значениям меток.
+
+    labels() создает дочерний объект один раз; на горячем пути дочерние объекты
+    стоит получить заранее и хранить в словаре.
+    """
+
+    def __init__(self, name, documentation, kind, labelnames=(), factory=Counter):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        self._offset = 0
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self.factory()
+        return child
+
+    # Метрика без меток ведет себя как свой единственный дочерний объект
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def total(self):
+        """Сумма счетчика по всем меткам (с учетом set_total)"""
+        return self._offset + sum(child.value for child in list(self._children.values()))
+
+    def set_total(self, value):
+        """Смещение, после которого total() равен value (восстановление после перезапуска)"""
+        self._offset += value - self.total()
+
+    def collect(self):
+        """[(суффикс, метки, значение)] для вывода"""
+        samples = []
+        for values, child in sorted(self._children.items()):
+            labels = dict(zip(self.labelnames, values))
+            if self.kind == 'histogram':
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, bucket in zip(child.buckets + (math.inf,), counts):
+                    cumulative += bucket
+                    samples.append(('_bucket', {**labels, 'le': _format_bound(bound)}, cumulative))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, count))
+            else:
+                samples.append(('', labels, child.value))
+        return samples
+
+
+class CallbackMetric:
+    """Значение, вычисляемое при чтении /metrics (глубины очередей, устройства онлайн)
+
+    fn() возвращает число или словарь {значение метки (или кортеж значений): число}.
+    """
+
+    def __init__(self, name, documentation, fn, kind='gauge', labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        result = self.fn()
+        if not isinstance(result, dict):
+            return [('', {}, result)]
+        samples = []
+        for values, value in sorted(result.items()):
+            if not isinstance(values, tuple):
+                values = (values,)
+            samples.append(('', dict(zip(self.labelnames, values)), value))
+        return samples
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Registry:
+    """Набор метрик процесса и вывод в текстовом формате Prometheus 0.0.4"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            try:
+                samples = metric.collect()
+            except Exception as e:
+                lines.append(f"# {name}: ошибка сбора: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for suffix, labels, value in samples:
+                if labels:
+                    label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                    lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name}{suffix} {_format_value(value)}")
+        lines.append('')
+        return '\n'.join(lines)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Family(name, documentation, 'counter', labelnames, Counter))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Family(name, documentation, 'histogram', labelnames, lambda: Histogram(buckets)))
+
+
+def gauge(name, documentation, fn, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, documentation, fn, 'gauge', labelnames))
+
+
+def counter_callback(name, documentation, fn, labelnames=()):
+    """Счетчик, значение которого ведет другой компонент (get_stats)"""
+    return REGISTRY.register(CallbackMetric(name, documentation, fn, 'counter', labelnames))
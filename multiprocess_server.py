@@ -0,0 +1,512 @@
+# multiprocess_server.py - МНОГОПРОЦЕССНЫЙ РЕЖИМ: ОДИН ПРОЦЕСС MQTT И СОСТОЯНИЯ, N HTTP ВОРКЕРОВ
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+# Файл с адресом IPC и ключом для воркеров, запущенных отдельно (gunicorn)
+IPC_FILE = 'ipc.json'
+
+# Общая память: версия хранилища, номер последнего события, счетчики сообщений и ошибок, время записи
+_COUNTERS = struct.Struct('<QQQQd')
+
+# GET маршруты, которые воркер обслуживает из своей копии состояния
+LOCAL_PATHS = frozenset(('/', '/status', '/commands', '/devices', '/api/devices', '/api/devices/query',
+                         '/api/stream', '/api/system/events'))
+
+
+def is_local_route(path):
+    if path in LOCAL_PATHS or path.startswith('/static/'):
+        return True
+    return path.startswith('/api/device/') and path.endswith('/info')
+
+
+class SharedCounters:
+    """Счетчики состояния в общей памяти.
+
+    Процесс приема записывает их раз в интервал, воркеры читают без IPC: пока
+    версия не изменилась, запрос обслуживается из локальной копии без обращения
+    к владельцу состояния.
+    """
+
+    def __init__(self, name, create=False):
+        self.name = name
+        self.owner = create
+        if create:
+            try:
+                # Блок от аварийно завершенного прошлого запуска
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_COUNTERS.size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Воркер только читает блок: его resource_tracker не должен удалять блок при выходе воркера.
+            # Воркеры, запущенные через multiprocessing, используют трекер владельца - там запись общая
+            if multiprocessing.parent_process() is None:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+    def write(self, version, event_seq, message_count, error_count):
+        _COUNTERS.pack_into(self.shm.buf, 0, version, event_seq, message_count, error_count, time.time())
+
+    def read(self):
+        """(версия, номер события, сообщений, ошибок, время записи)"""
+        return _COUNTERS.unpack_from(self.shm.buf, 0)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# ========== ПРОЦЕСС ПРИЕМА (ВЛАДЕЛЕЦ СОСТОЯНИЯ) ==========
+
+class StateOwner:
+    """Сторона процесса приема: публикация версии в общей памяти и ответы воркерам по IPC.
+
+    Воркер запрашивает изменения с известной ему версии ('sync') и передает
+    сюда запросы, которым нужны данные только этого процесса - команды MQTT,
+    телеметрию, статистику ('http').
+    """
+
+    def __init__(self, storage, app, address, shm_name, authkey=None, interval=0.05):
+        self.storage = storage
+        self.app = app
+        self.address = tuple(address) if isinstance(address, list) else address
+        self.shm_name = shm_name
+        self.authkey = authkey or secrets.token_bytes(32)
+        self.interval = interval
+        self.counters = None
+        self.listener = None
+        self._stop_event = threading.Event()
+
+        self.sync_count = 0
+        self.full_sync_count = 0
+        self.proxied_count = 0
+        self.workers = 0
+
+    def start(self):
+        self.counters = SharedCounters(self.shm_name, create=True)
+        self.publish()
+        self.listener = Listener(self.address, authkey=self.authkey, backlog=64)
+        threading.Thread(target=self._publish_loop, name="state-publisher", daemon=True).start()
+        threading.Thread(target=self._accept_loop, name="state-ipc", daemon=True).start()
+        logger.info(f"✅ Владелец состояния: IPC {self.address}, общая память {self.shm_name}")
+        return self
+
+    def write_ipc_file(self, directory):
+        """Адрес и ключ для воркеров gunicorn (файл доступен только владельцу)"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, IPC_FILE)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'address': self.address, 'authkey': self.authkey.hex(), 'shm_name': self.shm_name}, f)
+        return path
+
+    def stop(self):
+        self._stop_event.set()
+        if self.listener is not None:
+            self.listener.close()
+        if self.counters is not None:
+            self.counters.close()
+
+    def publish(self):
+        storage = self.storage
+        self.counters.write(storage.version, storage.event_log.last_seq, storage.message_count, storage.error_count)
+
+    def _publish_loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи общей памяти: {e}")
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                # Неверный ключ или оборванное рукопожатие
+                logger.warning(f"⚠️ Отклонено IPC подключение: {e}")
+                continue
+            threading.Thread(target=self._serve_worker, args=(connection,), name="state-ipc-worker", daemon=True).start()
+
+    def _serve_worker(self, connection):
+        self.workers += 1
+        try:
+            while True:
+                try:
+                    request = connection.recv()
+                except (EOFError, OSError):
+                    break
+                kind = request[0]
+                try:
+                    if kind == 'sync':
+                        response = self.sync(*request[1:])
+                    elif kind == 'http':
+                        response = self.proxy(*request[1:])
+                    else:
+                        response = {'error': f"unknown request {kind}"}
+                except Exception as e:
+                    logger.error(f"❌ Ошибка обработки IPC запроса {kind}: {e}")
+                    response = {'error': str(e)}
+                connection.send(response)
+        finally:
+            self.workers -= 1
+            connection.close()
+
+    def sync(self, since, event_seq):
+        """Изменения после версии since: записи устройств в to_state() и их версии, новые события"""
+        storage = self.storage
+        changes = storage.changes
+        self.sync_count += 1
+
+        result = changes.changes_since(since) if since else None
+        if result is None:
+            # Первая синхронизация или история неполна - полная копия
+            self.full_sync_count += 1
+            version = storage.version
+            snapshot = storage.devices.snapshot()
+            devices = {device_id: record.to_state() for device_id, record in snapshot.items()}
+            removed = {}
+            full = True
+        else:
+            version, changed, removed_ids = result
+            snapshot = storage.devices.snapshot()
+            devices = {}
+            removed = {}
+            for device_id in changed:
+                record = snapshot.get(device_id)
+                if record is not None:
+                    devices[device_id] = record.to_state()
+                else:
+                    removed[device_id] = changes.version_of(device_id)
+            for device_id in removed_ids:
+                removed[device_id] = changes.version_of(device_id)
+            full = False
+
+        return {
+            'version': version,
+            'full': full,
+            'devices': devices,
+            'versions': {device_id: changes.version_of(device_id) for device_id in devices},
+            'removed': removed,
+            'events': storage.event_log.export(after=event_seq)
+        }
+
+    def proxy(self, method, path, query_string, headers, body):
+        """Выполнение HTTP запроса воркера приложением этого процесса"""
+        from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+        self.proxied_count += 1
+        builder = EnvironBuilder(path=path, method=method, query_string=query_string, headers=headers, data=body)
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        app_iter, status, response_headers = run_wsgi_app(self.app, environ, buffered=True)
+        try:
+            content = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        return status, response_headers.to_wsgi_list(), content
+
+    def get_stats(self):
+        return {
+            'workers': self.workers,
+            'sync_count': self.sync_count,
+            'full_sync_count': self.full_sync_count,
+            'proxied_count': self.proxied_count
+        }
+
+
+# ========== HTTP ВОРКЕР ==========
+
+class StateReplica:
+    """Копия устройств и событий процесса приема внутри HTTP воркера.
+
+    Записи применяются к обычному DeviceStorage воркера через apply_many, поэтому
+    индексы, кэш ответов и поток изменений (/api/stream) воркера работают как в
+    однопроцессном режиме. Версии берутся у владельца (MirroredChangeLog).
+    """
+
+    def __init__(self, storage, address, authkey, shm_name, interval=0.05):
+        from device_registry import MirroredChangeLog
+
+        self.storage = storage
+        self.address = tuple(address) if isinstance(address, list) else address
+        self.authkey = authkey
+        self.interval = interval
+        self.counters = SharedCounters(shm_name)
+        storage.changes = MirroredChangeLog()
+
+        self.version = None
+        self.event_seq = 0
+        self._counts = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.sync_count = 0
+
+    def call(self, *request):
+        """Запрос к процессу приема по соединению текущего потока (одна повторная попытка)"""
+        for attempt in (0, 1):
+            connection = getattr(self._local, 'connection', None)
+            try:
+                if connection is None:
+                    connection = self._local.connection = Client(self.address, authkey=self.authkey)
+                connection.send(request)
+                return connection.recv()
+            except (EOFError, OSError):
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def sync(self, wait=False):
+        """Догоняет владельца, если версия в общей памяти изменилась. False - копия уже актуальна"""
+        version, event_seq, message_count, error_count, _ = self.counters.read()
+        if (message_count, error_count) != self._counts:
+            # Счетчики хранилища - сумма ячеек по потокам, запись дороже сравнения
+            self._counts = (message_count, error_count)
+            self.storage.message_count = message_count
+            self.storage.error_count = error_count
+        if version == self.version and event_seq == self.event_seq:
+            return False
+
+        # Пока другой поток синхронизирует, запрос обслуживается из чуть устаревшей копии
+        if not self._lock.acquire(blocking=wait or self.version is None):
+            return False
+        try:
+            result = self.call('sync', self.version or 0, self.event_seq)
+            self._apply(result)
+            return True
+        finally:
+            self._lock.release()
+
+    def _apply(self, result):
+        from device_manager import DeviceRecord
+
+        storage = self.storage
+        records = {device_id: DeviceRecord.from_state(state) for device_id, state in result['devices'].items()}
+        removed = dict(result['removed'])
+        if result['full']:
+            for device_id in storage.devices.snapshot():
+                if device_id not in records:
+                    removed[device_id] = result['version']
+
+        operations = [(device_id, lambda old, record=record: record) for device_id, record in records.items()]
+        operations += [(device_id, lambda old: None) for device_id in removed]
+        storage.devices.apply_many(operations)
+        # Версии задаются после записей, как в процессе приема: запрос, прочитавший
+        # версию, видит запись не старше нее (record() в _track_change версии не меняет)
+        storage.changes.mirror(result['version'], result['versions'], removed, reset=result['full'])
+
+        events = result['events']
+        if events:
+            storage.event_log.restore(events)
+            self.event_seq = events[-1][0]
+        self.version = result['version']
+        self.sync_count += 1
+
+    def start(self):
+        """Первая синхронизация и фоновое слежение за версией (для потоковых клиентов)"""
+        self.sync(wait=True)
+        threading.Thread(target=self._sync_loop, name="state-replica", daemon=True).start()
+        return self
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"❌ Ошибка синхронизации с процессом приема: {e}")
+
+
+class WorkerApp:
+    """WSGI приложение воркера: чтения - из локальной копии, остальное - в процесс приема"""
+
+    def __init__(self, app, replica):
+        self.app = app
+        self.replica = replica
+        self.local_count = 0
+        self.proxied_count = 0
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        if method in ('GET', 'HEAD') and is_local_route(path):
+            self.local_count += 1
+            try:
+                self.replica.sync()
+            except Exception as e:
+                logger.error(f"❌ Ошибка синхронизации с процессом приема: {e}")
+            return self.app(environ, start_response)
+
+        self.proxied_count += 1
+        headers = [(key[5:].replace('_', '-').title(), value) for key, value in environ.items() if key.startswith('HTTP_')]
+        if environ.get('CONTENT_TYPE'):
+            headers.append(('Content-Type', environ['CONTENT_TYPE']))
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length) if length else b''
+
+        try:
+            status, response_headers, content = self.replica.call(
+                'http', method, path, environ.get('QUERY_STRING', ''), headers, body)
+        except (EOFError, OSError) as e:
+            logger.error(f"❌ Процесс приема недоступен: {e}")
+            content = json.dumps({'status': 'error', 'message': 'Ingest process unavailable'}).encode('utf-8')
+            status = '503 Service Unavailable'
+            response_headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(content)))]
+
+        start_response(status, response_headers)
+        return [content]
+
+
+def create_worker_app(address, authkey, shm_name):
+    """Приложение HTTP воркера, подключенное к процессу приема"""
+    import web_server
+
+    # Воркер не принимает MQTT и не пишет журнал - только поток изменений для /api/stream
+    replica = StateReplica(web_server.storage, address, authkey, shm_name,
+                           interval=web_server.Config.WORKER_SYNC_INTERVAL).start()
+    web_server.storage.feed.start()
+    return WorkerApp(web_server.app, replica)
+
+
+def worker_main(sock, address, authkey, shm_name):
+    """Точка входа процесса воркера: werkzeug на общем слушающем сокете"""
+    from werkzeug.serving import make_server
+
+    from multiprocessing.connection import wait
+
+    # Воркер завершается вместе с процессом приема, даже если тот остановлен сигналом
+    parent = multiprocessing.parent_process()
+    threading.Thread(target=lambda: (wait([parent.sentinel]), os._exit(0)), name="parent-watch", daemon=True).start()
+
+    app = create_worker_app(address, authkey, shm_name)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+class LazyWorkerApp:
+    """WSGI приложение для gunicorn: подключается к процессу приема при первом запросе.
+
+    Процесс приема запускается отдельно: python multiprocess_server.py --ingest
+    Воркеры: gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 multiprocess_server:application
+    """
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    from web_server import Config
+                    with open(os.path.join(Config.JOURNAL_DIR, IPC_FILE)) as f:
+                        ipc = json.load(f)
+                    self._app = create_worker_app(ipc['address'], bytes.fromhex(ipc['authkey']), ipc['shm_name'])
+        return self._app(environ, start_response)
+
+
+application = LazyWorkerApp()
+
+
+# ========== ЗАПУСК ==========
+
+def start_owner(with_mqtt=True):
+    """Процесс приема: состояние, фоновые службы, MQTT и IPC для воркеров"""
+    import web_server
+    Config = web_server.Config
+
+    web_server.start_services()
+    if with_mqtt and not web_server.setup_mqtt():
+        logger.error("❌ Не удалось запустить MQTT клиент")
+
+    owner = StateOwner(web_server.storage, web_server.app, Config.WORKER_IPC_ADDRESS, Config.WORKER_SHARED_STATE,
+                       interval=Config.WORKER_SYNC_INTERVAL).start()
+    owner.write_ipc_file(Config.JOURNAL_DIR)
+    web_server.storage.log_event("Процесс приема запущен (многопроцессный режим)")
+    return owner
+
+
+def serve(host=None, port=None, workers=None, with_mqtt=True, stop_event=None):
+    """Процесс приема в текущем процессе и workers HTTP воркеров на общем сокете"""
+    import web_server
+    Config = web_server.Config
+    host = host or Config.WEB_HOST
+    port = port or Config.WEB_PORT
+    workers = workers or Config.WEB_WORKERS
+
+    owner = start_owner(with_mqtt)
+    sock = socket.create_server((host, port), backlog=2048)
+    context = multiprocessing.get_context('spawn')
+    args = (sock, owner.address, owner.authkey, owner.shm_name)
+
+    def spawn():
+        process = context.Process(target=worker_main, args=args, daemon=True)
+        process.start()
+        return process
+
+    processes = [spawn() for _ in range(workers)]
+    logger.info(f"🚀 HTTP воркеров: {workers}, адрес http://{web_server.LOCAL_IP}:{port}")
+
+    stop_event = stop_event or threading.Event()
+    try:
+        # Упавший воркер перезапускается, процесс приема продолжает работу
+        while not stop_event.wait(1.0):
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning(f"⚠️ HTTP воркер {process.pid} завершился (код {process.exitcode}), перезапуск")
+                    processes[index] = spawn()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=5)
+        sock.close()
+        owner.stop()
+
+
+def start_multiprocess_server():
+    """Запуск веб-сервера в многопроцессном режиме (аналог web_server.start_web_server)"""
+    try:
+        serve()
+        return True
+    except Exception as e:
+        logger.error(f"❌ Ошибка запуска многопроцессного сервера: {e}")
+        return False
+
+
+# Запуск при прямом выполнении: --ingest - только процесс приема (для воркеров gunicorn)
+if __name__ == '__main__':
+    import sys
+
+    if '--ingest' in sys.argv:
+        owner = start_owner()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            owner.stop()
+    else:
+        start_multiprocess_server()
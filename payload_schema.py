@@ -0,0 +1,442 @@
+# payload_schema.py - ДЕКЛАРАТИВНЫЕ СХЕМЫ ПОЛЕЙ СООБЩЕНИЙ УСТРОЙСТВ
+import json
+import re
+import socket
+import struct
+
+# Быстрый JSON парсер, если установлен (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(payload):
+    """Разбор JSON прямо из bytes payload (orjson, если доступен)"""
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+# ========== ПРЕОБРАЗОВАНИЕ ЗНАЧЕНИЙ ==========
+# Преобразователь возвращает значение поля или бросает TypeError/ValueError
+
+def as_int(value):
+    if type(value) is int:
+        return value
+    if type(value) is float:
+        return int(value)
+    raise TypeError(f"ожидалось число, получено {type(value).__name__}")
+
+
+def as_str(value):
+    if type(value) is str:
+        return value
+    raise TypeError(f"ожидалась строка, получено {type(value).__name__}")
+
+
+def as_bool(value):
+    if type(value) is bool:
+        return value
+    if value in (0, 1) and type(value) is int:
+        return bool(value)
+    raise TypeError(f"ожидался bool, получено {value!r}")
+
+
+_BYTE = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+_RGB_MATCH = re.compile(f"{_BYTE},{_BYTE},{_BYTE}").fullmatch
+
+
+def as_rgb(value):
+    """Цвет "r,g,b" с компонентами 0..255"""
+    if type(value) is str and _RGB_MATCH(value):
+        return value
+    raise ValueError(f"неверный цвет {value!r}")
+
+
+# Встраиваемые в сгенерированный код проверки (эквивалентны as_int/as_str/as_bool)
+_INLINE_CHECKS = {
+    as_int: ('if type(value) is int:', '    f{slot} = value',
+             'elif type(value) is float:', '    f{slot} = int(value)'),
+    as_str: ('if type(value) is str:', '    f{slot} = value'),
+    as_bool: ('if type(value) is bool:', '    f{slot} = value',
+              'elif type(value) is int and (value == 0 or value == 1):', '    f{slot} = value == 1'),
+}
+
+
+class Field:
+    """Поле схемы: имя в результате, ключи в JSON (по убыванию приоритета), значение по умолчанию"""
+
+    __slots__ = ('name', 'aliases', 'default', 'convert')
+
+    def __init__(self, name, aliases, default, convert):
+        self.name = name
+        self.aliases = tuple(aliases)
+        self.default = default
+        self.convert = convert
+
+
+class MessageSchema:
+    """Схема сообщения, скомпилированная в одну функцию разбора.
+
+    По таблице полей генерируется функция без циклов: для каждого поля поиск
+    ключей в порядке приоритета (короткий ключ, затем длинный - длинный ищется,
+    только если короткого нет) и проверка типа. Неверное значение заменяется
+    значением по умолчанию и считается. Неизвестные ключи ищутся отдельным
+    проходом, только если в сообщении есть ключи не из схемы.
+    """
+
+    MAX_TRACKED_KEYS = 64
+
+    def __init__(self, name, fields, ignore=()):
+        self.name = name
+        self.fields = tuple(fields)
+        self.ignore = frozenset(ignore)
+        self.known = frozenset(alias for field in self.fields for alias in field.aliases) | self.ignore
+        self._aliases = {field.name: field.aliases for field in self.fields}
+
+        self.decoded_count = 0
+        self.unknown_count = 0
+        self.invalid_count = 0
+        self.unknown_keys = {}
+        self.invalid_fields = {}
+
+        self.decode = self._compile()
+
+    def _compile(self):
+        """Генерация функции decode(data) -> {поле: значение}"""
+        # Константы передаются в фабрику и доступны функции как замыкания (без поиска в globals)
+        constants = {'_MISSING': object(), '_schema': self, '_known': self.known, 'type': type,
+                     'int': int, 'float': float, 'str': str, 'bool': bool}
+        lines = [
+            'def decode(data):',
+            '    get = data.get'
+        ]
+        for slot, field in enumerate(self.fields):
+            constants[f'_default{slot}'] = field.default
+            constants[f'_convert{slot}'] = field.convert
+            lines.append(f'    value = get({field.aliases[0]!r}, _MISSING)')
+            indent = '    '
+            for alias in field.aliases[1:]:
+                lines.append(f'{indent}if value is _MISSING:')
+                indent += '    '
+                lines.append(f'{indent}value = get({alias!r}, _MISSING)')
+            lines += [
+                '    if value is _MISSING:',
+                f'        f{slot} = _default{slot}'
+            ]
+            # Частые проверки типов встраиваются в код, остальные - вызов преобразователя
+            check = _INLINE_CHECKS.get(field.convert)
+            if check is not None:
+                check = [line.replace('{slot}', str(slot)) for line in check]
+                lines += [f'    el{check[0]}'] + [f'    {line}' for line in check[1:]]
+                lines += [
+                    '    else:',
+                    f'        f{slot} = _default{slot}',
+                    f'        _schema._count_invalid({field.name!r})'
+                ]
+            else:
+                lines += [
+                    '    else:',
+                    '        try:',
+                    f'            f{slot} = _convert{slot}(value)',
+                    '        except (TypeError, ValueError):',
+                    f'            f{slot} = _default{slot}',
+                    f'            _schema._count_invalid({field.name!r})'
+                ]
+        lines += [
+            '    if not data.keys() <= _known:',
+            '        _schema._count_unknown_keys(data)',
+            '    _schema.decoded_count += 1',
+            '    return {' + ', '.join(f'{field.name!r}: f{slot}' for slot, field in enumerate(self.fields)) + '}'
+        ]
+
+        source = '\n'.join([f"def make({', '.join(constants)}):"] +
+                           ['    ' + line for line in lines] + ['    return decode'])
+        namespace = {}
+        exec(compile(source, f'<schema {self.name}>', 'exec'), namespace)
+        return namespace['make'](**constants)
+
+    def _count_unknown_keys(self, data):
+        for key in data:
+            if key not in self.known:
+                self._count_unknown(key)
+
+    @staticmethod
+    def load(payload):
+        """JSON объект из payload (bytes или str); ValueError, если это не объект"""
+        data = loads(payload)
+        if not isinstance(data, dict):
+            raise ValueError(f"ожидался JSON объект, получено {type(data).__name__}")
+        return data
+
+    def decode_bytes(self, payload):
+        """Разбор payload (bytes или str); ValueError, если это не JSON объект"""
+        return self.decode(self.load(payload))
+
+    def present_values(self, data, names):
+        """Исходные значения полей names, которые есть в data (без значений по умолчанию)"""
+        result = {}
+        for name in names:
+            for alias in self._aliases[name]:
+                if alias in data:
+                    result[name] = data[alias]
+                    break
+        return result
+
+    def _count_unknown(self, key):
+        self.unknown_count += 1
+        if key in self.unknown_keys or len(self.unknown_keys) < self.MAX_TRACKED_KEYS:
+            self.unknown_keys[key] = self.unknown_keys.get(key, 0) + 1
+
+    def _count_invalid(self, name):
+        self.invalid_count += 1
+        self.invalid_fields[name] = self.invalid_fields.get(name, 0) + 1
+
+    def get_stats(self):
+        return {
+            'decoded_count': self.decoded_count,
+            'unknown_count': self.unknown_count,
+            'invalid_count': self.invalid_count,
+            'unknown_keys': dict(self.unknown_keys),
+            'invalid_fields': dict(self.invalid_fields)
+        }
+
+
+# ========== СХЕМЫ СООБЩЕНИЙ ==========
+# Короткие ключи - компактный статус NodeMCU, длинные - полный статус и скетч Wemos
+
+STATUS_SCHEMA = MessageSchema('status', (
+    Field('device_type', ('t', 'type'), 'unknown', as_str),
+    Field('ip_address', ('ip',), 'unknown', as_str),
+    Field('mac', ('mac',), '', as_str),
+    Field('rssi', ('rssi',), 0, as_int),
+    Field('free_heap', ('heap', 'free_heap'), 0, as_int),
+    Field('uptime', ('up', 'uptime'), 0, as_int),
+    Field('version', ('ver', 'version'), 'unknown', as_str),
+    Field('firmware', ('fw', 'firmware'), 'unknown', as_str),
+    Field('config_mode', ('cfg', 'config_mode'), False, as_bool),
+    Field('mqtt_broker', ('mqtt', 'mqtt_broker'), '', as_str),
+    Field('led_state', ('led_s', 'led_state'), True, as_bool),
+    # Поля для RGB устройств
+    Field('action_button_pressed', ('btn', 'action_button_pressed'), False, as_bool),
+    Field('led_on', ('led', 'led_on'), True, as_bool),
+    Field('rgb_color', ('rgb', 'rgb_color'), '0,0,0', as_rgb),
+    Field('available', ('avail', 'available'), True, as_bool),
+), ignore=('id', 'device_id', 'board', 'timestamp'))
+
+BUTTON_SCHEMA = MessageSchema('button', (
+    Field('action_button_pressed', ('action_button_pressed', 'btn'), False, as_bool),
+    Field('led_on', ('led_on', 'led'), True, as_bool),
+), ignore=('id', 'device_id', 'timestamp'))
+
+ERROR_SCHEMA = MessageSchema('error', (
+    Field('error', ('error',), 'Unknown error', as_str),
+), ignore=('id', 'device_id', 'timestamp'))
+
+# Подтверждение команды: cid из payload команды, результат выполнения
+ACK_SCHEMA = MessageSchema('ack', (
+    Field('command_id', ('cid',), '', as_str),
+    Field('ok', ('ok',), True, as_bool),
+    Field('error', ('err', 'error'), '', as_str),
+), ignore=('id', 'device_id', 'command', 'timestamp'))
+
+SCHEMAS = {schema.name: schema for schema in (STATUS_SCHEMA, BUTTON_SCHEMA, ERROR_SCHEMA, ACK_SCHEMA)}
+
+
+# ========== БИНАРНЫЙ ФОРМАТ ==========
+# Компактный формат для топиков devices/<id>/<тип>/bin (или MQTT 5 content-type
+# BINARY_CONTENT_TYPE). Порядок байт little-endian, как у ESP8266, первый байт -
+# версия формата. Строки - 1 байт длины и UTF-8. Результат разбора совпадает с
+# результатом JSON схемы того же типа сообщения.
+
+BINARY_VERSION = 1
+BINARY_SUFFIX = 'bin'
+BINARY_CONTENT_TYPE = 'application/x-device-struct'
+
+# Биты байта флагов статуса
+FLAG_CONFIG_MODE = 0x01
+FLAG_LED_STATE = 0x02
+FLAG_BUTTON_PRESSED = 0x04
+FLAG_LED_ON = 0x08
+FLAG_AVAILABLE = 0x10
+
+# версия, флаги, ip, mac, rssi, free_heap, uptime, r, g, b
+_STATUS_HEAD = struct.Struct('<BB4s6sbII3B')
+# Строки после фиксированной части; отсутствующие в конце payload - значения по умолчанию
+_STATUS_STRINGS = (('device_type', 'unknown'), ('version', 'unknown'),
+                   ('firmware', 'unknown'), ('mqtt_broker', ''))
+_BUTTON_HEAD = struct.Struct('<BB')  # версия, флаги (бит 0 - кнопка, бит 1 - светодиод)
+_DATA_VALUE = struct.Struct('<f')
+
+# Флаги статуса -> (config_mode, led_state, action_button_pressed, led_on, available)
+_STATUS_FLAGS = tuple(
+    (bool(flags & FLAG_CONFIG_MODE), bool(flags & FLAG_LED_STATE), bool(flags & FLAG_BUTTON_PRESSED),
+     bool(flags & FLAG_LED_ON), bool(flags & FLAG_AVAILABLE))
+    for flags in range(256)
+)
+_NO_IP = bytes(4)
+_NO_MAC = bytes(6)
+
+
+def _read_string(view, offset):
+    size = view[offset]
+    end = offset + 1 + size
+    if end > len(view):
+        raise ValueError(f"строка выходит за конец payload ({end} > {len(view)})")
+    return str(view[offset + 1:end], 'utf-8'), end
+
+
+def _pack_string(value):
+    data = str(value).encode('utf-8')[:255]
+    return bytes((len(data),)) + data
+
+
+def _decode_status(view):
+    _, flags, ip, mac, rssi, free_heap, uptime, red, green, blue = _STATUS_HEAD.unpack_from(view)
+    config_mode, led_state, pressed, led_on, available = _STATUS_FLAGS[flags]
+
+    strings = []
+    offset = _STATUS_HEAD.size
+    end = len(view)
+    for _, default in _STATUS_STRINGS:
+        if offset < end:
+            size = view[offset]
+            offset += 1 + size
+            if offset > end:
+                raise ValueError(f"строка выходит за конец payload ({offset} > {end})")
+            strings.append(str(view[offset - size:offset], 'utf-8'))
+        else:
+            strings.append(default)
+    device_type, version, firmware, mqtt_broker = strings
+
+    return {
+        'device_type': device_type,
+        'ip_address': socket.inet_ntoa(ip) if ip != _NO_IP else 'unknown',
+        'mac': mac.hex(':').upper() if mac != _NO_MAC else '',
+        'rssi': rssi,
+        'free_heap': free_heap,
+        'uptime': uptime,
+        'version': version,
+        'firmware': firmware,
+        'config_mode': config_mode,
+        'mqtt_broker': mqtt_broker,
+        'led_state': led_state,
+        'action_button_pressed': pressed,
+        'led_on': led_on,
+        'rgb_color': f"{red},{green},{blue}",
+        'available': available
+    }
+
+
+def encode_status(data):
+    """Бинарный статус из словаря с именами полей STATUS_SCHEMA (как пишет скетч)"""
+    ip = data.get('ip_address', 'unknown')
+    ip = socket.inet_aton(ip) if ip != 'unknown' else _NO_IP
+    mac = data.get('mac', '')
+    mac = bytes.fromhex(mac.replace(':', '')) if mac else _NO_MAC
+    rgb = [int(part) for part in data.get('rgb_color', '0,0,0').split(',')]
+    flags = ((FLAG_CONFIG_MODE if data.get('config_mode', False) else 0) |
+             (FLAG_LED_STATE if data.get('led_state', True) else 0) |
+             (FLAG_BUTTON_PRESSED if data.get('action_button_pressed', False) else 0) |
+             (FLAG_LED_ON if data.get('led_on', True) else 0) |
+             (FLAG_AVAILABLE if data.get('available', True) else 0))
+    head = _STATUS_HEAD.pack(BINARY_VERSION, flags, ip, mac, data.get('rssi', 0),
+                             data.get('free_heap', 0), data.get('uptime', 0), *rgb)
+    return head + b''.join(_pack_string(data.get(name, default)) for name, default in _STATUS_STRINGS)
+
+
+def _decode_button(view):
+    _, flags = _BUTTON_HEAD.unpack_from(view)
+    return {'action_button_pressed': bool(flags & 0x01), 'led_on': bool(flags & 0x02)}
+
+
+def encode_button(data):
+    flags = (0x01 if data.get('action_button_pressed') else 0) | (0x02 if data.get('led_on', True) else 0)
+    return _BUTTON_HEAD.pack(BINARY_VERSION, flags)
+
+
+def _decode_data(view):
+    """Показатели датчиков: пары (имя, float32) до конца payload"""
+    result = {}
+    offset = 1
+    end = len(view)
+    while offset < end:
+        name, offset = _read_string(view, offset)
+        (result[name],) = _DATA_VALUE.unpack_from(view, offset)
+        offset += _DATA_VALUE.size
+    return result
+
+
+def encode_data(data):
+    return bytes((BINARY_VERSION,)) + b''.join(
+        _pack_string(name) + _DATA_VALUE.pack(value) for name, value in data.items())
+
+
+def _decode_error(view):
+    return {'error': str(view[1:], 'utf-8')}
+
+
+def encode_error(data):
+    return bytes((BINARY_VERSION,)) + str(data.get('error', '')).encode('utf-8')
+
+
+class BinaryLayout:
+    """Бинарное представление одного типа сообщений.
+
+    Разбор идет по memoryview payload: struct.unpack_from читает фиксированную
+    часть прямо из буфера MQTT сообщения, строки декодируются из срезов
+    memoryview без промежуточных копий bytes.
+    """
+
+    def __init__(self, name, decode, encode, min_size=1):
+        self.name = name
+        self._decode = decode
+        self.encode = encode
+        self.min_size = min_size
+
+        self.decoded_count = 0
+        self.invalid_count = 0
+        self.bytes_count = 0
+
+    def decode_bytes(self, payload):
+        """Разбор payload; ValueError, если версия неизвестна или данные обрезаны"""
+        view = memoryview(payload)
+        try:
+            if len(view) < self.min_size:
+                raise ValueError(f"payload {len(view)} байт, нужно не меньше {self.min_size}")
+            if view[0] != BINARY_VERSION:
+                raise ValueError(f"неизвестная версия бинарного формата {view[0]}")
+            result = self._decode(view)
+        except (struct.error, UnicodeDecodeError, IndexError) as e:
+            self.invalid_count += 1
+            raise ValueError(f"поврежденный бинарный payload: {e}") from None
+        except ValueError:
+            self.invalid_count += 1
+            raise
+        self.decoded_count += 1
+        self.bytes_count += len(view)
+        return result
+
+    def get_stats(self):
+        return {
+            'decoded_count': self.decoded_count,
+            'invalid_count': self.invalid_count,
+            'avg_size': round(self.bytes_count / self.decoded_count, 1) if self.decoded_count else 0
+        }
+
+
+BINARY_LAYOUTS = {layout.name: layout for layout in (
+    BinaryLayout('status', _decode_status, encode_status, _STATUS_HEAD.size),
+    BinaryLayout('button', _decode_button, encode_button, _BUTTON_HEAD.size),
+    BinaryLayout('data', _decode_data, encode_data),
+    BinaryLayout('error', _decode_error, encode_error),
+)}
+
+
+def get_stats():
+    """Статистика разбора по всем схемам"""
+    stats = {name: schema.get_stats() for name, schema in SCHEMAS.items()}
+    stats['parser'] = 'orjson' if orjson is not None else 'json'
+    stats['binary'] = {name: layout.get_stats() for name, layout in BINARY_LAYOUTS.items()}
+    return stats
@@ -0,0 +1,263 @@
+# profiling.py - ВСТРОЕННОЕ ПРОФИЛИРОВАНИЕ: СЭМПЛЕР СТЕКОВ, СПАНЫ ЭТАПОВ, ЖУРНАЛ МЕДЛЕННЫХ СООБЩЕНИЙ
+"""Результаты сэмплера и трассировки - свернутые стеки (collapsed stacks):
+строка "кадр;кадр;...;кадр вес", формат flamegraph.pl, speedscope и inferno.
+"""
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Кадры ожидания: стеки, которые на них заканчиваются, - простаивающие потоки
+IDLE_FRAMES = frozenset((
+    ('wait', 'threading.py'), ('get', 'queue.py'), ('select', 'selectors.py'), ('poll', 'selectors.py'),
+    ('accept', 'socket.py'), ('readinto', 'socket.py'), ('_recv', 'connection.py'), ('_poll', 'connection.py'),
+    ('serve_forever', 'socketserver.py'), ('_worker', 'thread.py'), ('_loop_forever', 'client.py'),
+))
+
+
+class SamplingProfiler:
+    """Сэмплер стеков всех потоков через sys._current_frames().
+
+    Не требует перезапуска и инструментирования: раз в interval секунд
+    снимаются стеки потоков, одинаковые стеки считаются. Корень стека - имя
+    потока, поэтому потоки конвейера, paho и HTTP видны отдельно.
+    """
+
+    def __init__(self, max_seconds=60, default_interval=0.005):
+        self.max_seconds = max_seconds
+        self.default_interval = default_interval
+        self._lock = threading.Lock()
+        self._labels = {}
+        self.runs = 0
+
+    @property
+    def running(self):
+        return self._lock.locked()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def profile(self, seconds, interval=None, include_idle=False):
+        """Сэмплирование в течение seconds: ({свернутый стек: число сэмплов}, число снимков).
+
+        None, если профилирование уже идет.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self.runs += 1
+            interval = max(0.001, interval or self.default_interval)
+            deadline = time.monotonic() + min(seconds, self.max_seconds)
+            own = threading.get_ident()
+            stacks = {}
+            snapshots = 0
+
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    code = frame.f_code
+                    if not include_idle and (code.co_name, os.path.basename(code.co_filename)) in IDLE_FRAMES:
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(self._label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    key = ';'.join(reversed(labels))
+                    stacks[key] = stacks.get(key, 0) + 1
+                snapshots += 1
+                time.sleep(interval)
+
+            return stacks, snapshots
+        finally:
+            self._lock.release()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'token')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.token = self.tracer.begin(self.name)
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.end(self.token)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class SpanTracer:
+    """Спаны этапов обработки с собственным временем для свернутых стеков.
+
+    Пока трассировка выключена, span() возвращает общий пустой объект, а
+    begin()/add() - только проверка флага. Во время trace() каждый поток ведет
+    стек открытых спанов; при закрытии собственное время спана (без вложенных)
+    добавляется к пути "внешний;...;спан" в микросекундах.
+    """
+
+    def __init__(self, max_seconds=60):
+        self.max_seconds = max_seconds
+        self.enabled = False
+        self._local = threading.local()
+        self._totals = {}
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._run_lock.locked()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def span(self, name):
+        """Контекстный менеджер спана (пустой, если трассировка выключена)"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name)
+
+    def begin(self, name):
+        """Открытие спана: токен для end() или None, если трассировка выключена"""
+        if not self.enabled:
+            return None
+        token = [name, time.perf_counter(), 0.0]
+        self._stack().append(token)
+        return token
+
+    def end(self, token):
+        if token is None:
+            return
+        elapsed = time.perf_counter() - token[1]
+        stack = self._stack()
+        if not any(entry is token for entry in stack):
+            return
+        # Незакрытые вложенные спаны (исключение до end) закрываются вместе с этим
+        while stack[-1] is not token:
+            stack.pop()
+        path = ';'.join(entry[0] for entry in stack)
+        stack.pop()
+        if stack:
+            stack[-1][2] += elapsed
+        self._record(path, elapsed - token[2])
+
+    def add(self, name, seconds):
+        """Уже измеренный этап как вложенный спан текущего (без повторного замера времени)"""
+        if not self.enabled:
+            return
+        stack = self._stack()
+        if stack:
+            stack[-1][2] += seconds
+            path = ';'.join(entry[0] for entry in stack) + ';' + name
+        else:
+            path = name
+        self._record(path, seconds)
+
+    def _record(self, path, seconds):
+        with self._lock:
+            self._totals[path] = self._totals.get(path, 0.0) + seconds
+
+    def trace(self, seconds):
+        """Сбор спанов в течение seconds: {путь: микросекунды} или None, если трассировка уже идет"""
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        try:
+            with self._lock:
+                self._totals = {}
+            self.enabled = True
+            time.sleep(min(seconds, self.max_seconds))
+            self.enabled = False
+            with self._lock:
+                totals, self._totals = self._totals, {}
+            return {path: int(value * 1e6) for path, value in totals.items() if value > 0}
+        finally:
+            self.enabled = False
+            self._run_lock.release()
+
+
+class SlowMessageLog:
+    """Кольцевой журнал сообщений, обработка которых заняла больше threshold секунд"""
+
+    def __init__(self, threshold=0.02, capacity=200, payload_bytes=512):
+        self.threshold = threshold
+        self.payload_bytes = payload_bytes
+        self.enabled = False
+        self._entries = deque(maxlen=capacity)
+        self.recorded_count = 0
+
+    def record_message(self, device_id, message_type, payload, decode_seconds, received_at):
+        """Медленный разбор сообщения: payload сохраняется (текст или hex для бинарного формата)"""
+        self.recorded_count += 1
+        data = bytes(payload[:self.payload_bytes])
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.hex(' ')
+        self._entries.append({
+            'kind': 'decode',
+            'time': time.time(),
+            'device_id': device_id,
+            'type': message_type,
+            'decode_ms': round(decode_seconds * 1000, 3),
+            'queue_ms': round((time.time() - received_at) * 1000, 3),
+            'size': len(payload),
+            'payload': text,
+            'truncated': len(payload) > self.payload_bytes
+        })
+
+    def record_batch(self, stage, seconds, device_ids, message_count):
+        """Медленный этап пачки (применение к хранилищу): устройства вместо payload"""
+        self.recorded_count += 1
+        self._entries.append({
+            'kind': stage,
+            'time': time.time(),
+            'elapsed_ms': round(seconds * 1000, 3),
+            'messages': message_count,
+            'devices': list(device_ids)[:20],
+            'device_count': len(device_ids)
+        })
+
+    def get_entries(self, limit=50):
+        entries = list(self._entries)
+        return entries[-limit:][::-1] if limit else []
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        return {
+            'enabled': self.enabled,
+            'threshold_ms': self.threshold * 1000,
+            'recorded_count': self.recorded_count,
+            'stored': len(self._entries)
+        }
+
+
+def format_collapsed(stacks):
+    """Свернутые стеки, самые тяжелые сначала"""
+    return ''.join(f"{stack} {weight}\n" for stack, weight in sorted(stacks.items(), key=lambda item: -item[1]))
@@ -0,0 +1,95 @@
+# response_cache.py - КЭШ ГОТОВЫХ JSON ОТВЕТОВ ДЛЯ ЧАСТО ОПРАШИВАЕМЫХ API
+import gzip
+import json
+import threading
+import time
+
+# Быстрый JSON кодировщик, если установлен (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json(data):
+    """Кодирование в JSON байты (orjson, если доступен, иначе стандартный json)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class CachedResponse:
+    """Готовое тело ответа и его gzip-версия"""
+
+    __slots__ = ('version', 'body', 'gzipped', 'etag', 'created_at')
+
+    def __init__(self, version, body, gzipped, etag, created_at):
+        self.version = version
+        self.body = body
+        self.gzipped = gzipped
+        self.etag = etag
+        self.created_at = created_at
+
+
+class ResponseCache:
+    """Кэш закодированных ответов с ключом (эндпоинт, параметры) и версией хранилища.
+
+    Запись считается актуальной, пока версия совпадает с текущей версией данных
+    (и не истек max_age, если он задан). Любое изменение хранилища поднимает
+    версию, поэтому устаревшие тела никогда не отдаются.
+    """
+
+    def __init__(self, max_entries=512, compress=True, gzip_min_size=1024, gzip_level=5):
+        self.max_entries = max_entries
+        self.compress = compress
+        self.gzip_min_size = gzip_min_size
+        self.gzip_level = gzip_level
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, version, builder, max_age=None, etag=None):
+        """Готовый ответ из кэша или построенный через builder() и закодированный один раз"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if (entry is not None and entry.version == version and
+                (max_age is None or now - entry.created_at < max_age)):
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        body = encode_json(builder())
+        gzipped = None
+        if self.compress and len(body) >= self.gzip_min_size:
+            gzipped = gzip.compress(body, self.gzip_level)
+
+        entry = CachedResponse(version, body, gzipped, etag, now)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            # Вытесняем самые старые записи
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+        return entry
+
+    def invalidate(self, key=None):
+        """Сброс одной записи или всего кэша"""
+        with self._lock:
+            if key is None:
+                self._entries = {}
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0,
+            'encoder': 'orjson' if orjson is not None else 'json',
+            'gzip': self.compress
+        }
@@ -27,9 +27,7 @@ class ESPDeviceManager {
             const data = await response.json();
 
             if (data.status === 'success') {
-                this.updateDevicesDisplay(data.devices);
-                this.updateStats(data.stats);
-                this.systemStatus.mqtt = true;
+                this.applySnapshot(data);
             }
         } catch (error) {
             console.error('Ошибка загрузки устройств:', error);
@@ -39,6 +37,33 @@ class ESPDeviceManager {
         this.updateSystemStatus();
     }
 
+    applySnapshot(data) {
+        this.devices = new Map(data.devices.map(device => [device.id, device]));
+        this.updateDevicesDisplay(Array.from(this.devices.values()));
+        this.updateStats(data.stats);
+        this.systemStatus.mqtt = true;
+    }
+
+    applyDelta(data) {
+        // Дельты содержат только измененные поля; офлайн устройства убираем, как и /api/devices
+        for (const change of data.changes) {
+            if (change.op === 'remove') {
+                this.devices.delete(change.id);
+                continue;
+            }
+
+            const device = Object.assign({}, this.devices.get(change.id), change.device);
+            if (device.status === 'connected' && device.type !== undefined) {
+                this.devices.set(change.id, device);
+            } else {
+                this.devices.delete(change.id);
+            }
+        }
+
+        this.updateDevicesDisplay(Array.from(this.devices.values()));
+        if (data.stats) this.updateStats(data.stats);
+    }
+
     updateDevicesDisplay(devices) {
         const devicesList = document.getElementById('devices-list');
         if (!devicesList) return;
@@ -270,11 +295,46 @@ class ESPDeviceManager {
     }
 
     startAutoRefresh() {
+        // Если браузер поддерживает SSE - получаем изменения потоком, иначе опрашиваем
+        if (window.EventSource) {
+            this.startStream();
+            return;
+        }
+
+        this.startPolling();
+    }
+
+    startPolling() {
         // Обновляем устройства каждые 5 секунд
-        setInterval(() => {
+        if (this.pollTimer) return;
+        this.pollTimer = setInterval(() => {
             this.loadDevices();
         }, 5000);
     }
+
+    startStream() {
+        const source = new EventSource('/api/stream');
+
+        source.addEventListener('snapshot', event => {
+            this.applySnapshot(JSON.parse(event.data));
+            this.updateSystemStatus();
+        });
+
+        source.addEventListener('delta', event => {
+            this.applyDelta(JSON.parse(event.data));
+        });
+
+        source.onerror = () => {
+            // EventSource переподключается сам; при окончательном закрытии переходим на опрос
+            this.systemStatus.mqtt = false;
+            this.updateSystemStatus();
+            if (source.readyState === EventSource.CLOSED) {
+                this.startPolling();
+            }
+        };
+
+        this.stream = source;
+    }
 }
 
 // Глобальные функции
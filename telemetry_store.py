@@ -0,0 +1,418 @@
+# telemetry_store.py - ХРАНИЛИЩЕ ИСТОРИИ ТЕЛЕМЕТРИИ УСТРОЙСТВ
+import bisect
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b'TSEG0001'
+SEGMENT_SUFFIX = '.tsg'
+_HEADER_LEN = struct.Struct('<I')
+
+
+class Segment:
+    """Неизменяемый сегмент: колонки float64 (время и по одной на метрику), строки
+    упорядочены по устройству, затем по времени.
+
+    Формат файла: MAGIC | длина заголовка | JSON заголовок (выравнен до 8 байт) | колонки.
+    В заголовке - метрики и диапазоны строк устройств. Колонки читаются через mmap
+    без копирования.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.metrics = []
+        self.devices = {}
+        self.t_min = 0.0
+        self.t_max = 0.0
+        self._file = None
+        self._mmap = None
+        self._columns = None
+
+    @staticmethod
+    def write(path, rows, metrics):
+        """Запись сегмента из строк (device_id, timestamp, {метрика: значение}), атомарно"""
+        rows = sorted(rows, key=lambda row: (row[0], row[1]))
+        devices = {}
+        timestamps = array('d')
+        columns = {metric: array('d') for metric in metrics}
+        nan = math.nan
+
+        for position, (device_id, timestamp, values) in enumerate(rows):
+            span = devices.get(device_id)
+            if span is None:
+                devices[device_id] = [position, 1]
+            else:
+                span[1] += 1
+            timestamps.append(timestamp)
+            for metric, column in columns.items():
+                column.append(values.get(metric, nan))
+
+        header = json.dumps({
+            'count': len(rows),
+            'metrics': list(metrics),
+            'devices': devices,
+            't_min': min(timestamps) if rows else 0.0,
+            't_max': max(timestamps) if rows else 0.0
+        }).encode('utf-8')
+        header += b' ' * (-(len(SEGMENT_MAGIC) + _HEADER_LEN.size + len(header)) % 8)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SEGMENT_MAGIC)
+            f.write(_HEADER_LEN.pack(len(header)))
+            f.write(header)
+            timestamps.tofile(f)
+            for metric in metrics:
+                columns[metric].tofile(f)
+        os.replace(tmp_path, path)
+
+    def open(self):
+        """Чтение заголовка и отображение колонок в память (один раз)"""
+        if self._columns is not None:
+            return
+
+        with open(self.path, 'rb') as f:
+            if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                raise ValueError(f"Неизвестный формат сегмента: {self.path}")
+            header_len, = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            header = json.loads(f.read(header_len))
+
+        self.count = header['count']
+        self.metrics = header['metrics']
+        self.devices = header['devices']
+        self.t_min = header['t_min']
+        self.t_max = header['t_max']
+
+        columns = {}
+        if self.count:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self._mmap)
+            offset = len(SEGMENT_MAGIC) + _HEADER_LEN.size + header_len
+            size = self.count * 8
+            for name in ['__time__'] + self.metrics:
+                columns[name] = view[offset:offset + size].cast('d')
+                offset += size
+        self._columns = columns
+
+    def close(self):
+        """Освобождение mmap (обязательно перед удалением файла в Windows)"""
+        if self._columns is not None:
+            for column in self._columns.values():
+                column.release()
+            self._columns = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read(self, device_id, metric, start, end):
+        """Точки (время, значение) устройства в интервале [start, end)"""
+        self.open()
+        span = self.devices.get(device_id)
+        if span is None or metric not in self.metrics or self.t_max < start or self.t_min >= end:
+            return []
+
+        first, count = span
+        times = self._columns['__time__']
+        values = self._columns[metric]
+        lo = bisect.bisect_left(times, start, first, first + count)
+        hi = bisect.bisect_left(times, end, lo, first + count)
+        return [(times[i], values[i]) for i in range(lo, hi) if values[i] == values[i]]
+
+    def rows(self):
+        """Все строки сегмента (для уплотнения партиций)"""
+        self.open()
+        if not self.count:
+            return []
+        times = self._columns['__time__']
+        columns = [(metric, self._columns[metric]) for metric in self.metrics]
+        rows = []
+        for device_id, (first, count) in self.devices.items():
+            for i in range(first, first + count):
+                rows.append((device_id, times[i], {
+                    metric: column[i] for metric, column in columns if column[i] == column[i]
+                }))
+        return rows
+
+
+class TelemetryStore:
+    """Журнал телеметрии: буфер в памяти, периодическая запись сегментов по партициям времени.
+
+    Каждая партиция (по умолчанию час) - каталог с сегментами. Закрытые партиции
+    уплотняются в один сегмент, партиции старше retention удаляются целиком.
+    Запросы читают только партиции, пересекающие интервал, и буфер.
+    """
+
+    def __init__(self, directory, partition_seconds=3600, retention_seconds=7 * 86400,
+                 flush_interval=10.0, flush_size=20000, max_points=2000):
+        self.directory = directory
+        self.partition_seconds = int(partition_seconds)
+        self.retention_seconds = retention_seconds
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_points = max_points
+
+        self._pending = []  # (device_id, timestamp, {метрика: значение})
+        self._pending_lock = threading.Lock()
+        self._partitions = {}  # начало партиции -> список Segment
+        self._segments_lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._sequence = 0
+        self._stop_event = threading.Event()
+        self._flush_event = threading.Event()
+        self._thread = None
+
+        self.points_written = 0
+        self.segments_written = 0
+        self.partitions_dropped = 0
+
+        self._load()
+
+    # ========== ЗАПИСЬ ==========
+
+    def append(self, device_id, timestamp, metrics):
+        """Добавление точки: metrics - словарь числовых значений"""
+        self.append_many(((device_id, timestamp, metrics),))
+
+    def append_many(self, samples):
+        """Добавление пачки точек (device_id, timestamp, metrics) под одной блокировкой"""
+        clean = []
+        for device_id, timestamp, metrics in samples:
+            values = {name: float(value) for name, value in metrics.items()
+                      if isinstance(value, (int, float)) and not isinstance(value, bool)}
+            if values:
+                clean.append((device_id, float(timestamp), values))
+
+        if not clean:
+            return
+        with self._pending_lock:
+            self._pending.extend(clean)
+            full = len(self._pending) >= self.flush_size
+        if full:
+            self._flush_event.set()
+
+    def _partition_of(self, timestamp):
+        return int(timestamp // self.partition_seconds) * self.partition_seconds
+
+    def flush(self):
+        """Запись накопленных точек в сегменты (один сегмент на партицию)"""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = []
+            if not pending:
+                return 0
+
+            by_partition = {}
+            for row in pending:
+                by_partition.setdefault(self._partition_of(row[1]), []).append(row)
+
+            for partition, rows in by_partition.items():
+                metrics = sorted({metric for _, _, values in rows for metric in values})
+                segment = self._write_segment(partition, rows, metrics)
+                with self._segments_lock:
+                    self._partitions.setdefault(partition, []).append(segment)
+
+            self.points_written += len(pending)
+            return len(pending)
+
+    def _write_segment(self, partition, rows, metrics):
+        directory = os.path.join(self.directory, str(partition))
+        os.makedirs(directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{int(time.time() * 1000):015d}-{self._sequence:06d}{SEGMENT_SUFFIX}"
+        path = os.path.join(directory, name)
+        Segment.write(path, rows, metrics)
+        self.segments_written += 1
+        return Segment(path)
+
+    def _load(self):
+        """Подхват сегментов, записанных до перезапуска"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if not name.isdigit() or not os.path.isdir(directory):
+                continue
+            segments = [Segment(os.path.join(directory, file_name))
+                        for file_name in sorted(os.listdir(directory))
+                        if file_name.endswith(SEGMENT_SUFFIX)]
+            if segments:
+                self._partitions[int(name)] = segments
+
+    # ========== ОБСЛУЖИВАНИЕ ==========
+
+    def compact(self, partition):
+        """Слияние сегментов закрытой партиции в один"""
+        with self._flush_lock:
+            with self._segments_lock:
+                segments = list(self._partitions.get(partition, ()))
+            if len(segments) < 2:
+                return False
+
+            rows = []
+            for segment in segments:
+                rows.extend(segment.rows())
+            metrics = sorted({metric for segment in segments for metric in segment.metrics})
+            merged = self._write_segment(partition, rows, metrics)
+
+            with self._segments_lock:
+                self._partitions[partition] = [merged]
+                for segment in segments:
+                    segment.close()
+                    try:
+                        os.remove(segment.path)
+                    except OSError as e:
+                        logger.error(f"❌ Не удалось удалить сегмент {segment.path}: {e}")
+            return True
+
+    def enforce_retention(self, now=None):
+        """Удаление партиций старше срока хранения"""
+        now = time.time() if now is None else now
+        cutoff = now - self.retention_seconds
+        with self._segments_lock:
+            expired = [p for p in self._partitions if p + self.partition_seconds <= cutoff]
+            for partition in expired:
+                for segment in self._partitions.pop(partition):
+                    segment.close()
+                shutil.rmtree(os.path.join(self.directory, str(partition)), ignore_errors=True)
+                self.partitions_dropped += 1
+        return len(expired)
+
+    def maintain(self, now=None):
+        """Запись буфера, уплотнение закрытых партиций и удаление старых"""
+        now = time.time() if now is None else now
+        self.flush()
+        current = self._partition_of(now)
+        with self._segments_lock:
+            closed = [p for p, segments in self._partitions.items() if p < current and len(segments) > 1]
+        for partition in closed:
+            self.compact(partition)
+        self.enforce_retention(now)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._maintenance_loop, name="telemetry-store", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._flush_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self.flush()
+
+    def _maintenance_loop(self):
+        while not self._stop_event.is_set():
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи телеметрии: {e}")
+
+    # ========== ЗАПРОСЫ ==========
+
+    def points(self, device_id, metric, start, end):
+        """Сырые точки (время, значение) в интервале [start, end), упорядоченные по времени"""
+        first = self._partition_of(start)
+        with self._segments_lock:
+            segments = [segment
+                        for partition in sorted(self._partitions)
+                        if first <= partition < end
+                        for segment in self._partitions[partition]]
+            points = []
+            for segment in segments:
+                points.extend(segment.read(device_id, metric, start, end))
+
+        with self._pending_lock:
+            pending = list(self._pending)
+        for row_device, timestamp, values in pending:
+            if row_device == device_id and start <= timestamp < end:
+                value = values.get(metric)
+                if value is not None:
+                    points.append((timestamp, value))
+
+        points.sort()
+        return points
+
+    def series(self, device_id, metric, start, end, step=None):
+        """Ряд для графиков: сырые точки или агрегаты по интервалам step секунд.
+
+        Если step не задан и точек больше max_points, шаг подбирается автоматически.
+        """
+        points = self.points(device_id, metric, start, end)
+        if step is None and len(points) > self.max_points:
+            step = (end - start) / self.max_points
+
+        if not step:
+            return {
+                'columns': ['t', 'value'],
+                'points': [[t, value] for t, value in points]
+            }
+
+        buckets = []
+        current = None
+        for t, value in points:
+            # Интервалы выравнены по эпохе, чтобы повторные запросы давали те же точки
+            bucket = (t // step) * step
+            if current is None or current[0] != bucket:
+                current = [bucket, 0.0, value, value, 0]
+                buckets.append(current)
+            current[1] += value
+            current[2] = min(current[2], value)
+            current[3] = max(current[3], value)
+            current[4] += 1
+
+        return {
+            'step': step,
+            'columns': ['t', 'avg', 'min', 'max', 'count'],
+            'points': [[bucket, total / count, low, high, count] for bucket, total, low, high, count in buckets]
+        }
+
+    def metrics_of(self, device_id):
+        """Метрики, по которым у устройства есть история"""
+        names = set()
+        with self._segments_lock:
+            for segments in self._partitions.values():
+                for segment in segments:
+                    segment.open()
+                    if device_id in segment.devices:
+                        names.update(segment.metrics)
+        with self._pending_lock:
+            for row_device, _, values in self._pending:
+                if row_device == device_id:
+                    names.update(values)
+        return sorted(names)
+
+    def get_stats(self):
+        with self._segments_lock:
+            partitions = len(self._partitions)
+            segments = sum(len(s) for s in self._partitions.values())
+        return {
+            'directory': self.directory,
+            'pending_points': len(self._pending),
+            'points_written': self.points_written,
+            'segments_written': self.segments_written,
+            'partitions': partitions,
+            'segments': segments,
+            'partitions_dropped': self.partitions_dropped,
+            'retention_seconds': self.retention_seconds
+        }
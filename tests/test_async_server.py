@@ -0,0 +1,81 @@
+# test_async_server.py - ASGI ОБЕРТКА И ВСТРОЕННЫЙ HTTP СЕРВЕР
+import asyncio
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+from async_server import AsgiApp, HttpServer
+
+
+def echo_wsgi(environ, start_response):
+    """WSGI приложение, возвращающее метод, путь, запрос и тело"""
+    body = environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [f"{environ['REQUEST_METHOD']} {environ['PATH_INFO']} {environ['QUERY_STRING']} ".encode(), body]
+
+
+async def streaming_app(scope, receive, send):
+    await receive()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b'one', 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'two'})
+
+
+async def request(port, raw):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    data = await reader.read(65536)
+    writer.close()
+    return data
+
+
+def run_server(app, scenario):
+    async def main():
+        server = HttpServer(app, '127.0.0.1', 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            return await scenario(server, port)
+        finally:
+            server.server.close()
+            await server.server.wait_closed()
+    return asyncio.run(main())
+
+
+def test_wsgi_get_inline_and_post_offloaded():
+    app = AsgiApp(echo_wsgi)
+
+    async def scenario(server, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /api/devices?limit=2 HTTP/1.1\r\nHost: x\r\n\r\n')
+        first = await reader.readuntil(b'limit=2 ')
+        writer.write(b'POST /api/command HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\nConnection: close\r\n\r\nPING')
+        second = await reader.read()
+        writer.close()
+        return first, second
+
+    first, second = run_server(app, scenario)
+    assert first.startswith(b'HTTP/1.1 200 OK\r\n') and b'connection: keep-alive' in first
+    assert first.endswith(b'GET /api/devices limit=2 ')
+    assert second.endswith(b'POST /api/command  PING') and b'connection: close' in second
+    assert app.get_stats() == {'requests': 2, 'offloaded': 1, 'streams': 0}
+
+
+def test_streaming_response_is_chunked():
+    async def scenario(server, port):
+        return await request(port, b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+
+    response = run_server(streaming_app, scenario)
+    assert b'transfer-encoding: chunked' in response
+    assert response.endswith(b'\r\n\r\n3\r\none\r\n3\r\ntwo\r\n0\r\n\r\n')
+
+
+def test_oversized_body_is_rejected():
+    async def scenario(server, port):
+        server.max_body = 10
+        return await request(port, b'POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\n')
+
+    assert run_server(streaming_app, scenario).startswith(b'HTTP/1.1 413 ')
@@ -0,0 +1,73 @@
+# test_binary_payloads.py - КОМПАКТНЫЙ БИНАРНЫЙ ФОРМАТ СООБЩЕНИЙ
+import pytest
+
+from payload_schema import BINARY_LAYOUTS, STATUS_SCHEMA
+
+STATUS = {
+    'device_type': 'rgb_controller',
+    'ip_address': '192.168.1.50',
+    'mac': 'AA:BB:CC:00:11:22',
+    'rssi': -67,
+    'free_heap': 31000,
+    'uptime': 3600,
+    'version': '2.1',
+    'firmware': 'nodemcu',
+    'config_mode': False,
+    'mqtt_broker': 'broker.local',
+    'led_state': True,
+    'action_button_pressed': True,
+    'led_on': False,
+    'rgb_color': '255,128,0',
+    'available': True
+}
+
+
+def test_status_round_trip_matches_json_schema():
+    layout = BINARY_LAYOUTS['status']
+    decoded = layout.decode_bytes(layout.encode(STATUS))
+    assert decoded == STATUS
+    # Тот же статус в JSON (ключи полного статуса) дает тот же результат
+    json_status = {STATUS_SCHEMA._aliases[name][-1]: value for name, value in STATUS.items()}
+    assert decoded == STATUS_SCHEMA.decode(json_status)
+
+
+def test_status_without_trailing_strings_gets_defaults():
+    layout = BINARY_LAYOUTS['status']
+    payload = layout.encode({'rssi': -40})
+    head = payload[:layout.min_size]
+    decoded = layout.decode_bytes(head)
+    assert decoded['rssi'] == -40
+    assert decoded['ip_address'] == 'unknown' and decoded['mac'] == ''
+    assert (decoded['device_type'], decoded['version'], decoded['mqtt_broker']) == ('unknown', 'unknown', '')
+
+
+def test_button_data_and_error_round_trip():
+    button = BINARY_LAYOUTS['button']
+    assert button.decode_bytes(button.encode({'action_button_pressed': True, 'led_on': False})) == \
+        {'action_button_pressed': True, 'led_on': False}
+
+    data = BINARY_LAYOUTS['data']
+    assert data.decode_bytes(data.encode({'temperature': 21.5, 'humidity': 40.25})) == \
+        {'temperature': 21.5, 'humidity': 40.25}
+
+    error = BINARY_LAYOUTS['error']
+    assert error.decode_bytes(error.encode({'error': 'Сбой датчика'})) == {'error': 'Сбой датчика'}
+
+
+@pytest.mark.parametrize('payload', [
+    b'',                                                    # пусто
+    b'\x02' + BINARY_LAYOUTS['status'].encode(STATUS)[1:],  # неизвестная версия
+    BINARY_LAYOUTS['status'].encode(STATUS)[:10],           # обрезана фиксированная часть
+    BINARY_LAYOUTS['status'].encode(STATUS)[:-3],           # обрезана строка
+])
+def test_damaged_status_is_rejected(payload):
+    layout = BINARY_LAYOUTS['status']
+    invalid = layout.invalid_count
+    with pytest.raises(ValueError):
+        layout.decode_bytes(payload)
+    assert layout.invalid_count == invalid + 1
+
+
+def test_truncated_data_value_is_rejected():
+    with pytest.raises(ValueError):
+        BINARY_LAYOUTS['data'].decode_bytes(BINARY_LAYOUTS['data'].encode({'temperature': 1.0})[:-1])
@@ -0,0 +1,52 @@
+# test_change_feed.py - ОБЪЕДИНЕНИЕ ИЗМЕНЕНИЙ И РАССЫЛКА SSE
+import json
+
+from change_feed import ChangeFeed
+
+
+def parse(message):
+    event, data = message.decode('utf-8').strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+
+def test_changes_are_merged_per_device_within_window():
+    feed = ChangeFeed(stats_provider=lambda: {'online': 1})
+    first = feed.subscribe()
+    second = feed.subscribe()
+
+    feed.publish('ESP_A', {'status': 'online'})
+    feed.publish('ESP_A', {'rssi': -60})
+    feed.publish('ESP_B', {'status': 'online'})
+    feed.publish('ESP_B', removed=True)
+
+    assert feed.flush() == 2
+    event, payload = parse(first.get(0))
+    assert event == 'delta' and payload['sequence'] == 1
+    assert payload['changes'] == [
+        {'id': 'ESP_A', 'op': 'upsert', 'device': {'status': 'online', 'rssi': -60}},
+        {'id': 'ESP_B', 'op': 'remove'}
+    ]
+    assert payload['stats'] == {'online': 1}
+    # Пакет кодируется один раз и раздается всем подписчикам
+    assert parse(second.get(0)) == (event, payload)
+    assert feed.flush() == 0
+
+
+def test_publish_without_subscribers_is_dropped():
+    feed = ChangeFeed()
+    feed.publish('ESP_A', {'status': 'online'})
+    assert feed.flush() == 0 and feed.sequence == 0
+
+
+def test_slow_subscriber_is_marked_for_resync():
+    feed = ChangeFeed(max_queue=2)
+    subscription = feed.subscribe()
+    for index in range(3):
+        feed.publish(f'ESP_{index}', {'status': 'online'})
+        feed.flush()
+
+    assert subscription.resync
+    assert subscription.get(0) is None
+
+    feed.unsubscribe(subscription)
+    assert not feed.has_subscribers
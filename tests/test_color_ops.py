@@ -0,0 +1,48 @@
+# test_color_ops.py - ГРУППОВЫЕ ОПЕРАЦИИ С ЦВЕТАМИ (NUMPY И ЧИСТЫЙ PYTHON)
+import pytest
+
+import color_ops
+
+BACKENDS = ['python'] + (['numpy'] if color_ops.np is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(color_ops, 'np', None)
+    return request.param
+
+
+def rows(colors):
+    return [tuple(row) for row in color_ops.to_rows(colors)]
+
+
+def test_parse_rgb_clamps_and_rejects_garbage():
+    assert color_ops.parse_rgb('300,-5,10') == (255, 0, 10)
+    assert color_ops.parse_rgb('red') == (0, 0, 0)
+    assert color_ops.parse_rgb(None) == (0, 0, 0)
+
+
+def test_color_table_set_discard_and_gather(backend):
+    table = color_ops.ColorTable(capacity=2)
+    assert table.backend == backend
+    table.set('ESP_A', (1, 2, 3))
+    table.set('ESP_B', (4, 5, 6))
+    table.set('ESP_C', (7, 8, 9))   # таблица растет
+    table.discard('ESP_A')          # последнее устройство занимает освободившуюся строку
+
+    assert len(table) == 2 and 'ESP_A' not in table
+    assert rows(table.gather(['ESP_C', 'ESP_B', 'ESP_X'])) == [(7, 8, 9), (4, 5, 6), (0, 0, 0)]
+
+
+def test_operations_match_between_backends(backend):
+    assert rows(color_ops.solid(2, (9, 9, 9))) == [(9, 9, 9)] * 2
+    assert rows(color_ops.gradient(3, (0, 0, 0), (255, 100, 10))) == [(0, 0, 0), (128, 50, 5), (255, 100, 10)]
+
+    colors = color_ops.gradient(3, (0, 0, 0), (200, 200, 200))
+    assert rows(color_ops.rotate(colors, 1)) == [(200, 200, 200), (0, 0, 0), (100, 100, 100)]
+    assert rows(color_ops.scale_brightness(colors, 2)) == [(0, 0, 0), (200, 200, 200), (255, 255, 255)]
+
+    palette = [(1, 1, 1), (2, 2, 2)]
+    assert set(rows(color_ops.random_palette(20, palette, seed=1))) <= set(palette)
+    assert rows(color_ops.random_palette(5, seed=7)) == rows(color_ops.random_palette(5, seed=7))
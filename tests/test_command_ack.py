@@ -0,0 +1,95 @@
+# test_command_ack.py - ПРИМЕНЕНИЕ ПОДТВЕРЖДЕНИЙ КОМАНД К ЗАПИСИ УСТРОЙСТВА
+import json
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+import web_server
+
+
+class RecordingClient:
+    """MQTT клиент, запоминающий публикации"""
+
+    class Info:
+        rc = 0
+        mid = 1
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append((topic, json.loads(payload)))
+        return self.Info()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = RecordingClient()
+    monkeypatch.setattr(web_server, 'storage', web_server.DeviceStorage())
+    monkeypatch.setattr(web_server, 'mqtt_client', client)
+    monkeypatch.setattr(web_server.Config, 'COMMAND_OPTIMISTIC_UPDATES', False)
+    return client
+
+
+def ingest(device_id, message_type, data):
+    payload = json.dumps(data).encode('utf-8')
+    web_server._process_ingest_batch({device_id: [(message_type, payload, time.time())]})
+
+
+def ack(device_id, command_id):
+    ingest(device_id, 'ack', {'cid': command_id, 'ok': True})
+
+
+def last_command_id(client):
+    return client.published[-1][1]['cid']
+
+
+def register(device_id, acking=True):
+    storage = web_server.storage
+    storage.add_device(device_id, 'rgb_controller', '192.168.1.10', {'rgb_color': '0,0,0'})
+    if acking:
+        # Подтверждение команды прошлого запуска: прошивка поддерживает подтверждения
+        ack(device_id, 'previous-run')
+    return storage
+
+
+def test_late_ack_of_replaced_color_does_not_roll_back(client):
+    storage = register('ESP_ACK_1')
+
+    assert storage.set_device_color('ESP_ACK_1', 255, 0, 0)
+    red = last_command_id(client)
+    assert storage.set_device_color('ESP_ACK_1', 0, 0, 255)
+    blue = last_command_id(client)
+
+    ack('ESP_ACK_1', blue)
+    assert storage.devices.get('ESP_ACK_1').rgb_color == '0,0,255'
+
+    # Замененная команда не повторяется по таймауту
+    retry, _ = web_server.command_tracker.pop_expired(time.monotonic() + 60)
+    assert red not in [pending.command_id for pending in retry]
+
+    ack('ESP_ACK_1', red)
+    assert storage.devices.get('ESP_ACK_1').rgb_color == '0,0,255'
+
+
+def test_color_waits_for_ack_from_acking_device(client):
+    storage = register('ESP_ACK_2')
+
+    assert storage.set_device_color('ESP_ACK_2', 0, 255, 0)
+    assert storage.devices.get('ESP_ACK_2').rgb_color == '0,0,0'
+    ack('ESP_ACK_2', last_command_id(client))
+    assert storage.devices.get('ESP_ACK_2').rgb_color == '0,255,0'
+
+
+def test_device_without_acks_is_updated_optimistically(client):
+    storage = register('ESP_LEGACY_1', acking=False)
+    storage.devices.update('ESP_LEGACY_1', {'action_button_pressed': True, 'available': False})
+
+    assert storage.set_device_color('ESP_LEGACY_1', 0, 255, 0)
+    assert storage.reset_device_button('ESP_LEGACY_1')
+    device = storage.devices.get('ESP_LEGACY_1')
+    assert device.rgb_color == '0,255,0'
+    assert not device.action_button_pressed and device.available
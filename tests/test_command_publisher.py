@@ -0,0 +1,74 @@
+# test_command_publisher.py - ПАКЕТНАЯ ОТПРАВКА КОМАНД
+import json
+
+from command_publisher import CommandPublisher, TokenBucket
+
+
+class RecordingClient:
+    """MQTT клиент, запоминающий публикации"""
+
+    class Info:
+        mid = 1
+
+        def __init__(self, rc):
+            self.rc = rc
+
+    def __init__(self, failing=()):
+        self.published = []
+        self.failing = set(failing)
+
+    def publish(self, topic, payload, qos=0):
+        self.published.append((topic, json.loads(payload), qos))
+        return self.Info(1 if topic in self.failing else 0)
+
+
+def test_publish_many_encodes_shared_payload_once():
+    client = RecordingClient()
+    publisher = CommandPublisher(lambda: client, 'esp')
+    items = [{'device_id': f'ESP_{index}', 'command': 'SET_COLOR', 'args': {'r': 255, 'g': 0, 'b': 0}}
+             for index in range(3)]
+    items.append({'device_id': 'ESP_3', 'command': 'RESTART'})
+
+    results = publisher.publish_many(items, qos=1)
+
+    assert [result['status'] for result in results] == ['sent'] * 4
+    assert publisher.encoded_count == 2
+    assert [topic for topic, _, _ in client.published] == [f'esp/ESP_{index}/command' for index in range(4)]
+    first = client.published[0][1]
+    assert first['command'] == 'SET_COLOR' and first['r'] == 255 and first['source'] == 'bulk'
+    # У каждой публикации свой id команды
+    assert len({payload['cid'] for _, payload, _ in client.published}) == 4
+    assert {qos for _, _, qos in client.published} == {1}
+
+
+def test_publish_many_reports_per_device_errors():
+    client = RecordingClient(failing={'esp/ESP_1/command'})
+    publisher = CommandPublisher(lambda: client, 'esp')
+    results = publisher.publish_many([{'device_id': 'ESP_0', 'command': 'RESTART'},
+                                      {'device_id': 'ESP_1', 'command': 'RESTART'}])
+    assert [result['status'] for result in results] == ['sent', 'error']
+    assert publisher.error_count == 1
+
+    offline = CommandPublisher(lambda: None, 'esp')
+    assert offline.publish_many([{'device_id': 'ESP_0', 'command': 'RESTART'}])[0]['status'] == 'error'
+
+
+def test_group_command_is_one_publish():
+    client = RecordingClient()
+    publisher = CommandPublisher(lambda: client, 'esp')
+    result = publisher.publish_group('all', 'RESTART')
+    assert result['status'] == 'sent'
+    assert [(topic, payload['cid']) for topic, payload, _ in client.published] == \
+        [('esp/group/all/command', result['command_id'])]
+
+
+def test_with_id_keeps_payload_valid_json():
+    payload = CommandPublisher.with_id(json.dumps({'command': 'PING'}), 'abc')
+    assert json.loads(payload) == {'command': 'PING', 'cid': 'abc'}
+
+
+def test_token_bucket_limits_burst():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert 0 < bucket.wait_time() <= 1
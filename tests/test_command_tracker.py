@@ -0,0 +1,119 @@
+# test_command_tracker.py - ПОДТВЕРЖДЕНИЯ, ПОВТОРЫ И ПОРЯДОК ПРИМЕНЕНИЯ КОМАНД
+from command_tracker import CommandTracker
+
+
+def make_tracker(acking=('ESP_1', 'ESP_2')):
+    published = []
+    tracker = CommandTracker(lambda topic, payload, qos: published.append(payload) or True, timeout=1.0,
+                             max_retries=2, supersede=('SET_COLOR',), retry_always=('SET_COLOR', 'STATUS'))
+    for device_id in acking:
+        # Подтверждение команды прошлого запуска: прошивка поддерживает подтверждения
+        tracker.acknowledge(device_id, 'previous-run')
+    return tracker, published
+
+
+def track_color(tracker, device_id, color):
+    command_id = tracker.next_id()
+    tracker.track(command_id, device_id, 'SET_COLOR', f'devices/{device_id}/command', color, update={'rgb_color': color})
+    return command_id
+
+
+def test_retries_until_ack_then_fails():
+    tracker, _ = make_tracker()
+    command_id = tracker.next_id()
+    tracker.track(command_id, 'ESP_1', 'STATUS', 'devices/ESP_1/command', '{}')
+
+    retry, failed = tracker.pop_expired(tracker.next_deadline())
+    assert [pending.command_id for pending in retry] == [command_id] and not failed
+    retry, failed = tracker.pop_expired(tracker.next_deadline())
+    assert len(retry) == 1
+    retry, failed = tracker.pop_expired(tracker.next_deadline())
+    assert not retry and [pending.command_id for pending in failed] == [command_id]
+    assert tracker.failed_count == 1 and tracker.retry_count == 2
+    assert len(tracker) == 0
+
+
+def test_ack_finishes_command_once():
+    tracker, _ = make_tracker()
+    command_id = tracker.next_id()
+    tracker.track(command_id, 'ESP_1', 'STATUS', 'devices/ESP_1/command', '{}')
+
+    assert tracker.acknowledge('ESP_2', command_id) is None  # чужое устройство
+    assert tracker.acknowledge('ESP_1', command_id).command == 'STATUS'
+    assert tracker.acknowledge('ESP_1', command_id) is None  # повтор подтверждения
+    assert tracker.pop_expired(tracker.next_deadline()) == ([], [])
+    assert tracker.acked_count == 1 and tracker.unmatched_count == 4
+
+
+def test_newer_command_supersedes_pending_one():
+    tracker, _ = make_tracker()
+    red = track_color(tracker, 'ESP_1', '255,0,0')
+    blue = track_color(tracker, 'ESP_1', '0,0,255')
+    other = track_color(tracker, 'ESP_2', '255,0,0')
+
+    assert tracker.acknowledge('ESP_1', blue).update == {'rgb_color': '0,0,255'}
+
+    # Замененная команда не повторяется, ее позднее подтверждение не применяется
+    retry, failed = tracker.pop_expired(tracker.next_deadline() + 10)
+    assert [pending.command_id for pending in retry] == [other] and not failed
+    assert tracker.acknowledge('ESP_1', red) is None
+    assert tracker.superseded_count == 1
+
+
+def test_older_update_is_not_applied_after_newer_one():
+    tracker, _ = make_tracker()
+    tracker.supersede = frozenset()
+    red = track_color(tracker, 'ESP_1', '255,0,0')
+    blue = track_color(tracker, 'ESP_1', '0,0,255')
+
+    assert tracker.acknowledge('ESP_1', blue).update == {'rgb_color': '0,0,255'}
+    late = tracker.acknowledge('ESP_1', red)
+    assert late is not None and late.update is None
+    assert tracker.stale_count == 1
+
+
+def test_device_without_acks_gets_only_idempotent_retries():
+    tracker, _ = make_tracker(acking=())
+    toggle = tracker.next_id()
+    tracker.track(toggle, 'ESP_1', 'LED_TOGGLE', 'devices/ESP_1/command', '{}')
+    color = track_color(tracker, 'ESP_1', '255,0,0')
+
+    # LED_TOGGLE не повторяется: старая прошивка выполнила бы его второй раз
+    retry, failed = tracker.pop_expired(tracker.next_deadline() + 0.5)
+    assert [pending.command_id for pending in retry] == [color] and not failed
+    assert tracker.unconfirmed_count == 1
+
+    # Исчерпанные повторы без единого подтверждения - не отказ доставки
+    while tracker.next_deadline() is not None:
+        assert tracker.pop_expired(tracker.next_deadline())[1] == []
+    assert tracker.unconfirmed_count == 2 and tracker.failed_count == 0
+
+
+def test_first_ack_enables_retries():
+    tracker, _ = make_tracker(acking=())
+    assert not tracker.has_acked('ESP_1')
+    tracker.acknowledge('ESP_1', 'previous-run')
+    assert tracker.has_acked('ESP_1')
+
+    toggle = tracker.next_id()
+    tracker.track(toggle, 'ESP_1', 'LED_TOGGLE', 'devices/ESP_1/command', '{}')
+    retry, _ = tracker.pop_expired(tracker.next_deadline())
+    assert [pending.command_id for pending in retry] == [toggle]
+
+
+def test_failed_publish_restores_superseded_command():
+    tracker, _ = make_tracker()
+    red = track_color(tracker, 'ESP_1', '255,0,0')
+    blue = track_color(tracker, 'ESP_1', '0,0,255')
+    assert len(tracker) == 1
+
+    # Публикация синего не удалась: красный снова ждет подтверждения и повторяется
+    tracker.discard(blue)
+    assert tracker.superseded_count == 0
+    retry, _ = tracker.pop_expired(tracker.next_deadline() + 10)
+    assert [pending.command_id for pending in retry] == [red]
+    assert tracker.acknowledge('ESP_1', red).update == {'rgb_color': '255,0,0'}
+
+    # Следующая команда снова заменяет предыдущую
+    green = track_color(tracker, 'ESP_1', '0,255,0')
+    assert tracker.acknowledge('ESP_1', green) is not None
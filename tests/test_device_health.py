@@ -0,0 +1,64 @@
+# test_device_health.py - СКОЛЬЗЯЩИЕ АГРЕГАТЫ И РЕЙТИНГИ ПОКАЗАТЕЛЕЙ УСТРОЙСТВ
+import json
+
+import pytest
+
+from device_health import DeviceHealth, LogSketch
+
+
+def test_windows_ewma_and_restarts():
+    restarts = []
+    health = DeviceHealth(alpha=0.5, on_restart=lambda *args: restarts.append(args))
+    health.observe('ESP_A', 60, {'rssi': -50, 'uptime': 100})
+    health.observe('ESP_A', 90, {'rssi': -60, 'uptime': 130})
+    health.observe('ESP_A', 125, {'rssi': -70, 'uptime': 5})
+
+    device = health.get_device('ESP_A')
+    rssi = device['metrics']['rssi']
+    assert rssi['last'] == -70 and rssi['ewma'] == -62.5
+    # 60 и 90 - одна минута, 125 начинает следующую
+    assert rssi['windows']['1m']['previous']['count'] == 2
+    assert rssi['windows']['1m']['current']['count'] == 1
+    assert device['restart_count'] == 1
+    assert restarts == [('ESP_A', 130, 5, 125)]
+
+
+def test_lowest_skips_stale_and_discarded_devices():
+    health = DeviceHealth()
+    health.observe_many([('ESP_A', 1, {'rssi': -90}), ('ESP_B', 1, {'rssi': -60}), ('ESP_C', 1, {'rssi': -70})])
+    health.observe('ESP_A', 2, {'rssi': -40})
+    health.discard('ESP_C')
+
+    assert health.lowest('rssi', 2) == [('ESP_B', -60), ('ESP_A', -40)]
+    assert health.lowest('rssi', 5, predicate=lambda device_id: device_id != 'ESP_B') == [('ESP_A', -40)]
+    assert health.get_device('ESP_C') is None
+
+
+def test_sketch_quantiles_within_accuracy():
+    sketch = LogSketch(accuracy=0.02)
+    for value in range(1, 1001):
+        sketch.add(value)
+    assert sketch.quantile(0.5) == pytest.approx(500, rel=0.02)
+    assert sketch.quantile(0.95) == pytest.approx(950, rel=0.02)
+
+
+def test_compact_status_records_only_sent_metrics(monkeypatch, tmp_path):
+    pytest.importorskip('flask')
+    pytest.importorskip('paho.mqtt')
+    import web_server
+    from telemetry_store import TelemetryStore
+
+    storage = web_server.DeviceStorage()
+    telemetry = TelemetryStore(str(tmp_path))
+    monkeypatch.setattr(web_server, 'storage', storage)
+    monkeypatch.setattr(web_server, 'telemetry', telemetry)
+
+    # Компактный статус NodeMCU: без heap, затем без up
+    for device_id, status in (('ESP_A', {'id': 'ESP_A', 't': 'rgb_controller', 'ip': '10.0.0.2', 'rssi': -60, 'up': 50}),
+                              ('ESP_A', {'id': 'ESP_A', 't': 'rgb_controller', 'ip': '10.0.0.2', 'rssi': -61}),
+                              ('ESP_B', {'t': 'rgb_controller', 'ip': '10.0.0.3', 'rssi': -50, 'heap': 30000})):
+        web_server._process_ingest_batch({device_id: [('status', json.dumps(status).encode(), 1000.0)]})
+
+    assert storage.health.lowest('free_heap') == [('ESP_B', 30000)]
+    assert storage.health.get_device('ESP_A')['restart_count'] == 0
+    assert telemetry.metrics_of('ESP_A') == ['rssi', 'uptime']
@@ -0,0 +1,58 @@
+# test_device_index.py - ВТОРИЧНЫЕ ИНДЕКСЫ И ВЫБОРКИ УСТРОЙСТВ
+import pytest
+
+from device_index import DeviceIndex
+from device_manager import DeviceRecord, DeviceAttributes
+
+
+def make_record(device_id, device_type='rgb_controller', status='connected', firmware='1.0'):
+    return DeviceRecord(device_id=device_id, device_type=device_type, ip_address='10.0.0.1', status=status,
+                        last_seen=0.0, attributes=DeviceAttributes(firmware=firmware))
+
+
+def make_index():
+    return DeviceIndex({
+        'type': lambda device: device.device_type,
+        'status': lambda device: device.status,
+        'firmware': lambda device: device.attributes.firmware
+    })
+
+
+def test_find_intersects_and_follows_updates():
+    index = make_index()
+    a = make_record('ESP_A')
+    b = make_record('ESP_B', firmware='2.0')
+    c = make_record('ESP_C', device_type='sensor')
+    for record in (a, b, c):
+        index.update(record.device_id, None, record)
+
+    assert index.find(type='rgb_controller') == {'ESP_A', 'ESP_B'}
+    assert index.find(type='rgb_controller', firmware='2.0') == {'ESP_B'}
+    assert index.count(status='connected') == 3
+
+    index.update('ESP_A', a, a.evolve(status='disconnected'))
+    index.update('ESP_C', c, None)
+    assert index.find(type='rgb_controller', status='connected') == {'ESP_B'}
+    assert index.values('type') == {'rgb_controller': 2}
+    assert index.find(type='sensor') == set()
+
+
+def test_find_rejects_unindexed_field():
+    with pytest.raises(KeyError):
+        make_index().find(ip='10.0.0.1')
+
+
+def test_storage_find_reads_records_without_snapshot():
+    pytest.importorskip('flask')
+    pytest.importorskip('paho.mqtt')
+    from web_server import DeviceStorage
+
+    storage = DeviceStorage()
+    storage.devices.put('ESP_A', make_record('ESP_A'))
+    storage.devices.put('ESP_B', make_record('ESP_B', device_type='sensor'))
+    storage.devices.put('ESP_C', make_record('ESP_C', status='disconnected'))
+
+    assert [device.device_id for device in storage.find(type='rgb_controller', status='connected')] == ['ESP_A']
+    assert {device.device_id for device in storage.find(status='connected')} == {'ESP_A', 'ESP_B'}
+    # Выборка не собирает снимок всего реестра
+    assert storage.devices._snapshot is None
@@ -0,0 +1,87 @@
+# test_device_journal.py - ДОИГРЫВАНИЕ ЖУРНАЛА И ВОССТАНОВЛЕНИЕ ПОСЛЕ ПЕРЕЗАПУСКА
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+from device_journal import DeviceJournal, JOURNAL_FILE
+from device_manager import DeviceRecord, DeviceAttributes
+from web_server import Config, DeviceStorage
+
+
+def make_record(device_id, last_seen, status='connected', rgb_color='0,0,0'):
+    return DeviceRecord(
+        device_id=device_id,
+        device_type='rgb_controller',
+        ip_address='192.168.1.10',
+        status=status,
+        last_seen=last_seen,
+        attributes=DeviceAttributes(rssi=-50, uptime=1000),
+        created_at=last_seen,
+        rgb_color=rgb_color
+    )
+
+
+def test_load_replays_journal_after_snapshot(tmp_path):
+    storage = DeviceStorage()
+    journal = DeviceJournal(str(tmp_path), state_provider=storage.export_state)
+    now = time.time()
+    storage.devices.put('ESP_1', make_record('ESP_1', now))
+    storage.devices.put('ESP_2', make_record('ESP_2', now))
+    journal.snapshot()
+
+    # Изменения после снимка попадают только в журнал
+    storage.journal = journal
+    storage.devices.put('ESP_1', make_record('ESP_1', now, rgb_color='255,0,0'))
+    storage.remove_device('ESP_2')
+    storage.devices.put('ESP_3', make_record('ESP_3', now))
+    assert journal.commit() > 0
+    with open(tmp_path / JOURNAL_FILE, 'ab') as f:
+        f.write(b'{"s": 99, "d": {"ESP_4"')  # сбой посреди записи
+    journal.stop()
+
+    state = DeviceJournal(str(tmp_path)).load()
+    assert set(state['devices']) == {'ESP_1', 'ESP_3'}
+    assert state['devices']['ESP_1']['rgb_color'] == '255,0,0'
+
+
+def test_restart_keeps_restored_fleet_online_for_one_interval(tmp_path):
+    interval = Config.STATUS_UPDATE_INTERVAL
+    # Снимок сделан задолго до перезапуска
+    last_seen = time.time() - 10 * interval
+    old_storage = DeviceStorage()
+    for device_id in ('ESP_1', 'ESP_2', 'ESP_3'):
+        old_storage.devices.put(device_id, make_record(device_id, last_seen))
+    old_storage.devices.put('ESP_OFF', make_record('ESP_OFF', last_seen, status='disconnected'))
+    DeviceJournal(str(tmp_path), state_provider=old_storage.export_state).snapshot()
+
+    storage = DeviceStorage()
+    restored_at = time.time()
+    assert storage.restore_state(DeviceJournal(str(tmp_path)).load()) == 4
+
+    # Весь онлайн парк виден сразу и помечен как восстановленный, last_seen не подменяется
+    assert storage.get_online_count() == 3
+    device = storage.devices.get('ESP_1')
+    assert device.restored and device.last_seen == last_seen
+    assert device.to_dict()['restored'] is True
+
+    # Первый проход жнеца никого не снимает: дедлайн - восстановление + интервал
+    storage._expire_devices(storage.expiry.pop_expired(restored_at + 1), restored_at + 1)
+    assert storage.get_online_count() == 3
+    assert storage.devices.get('ESP_OFF').status == 'disconnected'
+
+    # Статус после перезапуска возвращает запись в обычный режим
+    time.sleep(0.05)
+    storage.add_device('ESP_1', 'rgb_controller', '192.168.1.10', {'rssi': -50, 'uptime': 1030})
+    device = storage.devices.get('ESP_1')
+    assert not device.restored and device.last_seen > restored_at
+
+    # Не вышедшие на связь за интервал после восстановления уходят в offline
+    deadline = device.last_seen + interval - 0.01
+    expired = storage.expiry.pop_expired(deadline)
+    assert set(expired) == {'ESP_2', 'ESP_3'}
+    storage._expire_devices(expired, deadline)
+    assert storage.devices.get('ESP_2').status == 'disconnected'
+    assert storage.devices.get('ESP_1').status == 'connected'
@@ -0,0 +1,50 @@
+# test_device_records.py - КОМПАКТНЫЕ ЗАПИСИ УСТРОЙСТВ И ОБЩИЕ СТРОКИ
+import device_manager
+from device_manager import DeviceRecord, DeviceAttributes, intern_string
+
+
+def make_record(**changes):
+    record = DeviceRecord(device_id='ESP_A', device_type='rgb_controller', ip_address='10.0.0.1',
+                          status='connected', last_seen=100.0,
+                          attributes=DeviceAttributes.from_dict({'rssi': -50, 'firmware': 'nodemcu'}),
+                          created_at=50.0)
+    return record.evolve(**changes) if changes else record
+
+
+def test_evolve_copies_and_state_round_trips():
+    record = make_record()
+    changed = record.evolve(rgb_color='1,2,3', last_data={'t': 20.5}, last_data_time=101.0)
+    assert record.rgb_color == '0,0,0' and changed.rgb_color == '1,2,3'
+
+    restored = DeviceRecord.from_state(changed.to_state())
+    assert restored == changed
+    assert restored.attributes.firmware == 'nodemcu'
+
+
+def test_to_dict_optional_fields_and_projection():
+    record = make_record()
+    data = record.to_dict()
+    assert data['id'] == 'ESP_A' and data['attributes']['rssi'] == -50
+    assert 'last_data' not in data and 'last_button_time' not in data
+
+    assert make_record(last_button_time=5.0).to_dict()['last_button_time'] == 5.0
+    assert record.to_dict(['id', 'rgb_color', 'unknown']) == {'id': 'ESP_A', 'rgb_color': '0,0,0'}
+
+
+def test_intern_table_is_bounded(monkeypatch):
+    monkeypatch.setattr(device_manager, '_STRING_TABLE', {})
+    monkeypatch.setattr(device_manager, 'MAX_INTERNED_STRINGS', 2)
+
+    first = intern_string(''.join(['fw', '-1']))
+    assert intern_string(''.join(['fw', '-1'])) is first
+    intern_string('fw-2')
+    overflow = ''.join(['fw', '-3'])
+    assert intern_string(overflow) is overflow
+    assert device_manager.interned_count() == 2
+    assert intern_string(5) == 5
+
+
+def test_only_low_cardinality_attributes_are_interned(monkeypatch):
+    monkeypatch.setattr(device_manager, '_STRING_TABLE', {})
+    DeviceAttributes.from_dict({'firmware': 'nodemcu', 'mac': 'AA:BB', 'rgb_color': '1,2,3'})
+    assert set(device_manager._STRING_TABLE) == {'nodemcu'}
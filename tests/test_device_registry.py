@@ -0,0 +1,56 @@
+# test_device_registry.py - РЕЕСТР С БЛОКИРОВКАМИ ПО ШАРДАМ И СНИМКАМИ
+import threading
+
+from device_registry import DeviceRegistry
+
+
+def test_snapshot_is_stable_while_registry_changes():
+    registry = DeviceRegistry(stripes=4)
+    registry.put('ESP_A', 1)
+    registry.put('ESP_B', 2)
+    snapshot = registry.snapshot()
+    assert registry.snapshot() is snapshot  # без записей снимок не пересобирается
+
+    registry.put('ESP_A', 10)
+    registry.remove('ESP_B')
+    registry.put('ESP_C', 3)
+    assert dict(snapshot) == {'ESP_A': 1, 'ESP_B': 2}
+    assert dict(registry.snapshot()) == {'ESP_A': 10, 'ESP_C': 3}
+    assert registry.snapshot().version > snapshot.version
+
+
+def test_apply_many_reports_changes_in_order():
+    changes = []
+    registry = DeviceRegistry(stripes=2, on_change=lambda device_id, old, new: changes.append((device_id, old, new)))
+    registry.put('ESP_A', 1)
+    changes.clear()
+
+    results = registry.apply_many([
+        ('ESP_A', lambda old: old + 1),
+        ('ESP_A', lambda old: old * 10),
+        ('ESP_B', lambda old: old),        # устройства нет и запись не меняется
+        ('ESP_C', lambda old: 7),
+    ])
+    assert ('ESP_A', 1, 2) in results and ('ESP_A', 2, 20) in results
+    assert ('ESP_B', None, None) in results
+    assert registry['ESP_A'] == 20 and 'ESP_B' not in registry
+    # on_change только для настоящих изменений
+    assert sorted(changes) == [('ESP_A', 1, 2), ('ESP_A', 2, 20), ('ESP_C', None, 7)]
+
+
+def test_concurrent_updates_are_not_lost():
+    registry = DeviceRegistry(stripes=4)
+    device_ids = [f'ESP_{index}' for index in range(8)]
+    for device_id in device_ids:
+        registry.put(device_id, 0)
+
+    def writer():
+        for _ in range(500):
+            registry.apply_many((device_id, lambda old: old + 1) for device_id in device_ids)
+
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert dict(registry.snapshot()) == {device_id: 2000 for device_id in device_ids}
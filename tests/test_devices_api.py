@@ -0,0 +1,68 @@
+# test_devices_api.py - ETAG, ДЕЛЬТЫ ?since= И ПАГИНАЦИЯ /api/devices
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+import web_server
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = web_server.DeviceStorage()
+    monkeypatch.setattr(web_server, 'storage', storage)
+    monkeypatch.setattr(web_server, 'response_cache', ResponseCache())
+    for index in range(5):
+        storage.add_device(f'ESP_{index}', 'rgb_controller', f'10.0.0.{index}', {'rssi': -50})
+    return storage
+
+
+@pytest.fixture
+def client(storage):
+    return web_server.app.test_client()
+
+
+def test_etag_returns_not_modified_until_change(client, storage):
+    response = client.get('/api/devices')
+    etag = response.headers['ETag']
+    assert len(response.get_json()['devices']) == 5
+
+    assert client.get('/api/devices', headers={'If-None-Match': etag}).status_code == 304
+    storage.devices.update('ESP_1', {'rgb_color': '1,2,3'})
+    assert client.get('/api/devices', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_since_returns_only_changes(client, storage):
+    version = client.get('/api/devices').get_json()['version']
+    storage.devices.update('ESP_2', {'rgb_color': '9,9,9'})
+    storage.remove_device('ESP_4')
+
+    data = client.get(f'/api/devices?since={version}&fields=id,rgb_color').get_json()
+    assert data['full'] is False
+    assert data['devices'] == [{'id': 'ESP_2', 'rgb_color': '9,9,9'}]
+    assert data['removed'] == ['ESP_4']
+
+    # Версия из будущего или неполная история - полный список
+    assert client.get('/api/devices?since=-1').get_json()['full'] is True
+
+
+def test_cursor_pagination_walks_all_online_devices(client, storage):
+    storage.devices.update('ESP_3', {'status': 'disconnected'})
+    seen = []
+    cursor = ''
+    while True:
+        data = client.get(f'/api/devices?limit=2&cursor={cursor}&fields=id').get_json()
+        seen += [device['id'] for device in data['devices']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+    assert seen == ['ESP_0', 'ESP_1', 'ESP_2', 'ESP_4']
+
+
+def test_heartbeat_keeps_sorted_online_page(storage):
+    storage.get_online_page(limit=2)
+    cached = storage._sorted_online
+    storage.add_device('ESP_0', 'rgb_controller', '10.0.0.0', {'rssi': -60})
+    assert storage.get_online_page(limit=2)[0][0].attributes.rssi == -60
+    assert storage._sorted_online is cached
@@ -0,0 +1,47 @@
+# test_event_log.py - КОЛЬЦЕВОЙ ЖУРНАЛ СОБЫТИЙ
+from event_log import EventLog
+
+
+def messages(events):
+    return [event['message'] for event in events]
+
+
+def test_ring_keeps_last_events_after_wraparound():
+    log = EventLog(capacity=3)
+    for index in range(1, 6):
+        assert log.append(f'event {index}', 'error' if index % 2 else 'info') == index
+
+    assert len(log) == 3 and log.first_seq == 3
+    assert messages(log.read()) == ['event 3', 'event 4', 'event 5']
+    assert messages(log.read(limit=2)) == ['event 4', 'event 5']
+    assert log.level_counts == {'error': 3, 'info': 2}
+
+
+def test_read_tail_after_sequence_number():
+    log = EventLog(capacity=10)
+    for index in range(1, 8):
+        log.append(f'event {index}')
+    assert [event['seq'] for event in log.read(after=4)] == [5, 6, 7]
+    assert [event['seq'] for event in log.read(after=1, limit=2)] == [2, 3]
+    assert log.read(after=7) == []
+
+
+def test_read_by_level_skips_overwritten_events():
+    log = EventLog(capacity=4)
+    for index in range(1, 9):
+        log.append(f'event {index}', 'error' if index in (2, 6, 7) else 'info')
+
+    assert messages(log.read(level='error')) == ['event 6', 'event 7']
+    assert messages(log.read(level='error', after=6)) == ['event 7']
+    assert log.read(level='warning') == []
+
+
+def test_export_and_restore_keep_sequence_numbers():
+    log = EventLog(capacity=3)
+    for index in range(1, 5):
+        log.append(f'event {index}', timestamp=float(index))
+
+    copy = EventLog(capacity=3)
+    copy.restore(log.export())
+    assert copy.export() == log.export() and copy.last_seq == 4
+    assert log.export(after=3) == [[4, 4.0, 'event 4', 'info']]
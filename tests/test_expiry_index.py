@@ -0,0 +1,46 @@
+# test_expiry_index.py - ДЕДЛАЙНЫ УСТРОЙСТВ И ФОНОВЫЙ ЖНЕЦ
+import threading
+
+from expiry_index import ExpiryIndex
+
+
+def test_pop_expired_respects_touch_and_discard():
+    index = ExpiryIndex(on_expire=lambda device_ids, now: None, timeout=30)
+    index.touch('ESP_A', 100)
+    index.touch('ESP_B', 100)
+    index.touch('ESP_C', 110)
+    index.touch('ESP_B', 120)   # продлен после постановки в кучу
+    index.discard('ESP_C')
+
+    assert index.pop_expired(129) == []
+    assert index.pop_expired(130) == ['ESP_A']
+    assert index.pop_expired(149) == []
+    assert index.pop_expired(150) == ['ESP_B']
+    assert len(index) == 0 and index.next_deadline() is None
+
+
+def test_heap_holds_one_entry_per_device():
+    index = ExpiryIndex(on_expire=lambda device_ids, now: None, timeout=30)
+    for last_seen in range(100):
+        index.touch('ESP_A', last_seen)
+    assert len(index._heap) == 1
+    assert index.pop_expired(128) == []
+    assert index.pop_expired(129) == ['ESP_A']
+
+
+def test_reaper_thread_reports_expired_devices():
+    expired = []
+    done = threading.Event()
+
+    def on_expire(device_ids, now):
+        expired.extend(device_ids)
+        done.set()
+
+    index = ExpiryIndex(on_expire=on_expire, timeout=0.01, resolution=0.01)
+    index.touch('ESP_A', 0)
+    index.start()
+    try:
+        assert done.wait(2)
+    finally:
+        index.stop()
+    assert expired == ['ESP_A'] and index.expired_count == 1
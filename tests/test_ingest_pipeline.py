@@ -0,0 +1,55 @@
+# test_ingest_pipeline.py - ОЧЕРЕДЬ И ВОРКЕРЫ ОБРАБОТКИ ВХОДЯЩИХ СООБЩЕНИЙ
+import threading
+
+from ingest_pipeline import IngestPipeline
+
+
+def test_messages_are_grouped_and_ordered_per_device():
+    received = []
+    lock = threading.Lock()
+
+    def handler(groups):
+        with lock:
+            received.append(groups)
+
+    pipeline = IngestPipeline(handler, workers=3, queue_size=1000, batch_size=50)
+    for index in range(100):
+        pipeline.submit(f'ESP_{index % 4}', 'status', index)
+    pipeline.start()
+    pipeline.stop()
+
+    by_device = {}
+    for groups in received:
+        for device_id, messages in groups.items():
+            by_device.setdefault(device_id, []).extend(payload for _, payload, _ in messages)
+    # Все сообщения устройства обработаны одним воркером в порядке поступления
+    assert by_device == {f'ESP_{n}': list(range(n, 100, 4)) for n in range(4)}
+
+    stats = pipeline.get_stats()
+    assert stats['processed_count'] == 100 and stats['dropped_count'] == 0
+    assert stats['max_batch_size'] <= 50
+
+
+def test_full_queue_drops_without_blocking():
+    pipeline = IngestPipeline(lambda groups: None, workers=1, queue_size=2)
+    assert pipeline.submit('ESP_A', 'status', b'1')
+    assert pipeline.submit('ESP_A', 'status', b'2')
+    assert not pipeline.submit('ESP_A', 'status', b'3')
+    assert pipeline.get_stats()['dropped_count'] == 1
+
+
+def test_handler_errors_do_not_stop_worker():
+    calls = []
+
+    def handler(groups):
+        calls.append(groups)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+
+    pipeline = IngestPipeline(handler, workers=1, batch_size=1)
+    pipeline.submit('ESP_A', 'status', b'1')
+    pipeline.submit('ESP_A', 'status', b'2')
+    pipeline.start()
+    pipeline.stop()
+    assert len(calls) == 2
+    assert pipeline.get_stats()['handler_errors'] == 1
@@ -0,0 +1,68 @@
+# test_log_pipeline.py - ЛОГИРОВАНИЕ ЧЕРЕЗ ОЧЕРЕДЬ И ВЫБОРКА ПО ТОПИКАМ
+import logging
+import queue
+
+import pytest
+
+from log_pipeline import DroppingQueueHandler, LogPipeline, TopicSampler
+
+
+def make_record(topic, level=logging.INFO, msg='message'):
+    record = logging.LogRecord('test', level, __file__, 1, msg, None, None)
+    record.topic = topic
+    return record
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_sampler_passes_every_nth_record_per_topic():
+    sampler = TopicSampler(every={'status': 3})
+    passed = [sampler.filter(make_record('status')) for _ in range(6)]
+    assert passed == [False, False, True, False, False, True]
+    assert sampler.filter(make_record('register'))
+    assert sampler.filter(make_record('status', logging.WARNING))
+    assert sampler.suppressed == {'status': 4}
+
+
+def test_sampler_rate_limits_topic():
+    sampler = TopicSampler(rate=2)
+    passed = [sampler.filter(make_record('status')) for _ in range(5)]
+    assert passed.count(True) == 2 and sampler.suppressed == {'status': 3}
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(make_record('status'))
+    handler.handle(make_record('status'))
+    assert handler.dropped == 1
+
+
+@pytest.fixture
+def root_handlers():
+    root = logging.getLogger()
+    saved = (list(root.handlers), root.level)
+    yield
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in saved[0]:
+        root.addHandler(handler)
+    root.setLevel(saved[1])
+
+
+def test_pipeline_delivers_records_on_listener_thread(root_handlers):
+    output = ListHandler()
+    pipeline = LogPipeline(handlers=[output])
+    pipeline.start()
+    try:
+        logging.getLogger('device').info('ESP_A online')
+    finally:
+        pipeline.stop()
+    assert output.messages == ['ESP_A online']
+    assert pipeline.get_stats() == {'queued': 0, 'dropped': 0, 'running': False}
@@ -0,0 +1,78 @@
+# test_metrics.py - СЧЕТЧИКИ, ГИСТОГРАММЫ И ВЫВОД /metrics
+import threading
+
+import pytest
+
+from metrics import CallbackMetric, Counter, Family, Histogram, Registry
+
+
+def test_counter_sums_cells_of_all_threads():
+    counter = Counter()
+
+    def work():
+        for _ in range(1000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(5)
+    assert counter.value == 8005
+
+    counter.set(10)
+    counter.inc()
+    assert counter.value == 11
+
+
+def test_histogram_buckets_sum_and_count():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    counts, total, count = histogram.snapshot()
+    assert counts == [2, 1, 1] and total == pytest.approx(2.65) and count == 4
+
+
+def test_family_total_and_set_total():
+    family = Family('esp_messages_total', 'Messages', 'counter', ('type',))
+    family.labels('status').inc(3)
+    family.labels('button').inc()
+    assert family.labels('status') is family.labels('status')
+    assert family.total() == 4
+    family.set_total(100)
+    family.labels('status').inc()
+    assert family.total() == 101
+
+
+def test_render_prometheus_text_format():
+    registry = Registry()
+    messages = registry.register(Family('esp_messages_total', 'MQTT "messages"', 'counter', ('type',)))
+    messages.labels('status').inc(2)
+    latency = registry.register(Family('esp_publish_seconds', 'Publish latency', 'histogram',
+                                       factory=lambda: Histogram((0.01,))))
+    latency.observe(0.005)
+    latency.observe(0.5)
+    registry.register(CallbackMetric('esp_devices_online', 'Online devices', lambda: {'rgb_controller': 3},
+                                     labelnames=('device_type',)))
+    registry.register(CallbackMetric('esp_broken', 'Broken', lambda: 1 / 0))
+
+    assert registry.render().split('\n') == [
+        '# esp_broken: ошибка сбора: division by zero',
+        '# HELP esp_devices_online Online devices',
+        '# TYPE esp_devices_online gauge',
+        'esp_devices_online{device_type="rgb_controller"} 3',
+        '# HELP esp_messages_total MQTT \\"messages\\"',
+        '# TYPE esp_messages_total counter',
+        'esp_messages_total{type="status"} 2',
+        '# HELP esp_publish_seconds Publish latency',
+        '# TYPE esp_publish_seconds histogram',
+        'esp_publish_seconds_bucket{le="0.01"} 1',
+        'esp_publish_seconds_bucket{le="+Inf"} 2',
+        'esp_publish_seconds_sum 0.505',
+        'esp_publish_seconds_count 2',
+        ''
+    ]
+
+    with pytest.raises(ValueError):
+        registry.register(Family('esp_messages_total', 'Duplicate', 'counter'))
@@ -0,0 +1,71 @@
+# test_multiprocess_replica.py - КОПИЯ СОСТОЯНИЯ В HTTP ВОРКЕРЕ МНОГОПРОЦЕССНОГО РЕЖИМА
+import os
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+import multiprocess_server
+import web_server
+from device_registry import MirroredChangeLog
+from multiprocess_server import StateOwner, StateReplica
+
+
+@pytest.fixture
+def owner(tmp_path, monkeypatch):
+    # Владелец и копия в одном процессе: копия не должна снимать регистрацию блока общей памяти
+    monkeypatch.setattr(multiprocess_server.resource_tracker, 'unregister', lambda name, rtype: None)
+    storage = web_server.DeviceStorage()
+    owner = StateOwner(storage, web_server.app, str(tmp_path / 'ipc.sock'), f'esp_test_{os.getpid()}').start()
+    yield owner
+    owner.stop()
+
+
+@pytest.fixture
+def replica(owner):
+    replica = StateReplica(web_server.DeviceStorage(), owner.address, owner.authkey, owner.shm_name)
+    yield replica
+    replica.counters.close()
+
+
+def test_replica_follows_owner_versions(owner, replica):
+    source = owner.storage
+    for index in range(3):
+        source.add_device(f'ESP_{index}', 'rgb_controller', f'10.0.0.{index}', {'rssi': -50})
+    owner.publish()
+
+    assert replica.sync(wait=True)
+    copy = replica.storage
+    assert sorted(copy.devices) == ['ESP_0', 'ESP_1', 'ESP_2']
+    assert copy.version == source.version
+    assert owner.full_sync_count == 1
+
+    source.add_device('ESP_1', 'rgb_controller', '10.0.0.1', {'rssi': -70})
+    source.remove_device('ESP_2')
+    owner.publish()
+
+    assert replica.sync(wait=True)
+    assert owner.full_sync_count == 1 and owner.sync_count == 2
+    assert sorted(copy.devices) == ['ESP_0', 'ESP_1']
+    assert copy.devices['ESP_1'].attributes.rssi == -70
+    assert copy.version == source.version
+    # ?since= у воркера отдает те же изменения, что и у процесса приема
+    assert copy.changes.changes_since(3) == source.changes.changes_since(3)
+    assert copy.event_log.export() == source.event_log.export()
+
+    assert not replica.sync(wait=True)
+
+
+def test_mirrored_changelog_takes_versions_from_owner():
+    changes = MirroredChangeLog()
+    assert changes.record('ESP_A') == 0
+
+    # Полная копия: история до ее версии неизвестна
+    changes.mirror(5, {'ESP_A': 4, 'ESP_B': 5}, {}, reset=True)
+    assert changes.changes_since(5) == (5, [], [])
+    assert changes.changes_since(4) is None
+
+    changes.mirror(7, {'ESP_A': 7}, {'ESP_B': 6})
+    assert changes.changes_since(5) == (7, ['ESP_A'], ['ESP_B'])
+    assert changes.version_of('ESP_B') == 6
@@ -0,0 +1,74 @@
+# test_outbound_scheduler.py - ОЧЕРЕДИ И ОГРАНИЧЕНИЕ СКОРОСТИ КОМАНД НА УСТРОЙСТВО
+from command_publisher import OutboundCommand, OutboundScheduler
+
+
+def make_command(device_id, command, number):
+    return OutboundCommand(f'{device_id}-{number}', device_id, command, f'esp/{device_id}/command',
+                           f'{{"command": "{command}", "n": {number}}}', 0, None)
+
+
+def make_scheduler(**options):
+    sent = []
+
+    def dispatch(command):
+        sent.append(command.command_id)
+        return True
+
+    options.setdefault('rate', 0.001)
+    return OutboundScheduler(dispatch, **options), sent
+
+
+def test_burst_goes_out_immediately_then_queues():
+    scheduler, sent = make_scheduler(burst=2)
+    statuses = [scheduler.submit(make_command('ESP_A', 'RESTART', n)) for n in range(3)]
+    assert statuses == ['sent', 'sent', 'queued']
+    assert sent == ['ESP_A-0', 'ESP_A-1'] and scheduler.depth('ESP_A') == 1
+
+
+def test_only_latest_coalesced_command_stays_queued():
+    scheduler, sent = make_scheduler(burst=1)
+    scheduler.submit(make_command('ESP_A', 'SET_COLOR', 0))
+    for n in range(1, 5):
+        assert scheduler.submit(make_command('ESP_A', 'SET_COLOR', n)) == 'queued'
+    scheduler.submit(make_command('ESP_A', 'RESTART', 5))
+
+    assert scheduler.coalesced_count == 3
+    assert scheduler.get_backlog() == [('ESP_A', 2, ['SET_COLOR', 'RESTART'])]
+    assert [command.payload for command in scheduler._queues['ESP_A']][0].endswith('"n": 4}')
+
+
+def test_full_device_queue_drops_new_commands():
+    scheduler, sent = make_scheduler(burst=1, max_queue=2)
+    statuses = [scheduler.submit(make_command('ESP_A', 'RESTART', n)) for n in range(4)]
+    assert statuses == ['sent', 'queued', 'queued', 'dropped']
+    assert scheduler.get_stats()['dropped_count'] == 1
+    # Другие устройства ограничиваются отдельно
+    assert scheduler.submit(make_command('ESP_B', 'RESTART', 0)) == 'sent'
+
+
+def test_pop_ready_takes_one_command_per_device_per_pass():
+    scheduler, sent = make_scheduler(burst=1)
+    for device_id in ('ESP_A', 'ESP_B'):
+        for n in range(3):
+            scheduler.submit(make_command(device_id, 'RESTART', n))
+
+    def refill():
+        for bucket in scheduler._buckets.values():
+            bucket.tokens = bucket.burst
+
+    refill()
+    ready, wait = scheduler.pop_ready()
+    assert [command.command_id for command in ready] == ['ESP_A-1', 'ESP_B-1']
+    assert wait == 0.0
+    ready, wait = scheduler.pop_ready()
+    assert ready == [] and wait > 0
+    refill()
+    ready, _ = scheduler.pop_ready()
+    assert [command.command_id for command in ready] == ['ESP_A-2', 'ESP_B-2']
+    assert scheduler.backlog == 0 and scheduler.pop_ready() == ([], None)
+
+
+def test_failed_immediate_publish_is_reported():
+    scheduler = OutboundScheduler(lambda command: False, rate=1, burst=1)
+    assert scheduler.submit(make_command('ESP_A', 'RESTART', 0)) == 'error'
+    assert scheduler.failed_count == 1
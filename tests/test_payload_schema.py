@@ -0,0 +1,52 @@
+# test_payload_schema.py - СКОМПИЛИРОВАННЫЕ СХЕМЫ ПОЛЕЙ СООБЩЕНИЙ
+import pytest
+
+from payload_schema import MessageSchema, Field, STATUS_SCHEMA, as_bool, as_int, as_rgb, as_str
+
+
+def make_schema():
+    return MessageSchema('test', (
+        Field('name', ('n', 'name'), 'unknown', as_str),
+        Field('count', ('c', 'count'), 0, as_int),
+        Field('enabled', ('on',), False, as_bool),
+        Field('color', ('rgb',), '0,0,0', as_rgb),
+    ), ignore=('id',))
+
+
+def test_short_alias_wins_and_missing_fields_get_defaults():
+    schema = make_schema()
+    assert schema.decode({'n': 'short', 'name': 'long', 'count': 2.7, 'id': 'ESP_A'}) == {
+        'name': 'short', 'count': 2, 'enabled': False, 'color': '0,0,0'
+    }
+    assert schema.decode({'on': 1, 'rgb': '255,0,10'}) == {
+        'name': 'unknown', 'count': 0, 'enabled': True, 'color': '255,0,10'
+    }
+    assert schema.decoded_count == 2 and schema.invalid_count == 0 and schema.unknown_count == 0
+
+
+def test_invalid_values_fall_back_to_defaults_and_are_counted():
+    schema = make_schema()
+    assert schema.decode({'n': 5, 'c': '3', 'on': 2, 'rgb': '256,0,0'}) == {
+        'name': 'unknown', 'count': 0, 'enabled': False, 'color': '0,0,0'
+    }
+    assert schema.invalid_fields == {'name': 1, 'count': 1, 'enabled': 1, 'color': 1}
+
+
+def test_unknown_keys_are_counted():
+    schema = make_schema()
+    schema.decode({'n': 'a', 'extra': 1, 'other': 2})
+    schema.decode({'extra': 1})
+    assert schema.unknown_count == 3 and schema.unknown_keys == {'extra': 2, 'other': 1}
+
+
+def test_decode_bytes_accepts_only_json_objects():
+    assert STATUS_SCHEMA.decode_bytes(b'{"t": "rgb_controller", "heap": 30000}')['free_heap'] == 30000
+    with pytest.raises(ValueError):
+        STATUS_SCHEMA.decode_bytes(b'[1, 2]')
+    with pytest.raises(ValueError):
+        STATUS_SCHEMA.decode_bytes(b'{broken')
+
+
+def test_present_values_skips_fields_the_device_did_not_send():
+    data = {'t': 'rgb_controller', 'rssi': -60, 'uptime': 42}
+    assert STATUS_SCHEMA.present_values(data, ('rssi', 'free_heap', 'uptime')) == {'rssi': -60, 'uptime': 42}
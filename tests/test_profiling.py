@@ -0,0 +1,81 @@
+# test_profiling.py - СЭМПЛЕР СТЕКОВ, СПАНЫ ЭТАПОВ И ЖУРНАЛ МЕДЛЕННЫХ СООБЩЕНИЙ
+import threading
+import time
+
+from profiling import SamplingProfiler, SlowMessageLog, SpanTracer, format_collapsed
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = SpanTracer()
+    with tracer.span('ingest'):
+        tracer.add('decode', 1.0)
+    assert tracer.begin('ingest') is None
+    assert tracer._totals == {}
+
+
+def test_spans_record_self_time_by_path():
+    tracer = SpanTracer()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(totals=tracer.trace(0.3)))
+    thread.start()
+    while not tracer.enabled:
+        time.sleep(0.001)
+
+    with tracer.span('ingest'):
+        tracer.add('decode', 0.001)
+        time.sleep(0.01)
+        with tracer.span('apply'):
+            time.sleep(0.05)
+    thread.join()
+
+    totals = result['totals']
+    assert set(totals) == {'ingest', 'ingest;decode', 'ingest;apply'}
+    assert totals['ingest;decode'] == 1000
+    assert totals['ingest;apply'] >= 50000
+    # Вложенные спаны не входят в собственное время внешнего
+    assert 5000 <= totals['ingest'] < 40000
+    assert not tracer.enabled and tracer.trace(0) == {}
+
+
+def test_unclosed_nested_span_is_closed_with_outer():
+    tracer = SpanTracer()
+    tracer.enabled = True
+    outer = tracer.begin('ingest')
+    tracer.begin('decode')
+    tracer.end(outer)
+    assert tracer._stack() == [] and set(tracer._totals) == {'ingest'}
+
+
+def test_sampler_collects_stacks_of_busy_threads():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_loop, name='busy')
+    thread.start()
+    try:
+        stacks, snapshots = SamplingProfiler().profile(0.1, interval=0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert snapshots > 0
+    assert any(stack.startswith('busy;') and 'busy_loop' in stack for stack in stacks)
+    assert format_collapsed({'a;b': 1, 'a;c': 3}) == 'a;c 3\na;b 1\n'
+
+
+def test_slow_message_log_keeps_newest_entries():
+    log = SlowMessageLog(capacity=2, payload_bytes=4)
+    log.record_message('ESP_A', 'status', b'{"t": 1}', 0.05, time.time())
+    log.record_message('ESP_B', 'status', b'\xff\x01', 0.05, time.time())
+    log.record_batch('apply', 0.1, ['ESP_A', 'ESP_B'], 10)
+
+    entries = log.get_entries()
+    assert [entry['kind'] for entry in entries] == ['apply', 'decode']
+    assert entries[1]['payload'] == 'ff 01' and not entries[1]['truncated']
+    assert log.get_stats()['recorded_count'] == 3
+
+    log.record_message('ESP_A', 'status', b'{"t": 1}', 0.05, time.time())
+    assert log.get_entries(limit=1)[0]['payload'] == '{"t"' and log.get_entries(limit=1)[0]['truncated']
@@ -0,0 +1,45 @@
+# test_response_cache.py - КЭШ ГОТОВЫХ ОТВЕТОВ ПО ВЕРСИИ ХРАНИЛИЩА
+import gzip
+import json
+
+from response_cache import ResponseCache
+
+
+def test_entry_is_rebuilt_only_when_version_changes():
+    cache = ResponseCache()
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return {'count': len(builds)}
+
+    first = cache.get_or_build('devices', 1, builder)
+    assert cache.get_or_build('devices', 1, builder) is first
+    assert json.loads(first.body) == {'count': 1}
+
+    second = cache.get_or_build('devices', 2, builder)
+    assert json.loads(second.body) == {'count': 2}
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_max_age_expires_entry_of_same_version():
+    cache = ResponseCache()
+    first = cache.get_or_build('stats', 1, lambda: {'uptime': 1}, max_age=0)
+    assert cache.get_or_build('stats', 1, lambda: {'uptime': 2}, max_age=0) is not first
+
+
+def test_large_bodies_are_gzipped_once():
+    cache = ResponseCache(gzip_min_size=64)
+    small = cache.get_or_build('small', 1, lambda: {'a': 1})
+    large = cache.get_or_build('large', 1, lambda: {'devices': [f'ESP_{i}' for i in range(100)]})
+    assert small.gzipped is None
+    assert gzip.decompress(large.gzipped) == large.body
+
+
+def test_oldest_entries_are_evicted():
+    cache = ResponseCache(max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.get_or_build(key, 1, dict)
+    assert sorted(cache._entries) == ['b', 'c']
+    cache.invalidate('b')
+    assert list(cache._entries) == ['c']
@@ -0,0 +1,61 @@
+# test_status_ingest.py - СРАВНЕНИЕ СТАТУСОВ С ЗАПИСЬЮ УСТРОЙСТВА
+import json
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('paho.mqtt')
+
+import web_server
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    storage = web_server.DeviceStorage()
+    monkeypatch.setattr(web_server, 'storage', storage)
+    return storage
+
+
+def ingest(device_id, message_type, data):
+    payload = json.dumps(data).encode('utf-8')
+    web_server._process_ingest_batch({device_id: [(message_type, payload, time.time())]})
+
+
+def status(uptime=1000, **fields):
+    return {'t': 'rgb_controller', 'ip': '192.168.1.10', 'rssi': -55, 'up': uptime,
+            'btn': False, 'rgb': '0,0,0', **fields}
+
+
+def test_repeated_status_reconciles_button_state(storage):
+    ingest('ESP_1', 'status', status())
+    ingest('ESP_1', 'button', {'action_button_pressed': True, 'led_on': True})
+    device = storage.devices.get('ESP_1')
+    assert device.action_button_pressed and not device.available
+
+    # Те же байты, что и в прошлом статусе: запись все равно сверяется по полям
+    ingest('ESP_1', 'status', status())
+    device = storage.devices.get('ESP_1')
+    assert not device.action_button_pressed
+    assert device.available
+
+
+def test_status_diff_against_record(storage):
+    ingest('ESP_1', 'status', status(uptime=1000))
+    created_at = storage.devices.get('ESP_1').created_at
+
+    # Изменились только rssi/uptime - обновление без события об изменении
+    ingest('ESP_1', 'status', status(uptime=1030, rssi=-60))
+    assert storage.status_counts['heartbeat'] == 1
+    assert storage.devices.get('ESP_1').attributes.uptime == 1030
+
+    # Без изменений - только last_seen
+    ingest('ESP_1', 'status', status(uptime=1030, rssi=-60))
+    assert storage.status_counts['touched'] == 1
+
+    ingest('ESP_1', 'status', status(uptime=1060, rssi=-60, rgb='10,20,30'))
+    assert storage.status_counts['changed'] == 1
+    device = storage.devices.get('ESP_1')
+    assert device.rgb_color == '10,20,30'
+    assert device.created_at == created_at
+    assert storage.status_counts['new'] == 1
@@ -0,0 +1,55 @@
+# test_telemetry_store.py - СЕГМЕНТЫ И ЗАПРОСЫ ИСТОРИИ ТЕЛЕМЕТРИИ
+from telemetry_store import TelemetryStore
+
+
+def make_store(tmp_path, **kwargs):
+    return TelemetryStore(str(tmp_path), partition_seconds=3600, retention_seconds=7200, **kwargs)
+
+
+def test_interleaved_device_ranges_in_one_segment(tmp_path):
+    store = make_store(tmp_path)
+    store.append_many([
+        ('ESP_A', 3000, {'rssi': -40}),
+        ('ESP_B', 100, {'rssi': -70}),
+        ('ESP_B', 200, {'rssi': -71})
+    ])
+    assert store.flush() == 3
+
+    # Сегмент начинается с устройства A (t=3000), но точки B раньше
+    assert store.points('ESP_B', 'rssi', 0, 1000) == [(100.0, -70.0), (200.0, -71.0)]
+    assert store.points('ESP_A', 'rssi', 0, 1000) == []
+    assert store.points('ESP_A', 'rssi', 2000, 3600) == [(3000.0, -40.0)]
+
+
+def test_points_merge_segments_buffer_and_restart(tmp_path):
+    store = make_store(tmp_path)
+    store.append('ESP_A', 10, {'rssi': -50, 'free_heap': 30000})
+    store.flush()
+    store.append('ESP_A', 20, {'rssi': -51})
+    store.flush()
+    store.append('ESP_A', 30, {'rssi': -52})  # еще в буфере
+
+    assert store.points('ESP_A', 'rssi', 0, 100) == [(10.0, -50.0), (20.0, -51.0), (30.0, -52.0)]
+    # Метрика отсутствует в части строк - пропуски не возвращаются
+    assert store.points('ESP_A', 'free_heap', 0, 100) == [(10.0, 30000.0)]
+
+    assert store.compact(0)
+    store.flush()
+    reopened = make_store(tmp_path)
+    assert reopened.points('ESP_A', 'rssi', 0, 100) == [(10.0, -50.0), (20.0, -51.0), (30.0, -52.0)]
+    assert reopened.metrics_of('ESP_A') == ['free_heap', 'rssi']
+
+
+def test_series_downsampling_and_retention(tmp_path):
+    store = make_store(tmp_path)
+    store.append_many([('ESP_A', t, {'rssi': float(t)}) for t in range(0, 120, 10)])
+    store.append('ESP_A', 7300, {'rssi': 1.0})
+    store.flush()
+
+    series = store.series('ESP_A', 'rssi', 0, 120, step=60)
+    assert series['points'] == [[0, 25.0, 0.0, 50.0, 6], [60, 85.0, 60.0, 110.0, 6]]
+
+    # Партиция [0, 3600) старше срока хранения на момент 11000
+    assert store.enforce_retention(now=11000) == 1
+    assert store.points('ESP_A', 'rssi', 0, 120) == []
+    assert store.points('ESP_A', 'rssi', 7200, 7400) == [(7300.0, 1.0)]
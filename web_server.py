@@ -1,18 +1,37 @@
 # web_server.py - ПОЛНОСТЬЮ ПЕРЕРАБОТАННАЯ ВЕРСИЯ С АВТООПРЕДЕЛЕНИЕМ IP
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, Response, render_template, jsonify, request, send_from_directory, g
+from flask.json.provider import DefaultJSONProvider
 import paho.mqtt.client as mqtt
 import json
 import time
 import threading
 import os
-from datetime import datetime
-from collections import defaultdict
+import bisect
 import logging
 import socket
+from dataclasses import replace
+from ingest_pipeline import IngestPipeline
+from device_registry import DeviceRegistry, ChangeLog
+from expiry_index import ExpiryIndex
+from device_index import DeviceIndex
+from device_manager import DeviceRecord, DeviceAttributes, INTERNED_ATTRIBUTES, intern_string
+from change_feed import ChangeFeed, format_sse
+from response_cache import ResponseCache
+from command_publisher import CommandPublisher, ACCEPTED_STATUSES
+from command_tracker import CommandTracker
+import color_ops
+from telemetry_store import TelemetryStore
+from device_health import DeviceHealth
+from event_log import EventLog
+from device_journal import DeviceJournal
+from log_pipeline import LogPipeline, TopicSampler
+import payload_schema
+import metrics
+import profiling
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# Записи по каждому MQTT сообщению - отдельный логгер с выборкой по топикам
+message_logger = logging.getLogger(__name__ + '.messages')
 
 app = Flask(__name__)
 
@@ -39,6 +58,90 @@ class Config:
     WEB_PORT = 5000
     DEVICE_TOPIC_PREFIX = "devices"
     STATUS_UPDATE_INTERVAL = 30  # секунды
+    # Конвейер обработки входящих MQTT сообщений
+    INGEST_WORKERS = 4
+    INGEST_QUEUE_SIZE = 10000
+    INGEST_BATCH_SIZE = 256
+    INGEST_BATCH_WAIT = 0.0  # секунды ожидания добора пачки
+    STORAGE_STRIPES = 16  # количество шардов блокировок реестра устройств
+    EXPIRY_RESOLUTION = 1.0  # секунды между проверками просроченных устройств
+    # Поток изменений для дашбордов (/api/stream)
+    STREAM_WINDOW = 0.25  # окно объединения изменений, секунды
+    STREAM_KEEPALIVE = 15  # интервал keepalive комментариев, секунды
+    # Кэш готовых JSON ответов для часто опрашиваемых API
+    RESPONSE_CACHE_ENTRIES = 512
+    RESPONSE_CACHE_GZIP = True
+    STATUS_CACHE_MAX_AGE = 1.0  # секунды, /api/system/status зависит от счетчиков сообщений
+    # Отправка команд
+    COMMAND_QOS = 0
+    COMMAND_RATE_LIMIT = 5000  # публикаций в секунду
+    COMMAND_BURST = 1000
+    # Очереди команд по устройствам: ESP8266 не успевает за сотнями SET_COLOR подряд
+    COMMAND_DEVICE_RATE = 10  # команд в секунду на устройство (0 - без очередей)
+    COMMAND_DEVICE_BURST = 5
+    COMMAND_DEVICE_QUEUE = 32  # команд в очереди одного устройства, дальше - отказ
+    # Команды, у которых в очереди и в ожидании подтверждения остается только последняя
+    COMMAND_COALESCE = ('SET_COLOR', 'RESET_BUTTON', 'SET_FORMAT', 'STATUS')
+    # Подтверждения команд (devices/+/ack) и повторы неподтвержденных
+    COMMAND_ACK_TIMEOUT = 2.0  # секунды до первого повтора
+    COMMAND_MAX_RETRIES = 3
+    COMMAND_RETRY_BACKOFF = 2.0  # множитель ожидания для следующих повторов
+    COMMAND_MAX_PENDING = 10000  # команд в ожидании подтверждения
+    # Повторяются и устройствам, еще не присылавшим подтверждений (повторное выполнение безопасно)
+    COMMAND_IDEMPOTENT = ('SET_COLOR', 'RESET_BUTTON', 'SET_FORMAT', 'STATUS')
+    # True - локальные данные (цвет, кнопка) меняются сразу при отправке;
+    # False - после подтверждения устройством. Устройства, не приславшие ни одного
+    # подтверждения (прошивки без них), всегда обновляются сразу
+    COMMAND_OPTIMISTIC_UPDATES = False
+    # История телеметрии (devices/+/data и показатели из статуса)
+    TELEMETRY_DIR = os.path.abspath("telemetry")
+    TELEMETRY_PARTITION_SECONDS = 3600  # одна партиция (каталог сегментов) на час
+    TELEMETRY_RETENTION_HOURS = 24 * 7
+    TELEMETRY_FLUSH_INTERVAL = 10.0  # секунды между записями сегментов
+    TELEMETRY_STATUS_METRICS = ('rssi', 'free_heap', 'uptime')
+    HEALTH_EWMA_ALPHA = 0.2  # вес нового значения в скользящем среднем
+    HEALTH_SKETCH_ACCURACY = 0.02  # относительная точность p50/p95
+    EVENT_LOG_CAPACITY = 1000  # событий в кольцевом журнале
+    # Журнал изменений и снимки состояния для восстановления после перезапуска
+    JOURNAL_DIR = os.path.abspath("state")
+    JOURNAL_SYNC_INTERVAL = 0.05  # секунды между групповыми фиксациями (fsync)
+    SNAPSHOT_INTERVAL = 300  # секунды между полными снимками
+    # Логирование (запись в консоль выполняется в отдельном потоке)
+    LOG_LEVEL = logging.INFO
+    LOG_QUEUE_SIZE = 10000  # записей; при переполнении новые записи отбрасываются
+    LOG_MESSAGES = False  # DEBUG записи по каждому MQTT сообщению
+    LOG_PAYLOADS = False  # полный текст payload каждого сообщения (только для отладки)
+    LOG_TOPIC_SAMPLING = {'status': 1, 'data': 10, 'button': 1}  # писать каждое N-е сообщение топика
+    LOG_TOPIC_RATE = 20  # не более записей в секунду на топик
+    # Формат сообщений, который сервер предлагает устройствам: 'json' или 'bin'
+    # (прием работает для обоих форматов независимо от настройки)
+    PAYLOAD_FORMAT = 'json'
+    # Режим сервера: 'threaded' - Flask с потоком на запрос и отдельный поток paho,
+    # 'asyncio' - async_server.py: HTTP и MQTT на одном цикле событий,
+    # 'multiprocess' - multiprocess_server.py: процесс приема и HTTP воркеры
+    SERVER_RUNTIME = 'threaded'
+    ASYNC_HTTP_SERVER = 'builtin'  # 'builtin' или 'uvicorn' (pip install uvicorn)
+    ASYNC_WORKER_THREADS = 8  # пул для POST запросов и маршрутов с чтением с диска
+    ASYNC_OFFLOAD_PATHS = ('/series',)  # окончания путей GET маршрутов, которые выполняются в пуле
+    # Многопроцессный режим (multiprocess_server.py): один процесс MQTT и состояния, N HTTP воркеров
+    WEB_WORKERS = os.cpu_count() or 1
+    WORKER_IPC_ADDRESS = ('127.0.0.1', 5001)  # канал воркеров к процессу приема
+    WORKER_SHARED_STATE = 'esp_device_state'  # имя блока общей памяти со счетчиками версий
+    WORKER_SYNC_INTERVAL = 0.05  # период публикации версий и фоновой синхронизации воркеров, с
+    # Профилирование (/api/admin/profile, /api/admin/trace, /api/admin/slow_messages)
+    PROFILING_ENABLED = False  # без этого флага маршруты профилирования отвечают 403
+    PROFILE_MAX_SECONDS = 60  # предел длительности одного запуска сэмплера или трассировки
+    PROFILE_INTERVAL = 0.005  # секунды между снимками стеков
+    SLOW_MESSAGE_MS = 20.0  # разбор сообщения или применение пачки дольше - запись в журнал медленных
+    SLOW_MESSAGE_LOG_SIZE = 200
+    SLOW_PAYLOAD_BYTES = 512  # сохраняемое начало payload медленного сообщения
+
+# Настройка логирования
+log_pipeline = LogPipeline(level=Config.LOG_LEVEL, queue_size=Config.LOG_QUEUE_SIZE)
+log_pipeline.start()
+message_sampler = TopicSampler(every=Config.LOG_TOPIC_SAMPLING, rate=Config.LOG_TOPIC_RATE)
+message_logger.addFilter(message_sampler)
+message_logger.setLevel(logging.DEBUG if Config.LOG_MESSAGES or Config.LOG_PAYLOADS else logging.INFO)
 
 # Выводим информацию о конфигурации
 print("=" * 50)
@@ -48,117 +151,509 @@ print(f"🔗 MQTT брокер: {Config.MQTT_BROKER_HOST}:{Config.MQTT_BROKER_PO
 print(f"🌐 Веб-интерфейс: http://{LOCAL_IP}:{Config.WEB_PORT}")
 print("=" * 50)
 
+# Метрики /metrics: запись в ячейку своего потока, без блокировок на горячем пути
+MESSAGE_TYPES = ('status', 'data', 'button', 'error', 'disconnect', 'ack')
+mqtt_messages = metrics.counter('esp_mqtt_messages_total', 'Входящие MQTT сообщения по типу и формату', ('type', 'format'))
+errors_total = metrics.counter('esp_errors_total', 'Ошибки обработки сообщений, команд и API')
+decode_seconds = metrics.histogram('esp_ingest_decode_seconds', 'Разбор payload одного сообщения', ('type',))
+apply_seconds = metrics.histogram('esp_storage_apply_seconds', 'Применение пачки обновлений к хранилищу')
+batch_messages = metrics.histogram('esp_ingest_batch_messages', 'Сообщений в пачке конвейера',
+                                   buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+publish_seconds = metrics.histogram('esp_mqtt_publish_seconds', 'Вызов publish() MQTT клиента для команд')
+request_seconds = metrics.histogram('esp_http_request_seconds', 'Обработка HTTP запросов', ('route', 'method'))
+http_responses = metrics.counter('esp_http_responses_total', 'HTTP ответы по маршрутам и кодам', ('route', 'code'))
+
+# Дочерние счетчики по типам сообщений заранее: на горячем пути только поиск в словаре
+message_counters = {message_type: mqtt_messages.labels(message_type, 'json') for message_type in MESSAGE_TYPES}
+message_counters.update({message_type + '/bin': mqtt_messages.labels(message_type, 'bin') for message_type in MESSAGE_TYPES})
+other_messages = mqtt_messages.labels('other', 'json')
+decode_timers = {message_type: decode_seconds.labels(message_type.partition('/')[0]) for message_type in message_counters}
+other_decode_timer = decode_seconds.labels('other')
+
+# Профилирование по запросу: сэмплер стеков, спаны этапов, журнал медленных сообщений
+sampler = profiling.SamplingProfiler(max_seconds=Config.PROFILE_MAX_SECONDS, default_interval=Config.PROFILE_INTERVAL)
+span_tracer = profiling.SpanTracer(max_seconds=Config.PROFILE_MAX_SECONDS)
+slow_messages = profiling.SlowMessageLog(
+    threshold=Config.SLOW_MESSAGE_MS / 1000,
+    capacity=Config.SLOW_MESSAGE_LOG_SIZE,
+    payload_bytes=Config.SLOW_PAYLOAD_BYTES
+)
+slow_messages.enabled = Config.PROFILING_ENABLED
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """JSON провайдер Flask: сериализация jsonify() видна в трассировке отдельным спаном"""
+
+    def dumps(self, obj, **kwargs):
+        with span_tracer.span('json dumps'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TracedJSONProvider(app)
+
 # Хранилище данных
 class DeviceStorage:
     def __init__(self):
-        self.devices = {}
-        self.device_types = defaultdict(list)
-        self.message_count = 0
-        self.error_count = 0
+        # Реестр с блокировками по шардам: API читает снимки без блокировок
+        self.devices = DeviceRegistry(stripes=Config.STORAGE_STRIPES, on_change=self._track_change)
+        # Онлайн устройства поддерживаются инкрементально при изменении записей
+        self.online_devices = {}  # device_id -> None (упорядочено по времени подключения)
+        self.online_by_type = {}
+        self._online_lock = threading.Lock()
+        self._online_version = 0  # растет при изменении состава онлайн устройств
+        # Дедлайны last_seen + таймаут, фоновый поток переводит просроченные в offline
+        self.expiry = ExpiryIndex(
+            on_expire=self._expire_devices,
+            timeout=Config.STATUS_UPDATE_INTERVAL,
+            resolution=Config.EXPIRY_RESOLUTION
+        )
+        # Вторичные индексы для выборок без обхода всего парка
+        self.index = DeviceIndex({
+            'type': lambda device: device.device_type,
+            'status': lambda device: device.status,
+            'available': lambda device: device.available,
+            'firmware': lambda device: device.attributes.firmware,
+            'version': lambda device: device.attributes.version
+        })
+        # Скользящая статистика RSSI/памяти/аптайма и рейтинги по парку
+        self.health = DeviceHealth(
+            metrics=Config.TELEMETRY_STATUS_METRICS,
+            alpha=Config.HEALTH_EWMA_ALPHA,
+            accuracy=Config.HEALTH_SKETCH_ACCURACY,
+            on_restart=self._on_device_restart
+        )
+        # Текущие цвета RGB контроллеров в упакованном виде для групповых операций
+        self.colors = color_ops.ColorTable()
+        # Версии изменений для ETag и запросов ?since=
+        self.changes = ChangeLog()
+        self._sorted_online = None
+        # Изменения устройств для потоковых клиентов
+        self.feed = ChangeFeed(window=Config.STREAM_WINDOW, stats_provider=self.get_device_stats)
         self.start_time = time.time()
-        self.event_log = []
+        self.event_log = EventLog(capacity=Config.EVENT_LOG_CAPACITY)
+        # Журнал изменений (подключается после восстановления состояния)
+        self.journal = None
+        # Итоги обработки статусов (new - новые/вернувшиеся, touched - только last_seen)
+        self.status_counts = {'new': 0, 'changed': 0, 'heartbeat': 0, 'touched': 0}
+        self._status_lock = threading.Lock()
         
-    def add_device(self, device_id, device_type, ip_address, attributes=None):
-        """Добавление нового устройства с поддержкой RGB устройств"""
-        device_data = {
-            'id': device_id,
-            'type': device_type,
-            'ip': ip_address,
-            'status': 'connected',
-            'last_seen': time.time(),
-            'attributes': attributes or {},
-            'created_at': datetime.now().isoformat(),
-            # Новые поля для RGB устройств
-            'action_button_pressed': False,
-            'led_on': True,
-            'rgb_color': '0,0,0',  # формат: "red,green,blue"
-            'available': True      # доступно для перемешивания
-        }
+    # Поля записи, изменение которых отправляется в поток (атрибут -> ключ JSON)
+    STREAM_FIELDS = (
+        ('status', 'status'),
+        ('device_type', 'type'),
+        ('ip_address', 'ip'),
+        ('rgb_color', 'rgb_color'),
+        ('led_on', 'led_on'),
+        ('action_button_pressed', 'action_button_pressed'),
+        ('available', 'available'),
+        ('restored', 'restored')
+    )
+        
+    # Показатели, которые меняются почти в каждом статусе: сохраняются, но изменением не считаются
+    VOLATILE_ATTRIBUTES = frozenset(('rssi', 'free_heap', 'uptime'))
+    # Поля записи, которые берутся из атрибутов статуса
+    STATUS_RECORD_FIELDS = ('action_button_pressed', 'led_on', 'rgb_color', 'available')
+    
+    @staticmethod
+    def _build_device_record(device_id, device_type, ip_address, attributes=None, now=None):
+        """Формирование записи устройства по данным статуса"""
+        now = now if now is not None else time.time()
+        device_data = DeviceRecord(
+            device_id=device_id,
+            device_type=intern_string(device_type),
+            ip_address=ip_address,
+            status='connected',
+            last_seen=now,
+            attributes=DeviceAttributes.from_dict(attributes or {}),
+            created_at=now
+        )
         
         # Обновляем атрибуты из MQTT сообщения
         if attributes:
             if 'action_button_pressed' in attributes:
-                device_data['action_button_pressed'] = attributes['action_button_pressed']
+                device_data.action_button_pressed = attributes['action_button_pressed']
             if 'led_on' in attributes:
-                device_data['led_on'] = attributes['led_on']
+                device_data.led_on = attributes['led_on']
             if 'rgb_color' in attributes:
-                device_data['rgb_color'] = attributes['rgb_color']
+                device_data.rgb_color = attributes['rgb_color']
             if 'available' in attributes:
-                device_data['available'] = attributes['available']
+                device_data.available = attributes['available']
+        
+        # Для RGB контроллеров доступность определяется кнопкой (как в update_device)
+        if device_type == 'rgb_controller':
+            device_data.available = not device_data.action_button_pressed
+                
+        return device_data
+    
+    def _apply_status(self, old, device_id, device_type, ip_address, attributes, now, diffs, counts):
+        """Запись по статусу устройства (вызывается реестром под блокировкой шарда).
+
+        Новое или вернувшееся в онлайн устройство получает полную запись с новым
+        created_at. Для онлайн устройства поля сравниваются с текущей записью:
+        без изменений обновляется только last_seen, иначе копируются только
+        изменившиеся поля. Значимые изменения {поле: (было, стало)} сливаются в diffs.
+        """
+        if old is None or old.status != 'connected':
+            counts['new'] += 1
+            record = self._build_device_record(device_id, device_type, ip_address, attributes, now)
+            if old is not None:
+                # Последние данные и нажатия вернувшегося устройства сохраняются
+                record.last_data = old.last_data
+                record.last_data_time = old.last_data_time
+                record.last_button_time = old.last_button_time
+            return record
         
-        self.devices[device_id] = device_data
+        changes = {}
+        if device_type != old.device_type:
+            changes['device_type'] = intern_string(device_type)
+        if ip_address != old.ip_address:
+            changes['ip_address'] = ip_address
         
-        if device_id not in self.device_types[device_type]:
-            self.device_types[device_type].append(device_id)
-            
-        self.log_event(f"Устройство подключено: {device_id} ({device_type})")
-        logger.info(f"Устройство зарегистрировано: {device_id}")
+        attribute_changes = {}
+        if attributes:
+            old_attributes = old.attributes
+            for name, value in attributes.items():
+                if getattr(old_attributes, name, value) != value:
+                    attribute_changes[name] = intern_string(value) if name in INTERNED_ATTRIBUTES else value
+            for name in self.STATUS_RECORD_FIELDS:
+                if name in attributes and getattr(old, name) != attributes[name]:
+                    changes[name] = attributes[name]
         
+        # Для RGB контроллеров доступность определяется кнопкой (как в _build_device_record)
+        if changes.get('device_type', old.device_type) == 'rgb_controller':
+            available = not changes.get('action_button_pressed', old.action_button_pressed)
+            if available != old.available:
+                changes['available'] = available
+            else:
+                changes.pop('available', None)
+        
+        if old.restored:
+            # Первый статус после перезапуска сервера: запись снова живая
+            changes['restored'] = False
+        
+        if not changes and not attribute_changes:
+            counts['touched'] += 1
+            return old.evolve(last_seen=now)
+        
+        significant = {name: (getattr(old, name), value) for name, value in changes.items()}
+        for name, value in attribute_changes.items():
+            if name not in self.VOLATILE_ATTRIBUTES and name not in significant:
+                significant[name] = (getattr(old.attributes, name), value)
+        if significant:
+            counts['changed'] += 1
+            diff = diffs.setdefault(device_id, {})
+            for name, (before, after) in significant.items():
+                diff[name] = (diff[name][0] if name in diff else before, after)
+        else:
+            counts['heartbeat'] += 1
+        
+        if attribute_changes:
+            changes['attributes'] = replace(old.attributes, **attribute_changes)
+        return old.evolve(last_seen=now, **changes)
+    
+    @staticmethod
+    def _merge_device_updates(device, updates):
+        """Копия записи устройства с примененными изменениями"""
+        device_data = device.evolve(**updates, last_seen=time.time(), status='connected', restored=False)
+        
+        # Автоматически обновляем доступность для RGB контроллеров
+        if device_data.device_type == 'rgb_controller':
+            device_data.available = not device_data.action_button_pressed
+            
         return device_data
     
+    def _track_change(self, device_id, old, new):
+        """Поддержка онлайн-индекса и дедлайнов (вызывается реестром под блокировкой шарда)"""
+        was_online = old is not None and old.status == 'connected'
+        is_online = new is not None and new.status == 'connected'
+        
+        if was_online != is_online or (was_online and old.device_type != new.device_type):
+            with self._online_lock:
+                self._online_version += 1
+                if was_online:
+                    self.online_devices.pop(device_id, None)
+                    self.online_by_type[old.device_type] -= 1
+                if is_online:
+                    self.online_devices[device_id] = None
+                    self.online_by_type[new.device_type] = self.online_by_type.get(new.device_type, 0) + 1
+        
+        self.index.update(device_id, old, new)
+        self.changes.record(device_id, removed=new is None)
+        if self.journal is not None:
+            self.journal.record_device(device_id, new)
+        
+        if new is None or new.device_type != 'rgb_controller':
+            if old is not None:
+                self.colors.discard(device_id)
+        elif old is None or old.rgb_color != new.rgb_color or old.device_type != new.device_type:
+            self.colors.set(device_id, color_ops.parse_rgb(new.rgb_color))
+        
+        if self.feed.has_subscribers:
+            self._publish_change(device_id, old, new)
+        
+        if new is None:
+            self.expiry.discard(device_id)
+        elif old is None or new.last_seen != old.last_seen:
+            self.expiry.touch(device_id, new.last_seen)
+    
+    def _publish_change(self, device_id, old, new):
+        """Минимальная дельта изменения для потоковых клиентов"""
+        if new is None:
+            self.feed.publish(device_id, removed=True)
+            return
+        
+        # Новое или вернувшееся в онлайн устройство отправляем целиком
+        if old is None or old.status != new.status and new.status == 'connected':
+            self.feed.publish(device_id, new.to_dict())
+            return
+        
+        fields = {}
+        for attr, key in self.STREAM_FIELDS:
+            value = getattr(new, attr)
+            if value != getattr(old, attr):
+                fields[key] = value
+        
+        if fields:
+            fields['last_seen'] = new.last_seen
+            self.feed.publish(device_id, fields)
+    
+    def _expire_devices(self, device_ids, now):
+        """Перевод в offline устройств, не выходивших на связь дольше таймаута"""
+        def expire(device):
+            if device is None or device.status != 'connected':
+                return device
+            # Восстановленная запись живет до дедлайна индекса (время восстановления + таймаут)
+            if not device.restored and now - device.last_seen < Config.STATUS_UPDATE_INTERVAL:
+                return device
+            return device.evolve(status='disconnected')
+        
+        for device_id, old, new in self.devices.apply_many((device_id, expire) for device_id in device_ids):
+            if new is not old:
+                self.log_event(f"Устройство не отвечает: {device_id}", 'warning')
+    
+    def _on_device_added(self, device_id, device, old_device=None):
+        if old_device is not None:
+            self.log_event(f"Устройство снова на связи: {device_id} ({device.device_type})")
+            logger.info(f"Устройство вернулось в онлайн: {device_id}")
+        else:
+            self.log_event(f"Устройство подключено: {device_id} ({device.device_type})")
+            logger.info(f"Устройство зарегистрировано: {device_id}")
+    
+    def _on_device_changed(self, device_id, diff):
+        changes = ', '.join(f"{name}: {old} -> {new}" for name, (old, new) in diff.items())
+        self.log_event(f"Изменения устройства {device_id}: {changes}")
+    
+    def _on_device_removed(self, device_id, device):
+        self.health.discard(device_id)
+        self.log_event(f"Устройство отключено: {device_id}")
+        logger.info(f"Устройство удалено: {device_id}")
+    
+    def _on_device_restart(self, device_id, previous_uptime, uptime, timestamp):
+        self.log_event(f"Устройство перезагрузилось: {device_id} (аптайм {previous_uptime} -> {uptime})", 'warning')
+        logger.warning(f"🔄 Перезагрузка устройства {device_id}: аптайм {previous_uptime} -> {uptime}")
+        
+    def add_device(self, device_id, device_type, ip_address, attributes=None):
+        """Добавление нового устройства с поддержкой RGB устройств (как статус от устройства)"""
+        self.apply_updates([(device_id, 'add', {
+            'device_type': device_type,
+            'ip_address': ip_address,
+            'attributes': attributes or {}
+        })])
+        return self.devices.get(device_id)
+    
     def update_device(self, device_id, updates):
         """Обновление данных устройства"""
-        if device_id in self.devices:
-            self.devices[device_id].update(updates)
-            self.devices[device_id]['last_seen'] = time.time()
+        self.devices.apply(
+            device_id,
+            lambda device: self._merge_device_updates(device, updates) if device is not None else None
+        )
+    
+    def apply_updates(self, updates):
+        """Применение пачки обновлений из конвейера (одна публикация на шард реестра)"""
+        operations = []
+        errors = []
+        statuses = set()
+        diffs = {}
+        counts = dict.fromkeys(self.status_counts, 0)
+        now = time.time()
+        
+        for device_id, kind, data in updates:
+            if kind == 'add':
+                statuses.add(device_id)
+                operations.append((device_id, lambda old, device_id=device_id, data=data: self._apply_status(
+                    old, device_id, data['device_type'], data['ip_address'], data['attributes'], now, diffs, counts)))
+            elif kind == 'update':
+                operations.append((device_id, lambda old, data=data:
+                                   self._merge_device_updates(old, data) if old is not None else None))
+            elif kind == 'remove':
+                operations.append((device_id, lambda old: None))
+            elif kind == 'error':
+                errors.append(data)
+        
+        with span_tracer.span('registry apply_many'):
+            changes = self.devices.apply_many(operations)
+        
+        # Побочные эффекты (события, список типов) выполняем вне блокировок шардов
+        with span_tracer.span('side effects'):
+            for device_id, old, new in changes:
+                if new is None and old is not None:
+                    self._on_device_removed(device_id, old)
+                elif (new is not None and device_id in statuses and new.status == 'connected' and
+                      (old is None or old.status != 'connected')):
+                    self._on_device_added(device_id, new, old)
             
-            # Автоматически обновляем доступность для RGB контроллеров
-            if self.devices[device_id]['type'] == 'rgb_controller':
-                action_pressed = self.devices[device_id].get('action_button_pressed', False)
-                self.devices[device_id]['available'] = not action_pressed
+            for device_id, diff in diffs.items():
+                self._on_device_changed(device_id, diff)
+        
+        with self._status_lock:
+            for name, count in counts.items():
+                self.status_counts[name] += count
+        
+        for message in errors:
+            self.count_error()
+            self.log_event(message, 'error')
     
     def remove_device(self, device_id):
         """Удаление устройства"""
-        if device_id in self.devices:
-            device_type = self.devices[device_id]['type']
-            if device_id in self.device_types[device_type]:
-                self.device_types[device_type].remove(device_id)
-                
-            self.log_event(f"Устройство отключено: {device_id}")
-            del self.devices[device_id]
-            logger.info(f"Устройство удалено: {device_id}")
+        device = self.devices.remove(device_id)
+        if device is not None:
+            self._on_device_removed(device_id, device)
     
     def get_online_devices(self):
-        """Получение онлайн устройств"""
-        current_time = time.time()
+        """Получение онлайн устройств (без обхода всего парка)"""
+        snapshot = self.devices.snapshot()
         online_devices = []
         
-        for device_id, device in self.devices.items():
-            if current_time - device['last_seen'] < Config.STATUS_UPDATE_INTERVAL:
+        for device_id in list(self.online_devices):
+            device = snapshot.get(device_id)
+            if device is not None and device.status == 'connected':
                 online_devices.append(device)
-            else:
-                device['status'] = 'disconnected'
                 
         return online_devices
     
+    @property
+    def version(self):
+        """Монотонная версия хранилища (растет при любом изменении записей)"""
+        return self.changes.version
+    
+    def get_online_page(self, cursor=None, limit=100):
+        """Страница онлайн устройств, упорядоченных по id, начиная после cursor"""
+        # Сортированный список пересобирается только при смене состава онлайн устройств,
+        # а не при каждом статусе; записи страницы читаются по id без снимка реестра
+        cached = self._sorted_online
+        if cached is None or cached[0] != self._online_version:
+            with self._online_lock:
+                cached = (self._online_version, sorted(self.online_devices))
+            self._sorted_online = cached
+        
+        device_ids = cached[1]
+        start = bisect.bisect_right(device_ids, cursor) if cursor else 0
+        page_ids = device_ids[start:start + limit]
+        
+        get = self.devices.get
+        devices = [device for device in map(get, page_ids) if device is not None]
+        next_cursor = page_ids[-1] if page_ids and start + limit < len(device_ids) else None
+        
+        return devices, next_cursor
+    
+    def get_online_count(self):
+        """Количество онлайн устройств за O(1)"""
+        return len(self.online_devices)
+    
+    def find(self, **criteria):
+        """Выборка устройств по индексируемым полям: find(type=..., status=..., available=...)"""
+        # Записи читаются по id из шардов: снимок всего реестра пересобирался бы
+        # при каждом изменении, и выборка стоила бы O(парка), а не O(результата)
+        get = self.devices.get
+        devices = []
+        for device_id in self.index.find(**criteria):
+            device = get(device_id)
+            if device is not None:
+                devices.append(device)
+        return devices
+    
     def get_device_stats(self):
         """Статистика по устройствам"""
-        online_devices = self.get_online_devices()
+        online_by_type = dict(self.online_by_type)
         
         stats = {
             'total': len(self.devices),
-            'online': len(online_devices),
+            'online': self.get_online_count(),
             'by_type': {}
         }
         
-        for device_type, devices in self.device_types.items():
-            online_count = sum(1 for device_id in devices 
-                             if self.devices[device_id]['status'] == 'connected')
-            stats['by_type'][device_type] = online_count
+        for device_type in self.index.values('type'):
+            stats['by_type'][device_type] = online_by_type.get(device_type, 0)
             
         return stats
 
     # ========== НОВЫЕ МЕТОДЫ ДЛЯ RGB УСТРОЙСТВ ==========
     
+    @staticmethod
+    def is_optimistic(device_id):
+        """Локальные данные меняются при отправке команды, а не по подтверждению"""
+        return Config.COMMAND_OPTIMISTIC_UPDATES or not command_tracker.has_acked(device_id)
+    
     def get_available_rgb_controllers(self):
         """Получение доступных RGB контроллеров (кнопка не нажата)"""
-        available_devices = []
-        for device_id, device in self.devices.items():
-            if (device.get('type') == 'rgb_controller' and 
-                device.get('status') == 'connected' and
-                not device.get('action_button_pressed', False)):
-                available_devices.append(device)
-        return available_devices
+        return self.find(type='rgb_controller', status='connected', available=True)
+    
+    def set_device_colors(self, colors, source='web', qos=None):
+        """Установка цветов для группы устройств одной пачкой публикаций
+
+        colors - последовательность (device_id, red, green, blue). Возвращает результаты
+        по каждому устройству; локальные данные обновляются одной операцией реестра.
+        """
+        items = []
+        updates = []
+        results = []
+        for device_id, red, green, blue in colors:
+            if device_id not in self.devices:
+                results.append({'device_id': device_id, 'command': 'SET_COLOR', 'status': 'not_found'})
+                continue
+            items.append({
+                'device_id': device_id,
+                'command': 'SET_COLOR',
+                'args': {
+                    'red': max(0, min(255, int(red))),
+                    'green': max(0, min(255, int(green))),
+                    'blue': max(0, min(255, int(blue)))
+                }
+            })
+            # Без предварительного обновления цвет меняется, когда устройство подтвердит команду
+            args = items[-1]['args']
+            updates.append(None if self.is_optimistic(device_id) else {
+                'rgb_color': f"{args['red']},{args['green']},{args['blue']}",
+                'led_on': args['red'] > 0 or args['green'] > 0 or args['blue'] > 0
+            })
+        
+        published = command_publisher.publish_many(items, qos=qos, source=source, updates=updates)
+        sent = {}
+        for item, update, result in zip(items, updates, published):
+            results.append(result)
+            if result['status'] not in ACCEPTED_STATUSES:
+                self.count_error()
+            elif update is None:
+                args = item['args']
+                sent[item['device_id']] = (args['red'], args['green'], args['blue'])
+        
+        if not sent:
+            return results
+        
+        # Предварительно обновляем локальные данные устройств без подтверждений
+        def apply_color(device, color):
+            if device is None:
+                return None
+            red, green, blue = color
+            return device.evolve(
+                rgb_color=f"{red},{green},{blue}",
+                led_on=(red > 0 or green > 0 or blue > 0)
+            )
+        
+        self.devices.apply_many(
+            (device_id, lambda device, color=color: apply_color(device, color))
+            for device_id, color in sent.items()
+        )
+        
+        return results
     
     def set_device_color(self, device_id, red, green, blue):
         """Установка цвета для устройства через MQTT"""
@@ -167,63 +662,95 @@ class DeviceStorage:
             return False
         
         try:
-            topic = f"{Config.DEVICE_TOPIC_PREFIX}/{device_id}/command"
-            mqtt_client.publish(topic, json.dumps({
-                'command': 'SET_COLOR',
-                'red': max(0, min(255, red)),
-                'green': max(0, min(255, green)),
-                'blue': max(0, min(255, blue)),
-                'timestamp': time.time()
-            }))
+            result = self.set_device_colors([(device_id, red, green, blue)])[0]
+            if result['status'] not in ACCEPTED_STATUSES:
+                logger.error(f"❌ Ошибка установки цвета для {device_id}: {result.get('error')}")
+                return False
             
             self.log_event(f"Команда SET_COLOR отправлена: {device_id} -> RGB({red},{green},{blue})")
             logger.info(f"🎨 Установка цвета: {device_id} -> RGB({red},{green},{blue})")
             
-            # Предварительно обновляем локальные данные
-            self.devices[device_id]['rgb_color'] = f"{red},{green},{blue}"
-            self.devices[device_id]['led_on'] = (red > 0 or green > 0 or blue > 0)
-            
             return True
             
         except Exception as e:
             logger.error(f"❌ Ошибка установки цвета для {device_id}: {e}")
-            self.error_count += 1
+            self.count_error()
             return False
     
-    def mix_colors(self):
-        """Перемешивание цветов между доступными RGB контроллерами"""
+    def apply_color_operation(self, operation, params=None, source='web'):
+        """Групповая операция над цветами доступных RGB контроллеров.
+
+        Новые цвета всех устройств вычисляются одним шагом (color_ops) и
+        отправляются одной пачкой публикаций. Устройства упорядочены по id,
+        чтобы градиент и сдвиг были воспроизводимыми.
+        """
+        params = params or {}
+        device_ids = sorted(self.index.find(type='rgb_controller', status='connected', available=True))
+        count = len(device_ids)
+        
+        if operation == 'set_all':
+            colors = color_ops.solid(count, params['color'])
+        elif operation == 'rotate':
+            colors = color_ops.rotate(self.colors.gather(device_ids), params.get('shift', 1))
+        elif operation == 'gradient':
+            colors = color_ops.gradient(count, params['start'], params['end'])
+        elif operation == 'brightness':
+            colors = color_ops.scale_brightness(self.colors.gather(device_ids), params['factor'])
+        elif operation == 'random':
+            colors = color_ops.random_palette(count, params.get('palette'), params.get('seed'))
+        else:
+            raise ValueError(f"Неизвестная операция с цветами: {operation}")
+        
+        results = self.set_device_colors(
+            [(device_id, *color) for device_id, color in zip(device_ids, color_ops.to_rows(colors))],
+            source=source
+        )
+        success_count = sum(1 for result in results if result['status'] in ACCEPTED_STATUSES)
+        return success_count, count
+    
+    def set_all_colors(self, red, green, blue):
+        """Один цвет для всех доступных RGB контроллеров (одна общая публикация payload)"""
         try:
-            available_devices = self.get_available_rgb_controllers()
+            color = (max(0, min(255, int(red))), max(0, min(255, int(green))), max(0, min(255, int(blue))))
+            success_count, total = self.apply_color_operation('set_all', {'color': color}, source='set_all')
             
-            if len(available_devices) < 2:
-                message = "Недостаточно доступных устройств для перемешивания"
+            if total == 0:
+                message = "Нет доступных RGB контроллеров"
                 self.log_event(message, 'warning')
                 return {"status": "error", "message": message}
             
-            # Собираем текущие цвета
-            colors = []
-            device_ids = []
+            message = f"Цвет RGB({color[0]},{color[1]},{color[2]}) установлен для {success_count} из {total} устройств"
+            self.log_event(message)
+            logger.info(f"🎨 {message}")
+            
+            return {
+                "status": "success",
+                "message": message,
+                "updated_count": success_count,
+                "total_available": total
+            }
             
-            for device in available_devices:
-                rgb_str = device.get('rgb_color', '0,0,0')
-                try:
-                    colors.append([int(x) for x in rgb_str.split(',')])
-                    device_ids.append(device['id'])
-                except ValueError:
-                    colors.append([0, 0, 0])  # цвет по умолчанию при ошибке
+        except Exception as e:
+            error_msg = f"Ошибка установки цвета для всех устройств: {str(e)}"
+            logger.error(f"❌ {error_msg}")
+            self.count_error()
+            self.log_event(error_msg, 'error')
+            return {"status": "error", "message": error_msg}
+    
+    def mix_colors(self):
+        """Перемешивание цветов между доступными RGB контроллерами"""
+        try:
+            available_count = self.index.count(type='rgb_controller', status='connected', available=True)
             
-            # Перемешиваем цвета (циклический сдвиг вправо)
-            mixed_colors = [colors[-1]] + colors[:-1]
+            if available_count < 2:
+                message = "Недостаточно доступных устройств для перемешивания"
+                self.log_event(message, 'warning')
+                return {"status": "error", "message": message}
             
-            # Устанавливаем новые цвета
-            success_count = 0
-            for i, device_id in enumerate(device_ids):
-                if i < len(mixed_colors):
-                    new_color = mixed_colors[i]
-                    if self.set_device_color(device_id, new_color[0], new_color[1], new_color[2]):
-                        success_count += 1
+            # Циклический сдвиг цветов вправо одной векторной операцией
+            success_count, total = self.apply_color_operation('rotate', {'shift': 1}, source='mix')
             
-            message = f"Цвета перемешаны для {success_count} из {len(available_devices)} устройств"
+            message = f"Цвета перемешаны для {success_count} из {total} устройств"
             self.log_event(message)
             logger.info(f"🎨 {message}")
             
@@ -231,13 +758,13 @@ class DeviceStorage:
                 "status": "success", 
                 "message": message,
                 "mixed_count": success_count,
-                "total_available": len(available_devices)
+                "total_available": total
             }
             
         except Exception as e:
             error_msg = f"Ошибка перемешивания цветов: {str(e)}"
             logger.error(f"❌ {error_msg}")
-            self.error_count += 1
+            self.count_error()
             self.log_event(error_msg, 'error')
             return {"status": "error", "message": error_msg}
     
@@ -248,42 +775,46 @@ class DeviceStorage:
             return False
         
         try:
-            topic = f"{Config.DEVICE_TOPIC_PREFIX}/{device_id}/command"
-            mqtt_client.publish(topic, json.dumps({
-                'command': 'RESET_BUTTON',
-                'timestamp': time.time()
-            }))
+            update = {'action_button_pressed': False, 'available': True}
+            optimistic = self.is_optimistic(device_id)
+            result = command_publisher.publish_many(
+                [{'device_id': device_id, 'command': 'RESET_BUTTON'}], source='web',
+                updates=None if optimistic else [update]
+            )[0]
+            if result['status'] not in ACCEPTED_STATUSES:
+                logger.error(f"❌ Ошибка сброса кнопки для {device_id}: {result.get('error')}")
+                self.count_error()
+                return False
             
             self.log_event(f"Команда RESET_BUTTON отправлена: {device_id}")
             logger.info(f"🔄 Сброс кнопки: {device_id}")
             
             # Предварительно обновляем локальные данные
-            self.devices[device_id]['action_button_pressed'] = False
-            self.devices[device_id]['available'] = True
+            if optimistic:
+                self.devices.update(device_id, update)
             
             return True
             
         except Exception as e:
             logger.error(f"❌ Ошибка сброса кнопки для {device_id}: {e}")
-            self.error_count += 1
+            self.count_error()
             return False
     
     def get_rgb_controllers_info(self):
         """Детальная информация о всех RGB контроллерах"""
         rgb_devices = []
-        for device_id, device in self.devices.items():
-            if device.get('type') == 'rgb_controller':
-                rgb_info = {
-                    'id': device['id'],
-                    'status': device['status'],
-                    'action_button_pressed': device.get('action_button_pressed', False),
-                    'led_on': device.get('led_on', False),
-                    'rgb_color': device.get('rgb_color', '0,0,0'),
-                    'available': device.get('available', True),
-                    'last_seen': device.get('last_seen'),
-                    'ip': device.get('ip', 'unknown')
-                }
-                rgb_devices.append(rgb_info)
+        for device in self.find(type='rgb_controller'):
+            rgb_info = {
+                'id': device.device_id,
+                'status': device.status,
+                'action_button_pressed': device.action_button_pressed,
+                'led_on': device.led_on,
+                'rgb_color': device.rgb_color,
+                'available': device.available,
+                'last_seen': device.last_seen,
+                'ip': device.ip_address
+            }
+            rgb_devices.append(rgb_info)
         
         return {
             'total': len(rgb_devices),
@@ -291,18 +822,75 @@ class DeviceStorage:
         }
     
     def log_event(self, message, level='info'):
-        """Логирование события"""
-        event = {
-            'timestamp': datetime.now().isoformat(),
-            'message': message,
-            'level': level
+        """Логирование события (время форматируется только при чтении журнала)"""
+        now = time.time()
+        seq = self.event_log.append(message, level, now)
+        if self.journal is not None:
+            self.journal.record_event(seq, now, message, level)
+    
+    def get_counters(self):
+        return {'message_count': self.message_count, 'error_count': self.error_count}
+    
+    def export_state(self):
+        """Полное состояние для снимка журнала"""
+        snapshot = self.devices.snapshot()
+        return {
+            'devices': {device_id: snapshot[device_id].to_state() for device_id in snapshot},
+            'events': self.event_log.export(),
+            'counters': self.get_counters()
         }
+    
+    def restore_state(self, state):
+        """Загрузка состояния из снимка и журнала (до подключения журнала и MQTT)"""
+        records = []
+        for device_id, data in state['devices'].items():
+            try:
+                records.append((device_id, DeviceRecord.from_state(data)))
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ Пропущена запись {device_id} при восстановлении: {e}")
+        
+        # Записи помечаются восстановленными до первого статуса. last_seen остается
+        # прежним, а срок жизни онлайн устройств отсчитывается от момента
+        # восстановления: иначе после перезапуска дольше STATUS_UPDATE_INTERVAL
+        # первый проход жнеца перевел бы весь парк в offline
+        for _, record in records:
+            record.restored = True
         
-        self.event_log.append(event)
+        # Одна публикация на шард; индексы и дедлайны обновляются через on_change
+        self.devices.apply_many(
+            (device_id, lambda old, record=record: record) for device_id, record in records
+        )
+        now = time.time()
+        for device_id, record in records:
+            if record.status == 'connected':
+                self.expiry.touch(device_id, now)
         
-        # Ограничиваем размер лога
-        if len(self.event_log) > 1000:
-            self.event_log = self.event_log[-500:]
+        counters = state.get('counters') or {}
+        self.message_count = counters.get('message_count', self.message_count)
+        self.error_count = counters.get('error_count', self.error_count)
+        self.event_log.restore(state.get('events') or [])
+        return len(records)
+    
+    @property
+    def message_count(self):
+        """Входящие MQTT сообщения (сумма esp_mqtt_messages_total)"""
+        return mqtt_messages.total()
+    
+    @message_count.setter
+    def message_count(self, value):
+        mqtt_messages.set_total(value)
+    
+    @property
+    def error_count(self):
+        return errors_total.total()
+    
+    @error_count.setter
+    def error_count(self, value):
+        errors_total.set_total(value)
+    
+    def count_error(self):
+        """Учет ошибки (из любого потока, без блокировки)"""
+        errors_total.inc()
     
     def get_system_info(self):
         """Информация о системе"""
@@ -316,12 +904,78 @@ class DeviceStorage:
             'message_count': self.message_count,
             'error_count': self.error_count,
             'device_count': len(self.devices),
-            'online_count': len(self.get_online_devices())
+            'online_count': self.get_online_count()
         }
 
 # Инициализация хранилища
 storage = DeviceStorage()
 mqtt_client = None
+command_tracker = CommandTracker(
+    publish=lambda topic, payload, qos: command_publisher.republish(topic, payload, qos),
+    timeout=Config.COMMAND_ACK_TIMEOUT,
+    max_retries=Config.COMMAND_MAX_RETRIES,
+    backoff=Config.COMMAND_RETRY_BACKOFF,
+    max_pending=Config.COMMAND_MAX_PENDING,
+    supersede=Config.COMMAND_COALESCE,
+    retry_always=Config.COMMAND_IDEMPOTENT,
+    on_failed=lambda pending: storage.log_event(
+        f"Команда {pending.command} не подтверждена: {pending.device_id} (попыток: {pending.attempts})", 'warning')
+)
+command_publisher = CommandPublisher(
+    client_getter=lambda: mqtt_client,
+    topic_prefix=Config.DEVICE_TOPIC_PREFIX,
+    rate=Config.COMMAND_RATE_LIMIT,
+    burst=Config.COMMAND_BURST,
+    default_qos=Config.COMMAND_QOS,
+    tracker=command_tracker,
+    publish_latency=publish_seconds,
+    device_rate=Config.COMMAND_DEVICE_RATE,
+    device_burst=Config.COMMAND_DEVICE_BURST,
+    device_queue=Config.COMMAND_DEVICE_QUEUE,
+    coalesce=Config.COMMAND_COALESCE
+)
+response_cache = ResponseCache(
+    max_entries=Config.RESPONSE_CACHE_ENTRIES,
+    compress=Config.RESPONSE_CACHE_GZIP
+)
+journal = DeviceJournal(
+    Config.JOURNAL_DIR,
+    sync_interval=Config.JOURNAL_SYNC_INTERVAL,
+    snapshot_interval=Config.SNAPSHOT_INTERVAL,
+    state_provider=storage.export_state,
+    counters_provider=storage.get_counters
+)
+
+def restore_state():
+    """Восстановление устройств, счетчиков и событий из снимка и журнала, запуск журнала.
+
+    Повторные вызовы ничего не делают.
+    """
+    if storage.journal is not None:
+        return 0
+    
+    started = time.perf_counter()
+    state = journal.load()
+    count = storage.restore_state(state)
+    
+    storage.journal = journal
+    # Новый снимок сразу: журнал начинается с чистого файла
+    journal.snapshot()
+    journal.start()
+    
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"💾 Восстановлено устройств: {count}, записей журнала: {state['replayed']} за {elapsed:.1f} мс")
+    storage.log_event(f"Состояние восстановлено: {count} устройств за {elapsed:.1f} мс")
+    return count
+
+def save_state():
+    """Последняя фиксация журнала и снимок при завершении работы"""
+    if storage.journal is not None:
+        journal.stop()
+        storage.journal = None
+
+# Тип сообщения в конвейере для бинарного payload: 'status' -> 'status/bin'
+BINARY_TYPE_SUFFIX = '/' + payload_schema.BINARY_SUFFIX
 
 # MQTT обработчики
 def on_mqtt_connect(client, userdata, flags, rc):
@@ -335,7 +989,9 @@ def on_mqtt_connect(client, userdata, flags, rc):
             f"{Config.DEVICE_TOPIC_PREFIX}/+/disconnect",  # Отключения
             f"{Config.DEVICE_TOPIC_PREFIX}/+/data",        # Данные с датчиков
             f"{Config.DEVICE_TOPIC_PREFIX}/+/error",       # Ошибки
-            f"{Config.DEVICE_TOPIC_PREFIX}/+/button"       # Состояния кнопок
+            f"{Config.DEVICE_TOPIC_PREFIX}/+/button",      # Состояния кнопок
+            f"{Config.DEVICE_TOPIC_PREFIX}/+/ack",         # Подтверждения команд
+            f"{Config.DEVICE_TOPIC_PREFIX}/+/+/{payload_schema.BINARY_SUFFIX}"  # Те же сообщения в бинарном формате
         ]
         
         for topic in topics:
@@ -353,128 +1009,304 @@ def on_mqtt_connect(client, userdata, flags, rc):
         
         logger.info("🔍 Отправлена команда DISCOVER для поиска устройств")
         
+        # Предлагаем подключенным устройствам формат сообщений
+        if Config.PAYLOAD_FORMAT != 'json':
+            command_publisher.publish_group('all', 'SET_FORMAT', {'format': Config.PAYLOAD_FORMAT}, source='server')
+            logger.info(f"📦 Устройствам предложен формат сообщений: {Config.PAYLOAD_FORMAT}")
+        
     else:
         logger.error(f"❌ Ошибка подключения MQTT: {rc}")
-        storage.error_count += 1
+        storage.count_error()
         storage.log_event(f"Ошибка подключения MQTT: код {rc}", 'error')
 
 def on_mqtt_message(client, userdata, msg):
-    """Обработчик входящих MQTT сообщений"""
-    try:
-        storage.message_count += 1
-        
-        # ВРЕМЕННАЯ ОТЛАДКА - логируем ВСЕ сообщения
-        payload_str = msg.payload.decode('utf-8')
-        logger.info(f"🔍 MQTT сообщение: [{msg.topic}] {payload_str}")
-        
-        topic_parts = msg.topic.split('/')
-        if len(topic_parts) < 3:
+    """Обработчик входящих MQTT сообщений - только постановка в очередь конвейера"""
+    topic_parts = msg.topic.split('/')
+    if len(topic_parts) < 3:
+        other_messages.inc()
+        logger.warning(f"⚠️ Неверный формат топика: {msg.topic}")
+        return
+
+    message_type = topic_parts[2]
+    if len(topic_parts) > 3:
+        # devices/<id>/<тип>/bin - компактный бинарный формат
+        if len(topic_parts) > 4 or topic_parts[3] != payload_schema.BINARY_SUFFIX:
+            other_messages.inc()
             logger.warning(f"⚠️ Неверный формат топика: {msg.topic}")
             return
-            
-        device_id = topic_parts[1]
-        message_type = topic_parts[2]
-        
-        logger.info(f"📨 Обработка: устройство={device_id}, тип={message_type}")
-        
-        if message_type == "status":
-            # Регистрация/обновление устройства
-            try:
-                data = json.loads(payload_str)
-                
-                # ОБНОВЛЕННЫЙ MAPPING ПОЛЕЙ (поддержка старых и новых имен)
-                device_type = data.get('t', data.get('type', 'unknown'))
-                ip_address = data.get('ip', 'unknown')
-                
-                # Собираем все атрибуты для устройства
-                attributes = {
-                    'mac': data.get('mac', ''),
-                    'rssi': data.get('rssi', 0),
-                    'free_heap': data.get('heap', data.get('free_heap', 0)),
-                    'uptime': data.get('up', data.get('uptime', 0)),
-                    'version': data.get('ver', data.get('version', 'unknown')),
-                    'firmware': data.get('fw', data.get('firmware', 'unknown')),
-                    'config_mode': data.get('cfg', data.get('config_mode', False)),
-                    'mqtt_broker': data.get('mqtt', data.get('mqtt_broker', '')),
-                    'led_state': data.get('led_s', data.get('led_state', True)),
-                    # Поля для RGB устройств
-                    'action_button_pressed': data.get('btn', data.get('action_button_pressed', False)),
-                    'led_on': data.get('led', data.get('led_on', True)),
-                    'rgb_color': data.get('rgb', data.get('rgb_color', '0,0,0')),
-                    'available': data.get('avail', data.get('available', True))
-                }
-                
-                # Логируем полученные данные
-                logger.info(f"✅ Получен статус от {device_id}: type={device_type}, ip={ip_address}")
-                
-                storage.add_device(
-                    device_id=device_id,
-                    device_type=device_type,
-                    ip_address=ip_address,
-                    attributes=attributes
-                )
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Ошибка парсинга JSON от {device_id}: {e}")
-                storage.error_count += 1
-                storage.log_event(f"Ошибка JSON от {device_id}: {str(e)}", 'error')
-                
-        elif message_type == "data":
-            # Данные от устройства
-            try:
-                data = json.loads(payload_str)
-                storage.update_device(device_id, {
-                    'last_data': data,
-                    'last_data_time': time.time()
-                })
-                logger.info(f"📊 Данные от {device_id}: {data}")
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Ошибка парсинга данных от {device_id}: {e}")
-                
-        elif message_type == "button":
-            # Состояние кнопки
-            try:
-                data = json.loads(payload_str)
-                storage.update_device(device_id, {
-                    'action_button_pressed': data.get('action_button_pressed', False),
-                    'led_on': data.get('led_on', True),
-                    'last_button_time': time.time()
-                })
-                logger.info(f"🔘 Статус кнопки от {device_id}: pressed={data.get('action_button_pressed')}")
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Ошибка парсинга кнопки от {device_id}: {e}")
-                
-        elif message_type == "disconnect":
-            # Отключение устройства
-            storage.remove_device(device_id)
-            logger.info(f"🔴 Устройство отключено: {device_id}")
-            
-        elif message_type == "error":
-            # Ошибка от устройства
+        message_type += BINARY_TYPE_SUFFIX
+    elif msg.properties is not None and getattr(msg.properties, 'ContentType', None) == payload_schema.BINARY_CONTENT_TYPE:
+        # MQTT 5: формат указан в content-type
+        message_type += BINARY_TYPE_SUFFIX
+
+    (message_counters.get(message_type) or other_messages).inc()
+    with span_tracer.span('mqtt enqueue ' + message_type):
+        ingest.submit(topic_parts[1], message_type, msg.payload)
+
+def decode_device_message(device_id, message_type, payload):
+    """Разбор сообщения устройства (выполняется в воркере конвейера, без блокировки хранилища)
+
+    Возвращает обновление (device_id, kind, data) для DeviceStorage.apply_updates или None.
+    Тип с суффиксом /bin - бинарный payload, результат разбора тот же, что у JSON.
+    """
+    binary = message_type.endswith(BINARY_TYPE_SUFFIX)
+    if binary:
+        message_type = message_type[:-len(BINARY_TYPE_SUFFIX)]
+        layout = payload_schema.BINARY_LAYOUTS.get(message_type)
+
+    # Полный payload только в режиме отладки; аргументы форматируются, только если запись пройдет
+    if Config.LOG_PAYLOADS:
+        message_logger.debug("🔍 MQTT сообщение: [%s/%s/%s] %s", Config.DEVICE_TOPIC_PREFIX, device_id, message_type,
+                             bytes(payload).hex(' ') if binary else payload.decode('utf-8', 'replace'),
+                             extra={'topic': message_type})
+
+    if binary and layout is None and message_type != "disconnect":
+        logger.warning(f"⚠️ Нет бинарного формата для сообщений {message_type} от {device_id}")
+        return None
+
+    if message_type == "status":
+        # Регистрация/обновление устройства: поля и их короткие/длинные имена описаны в STATUS_SCHEMA
+        try:
+            if binary:
+                # Бинарный статус всегда содержит все числовые показатели
+                attributes = layout.decode_bytes(payload)
+                metrics = {name: attributes[name] for name in Config.TELEMETRY_STATUS_METRICS}
+            else:
+                data = payload_schema.STATUS_SCHEMA.load(payload)
+                attributes = payload_schema.STATUS_SCHEMA.decode(data)
+                # В историю - только присланные показатели: компактный статус NodeMCU
+                # без heap не должен записывать free_heap=0 из значения по умолчанию
+                metrics = payload_schema.STATUS_SCHEMA.present_values(data, Config.TELEMETRY_STATUS_METRICS)
+        except ValueError as e:
+            encoding = 'бинарного статуса' if binary else 'JSON'
+            logger.error(f"❌ Ошибка парсинга {encoding} от {device_id}: {e}")
+            return (device_id, 'error', f"Ошибка {encoding} от {device_id}: {str(e)}")
+
+        device_type = attributes.pop('device_type')
+        ip_address = attributes.pop('ip_address')
+
+        message_logger.debug("✅ Получен статус от %s: type=%s, ip=%s", device_id, device_type, ip_address,
+                             extra={'topic': message_type})
+
+        return (device_id, 'add', {
+            'device_type': device_type,
+            'ip_address': ip_address,
+            'attributes': attributes,
+            'metrics': metrics
+        })
+
+    elif message_type == "data":
+        # Данные от устройства
+        try:
+            data = layout.decode_bytes(payload) if binary else payload_schema.loads(payload)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка парсинга данных от {device_id}: {e}")
+            return None
+
+        message_logger.debug("📊 Данные от %s: %s", device_id, data, extra={'topic': message_type})
+        return (device_id, 'update', {
+            'last_data': data,
+            'last_data_time': time.time()
+        })
+
+    elif message_type == "button":
+        # Состояние кнопки
+        try:
+            data = (layout if binary else payload_schema.BUTTON_SCHEMA).decode_bytes(payload)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка парсинга кнопки от {device_id}: {e}")
+            return None
+
+        message_logger.debug("🔘 Статус кнопки от %s: pressed=%s", device_id, data['action_button_pressed'],
+                             extra={'topic': message_type})
+        return (device_id, 'update', {
+            'action_button_pressed': data['action_button_pressed'],
+            'led_on': data['led_on'],
+            'last_button_time': time.time()
+        })
+
+    elif message_type == "disconnect":
+        # Отключение устройства
+        logger.info(f"🔴 Устройство отключено: {device_id}")
+        return (device_id, 'remove', None)
+
+    elif message_type == "error":
+        # Ошибка от устройства
+        try:
+            data = (layout if binary else payload_schema.ERROR_SCHEMA).decode_bytes(payload)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка парсинга ошибки от {device_id}: {e}")
+            return None
+
+        error_msg = data['error']
+        logger.error(f"❌ Ошибка от {device_id}: {error_msg}")
+        return (device_id, 'error', f"Ошибка устройства {device_id}: {error_msg}")
+
+    elif message_type == "ack":
+        # Подтверждение команды (применяется в process_ingest_batch)
+        try:
+            data = payload_schema.ACK_SCHEMA.decode_bytes(payload)
+        except ValueError as e:
+            logger.error(f"❌ Ошибка парсинга подтверждения от {device_id}: {e}")
+            return None
+
+        message_logger.debug("☑️ Подтверждение от %s: %s", device_id, data, extra={'topic': message_type})
+        return (device_id, 'ack', data)
+
+    logger.warning(f"⚠️ Неизвестный тип сообщения от {device_id}: {message_type}")
+    return None
+
+def extract_telemetry(update, received_at):
+    """Числовые показатели для истории из разобранного сообщения (или None)"""
+    device_id, kind, data = update
+    if kind == 'update' and 'last_data' in data and isinstance(data['last_data'], dict):
+        # timestamp в данных - millis() устройства, время точки берем по приему
+        metrics = {name: value for name, value in data['last_data'].items() if name != 'timestamp'}
+    elif kind == 'add' and data.get('metrics'):
+        metrics = data['metrics']
+    else:
+        return None
+    return (device_id, received_at, metrics)
+
+def acknowledge_command(device_id, data):
+    """Завершение команды по подтверждению: отложенное обновление записи устройства или None"""
+    pending = command_tracker.acknowledge(device_id, data['command_id'], data['ok'])
+    if pending is None:
+        return None
+    if not data['ok']:
+        storage.log_event(f"Устройство {device_id} отклонило команду {pending.command}: {data['error']}", 'warning')
+        return None
+    if pending.update:
+        return (device_id, 'update', pending.update)
+    return None
+
+def process_ingest_batch(groups):
+    """Обработка пачки сообщений из конвейера: разбор без блокировок, затем одно применение к хранилищу"""
+    token = span_tracer.begin('ingest batch')
+    try:
+        _process_ingest_batch(groups)
+    finally:
+        span_tracer.end(token)
+
+def _process_ingest_batch(groups):
+    updates = []
+    samples = []
+    status_samples = []
+    perf_counter = time.perf_counter
+    count = 0
+    # Флаги читаются раз на пачку: выключенное профилирование стоит одного сравнения на сообщение
+    tracing = span_tracer.enabled
+    slow_threshold = slow_messages.threshold if slow_messages.enabled else float('inf')
+
+    for device_id, messages in groups.items():
+        count += len(messages)
+        for message_type, payload, received_at in messages:
             try:
-                data = json.loads(payload_str)
-                storage.error_count += 1
-                error_msg = data.get('error', 'Unknown error')
-                storage.log_event(f"Ошибка устройства {device_id}: {error_msg}", 'error')
-                logger.error(f"❌ Ошибка от {device_id}: {error_msg}")
-            except json.JSONDecodeError as e:
-                logger.error(f"❌ Ошибка парсинга ошибки от {device_id}: {e}")
-                
-        else:
-            logger.warning(f"⚠️ Неизвестный тип сообщения от {device_id}: {message_type}")
-            
-    except Exception as e:
-        logger.error(f"❌ Критическая ошибка обработки MQTT сообщения: {e}")
-        storage.error_count += 1
-        storage.log_event(f"Критическая ошибка MQTT: {str(e)}", 'error')
+                started = perf_counter()
+                update = decode_device_message(device_id, message_type, payload)
+                elapsed = perf_counter() - started
+                (decode_timers.get(message_type) or other_decode_timer).observe(elapsed)
+                if tracing:
+                    span_tracer.add('decode ' + message_type, elapsed)
+                if elapsed > slow_threshold:
+                    slow_messages.record_message(device_id, message_type, payload, elapsed, received_at)
+                if update is not None and update[1] == 'ack':
+                    update = acknowledge_command(device_id, update[2])
+                    if update is not None:
+                        updates.append(update)
+                    continue
+                if update is not None:
+                    updates.append(update)
+                    sample = extract_telemetry(update, received_at)
+                    if sample is not None:
+                        samples.append(sample)
+                        if update[1] == 'add':
+                            status_samples.append(sample)
+            except Exception as e:
+                logger.error(f"❌ Критическая ошибка обработки MQTT сообщения: {e}")
+                updates.append((device_id, 'error', f"Критическая ошибка MQTT: {str(e)}"))
 
-def setup_mqtt():
-    """Настройка MQTT клиента"""
+    batch_messages.observe(count)
+    if updates:
+        with span_tracer.span('storage apply'):
+            started = perf_counter()
+            storage.apply_updates(updates)
+            elapsed = perf_counter() - started
+        apply_seconds.observe(elapsed)
+        if elapsed > slow_threshold:
+            slow_messages.record_batch('apply', elapsed, groups.keys(), count)
+    if samples:
+        with span_tracer.span('telemetry append'):
+            telemetry.append_many(samples)
+    if status_samples:
+        with span_tracer.span('health observe'):
+            storage.health.observe_many(status_samples)
+
+# История телеметрии устройств
+telemetry = TelemetryStore(
+    Config.TELEMETRY_DIR,
+    partition_seconds=Config.TELEMETRY_PARTITION_SECONDS,
+    retention_seconds=Config.TELEMETRY_RETENTION_HOURS * 3600,
+    flush_interval=Config.TELEMETRY_FLUSH_INTERVAL
+)
+
+# Конвейер обработки входящих сообщений
+ingest = IngestPipeline(
+    handler=process_ingest_batch,
+    workers=Config.INGEST_WORKERS,
+    queue_size=Config.INGEST_QUEUE_SIZE,
+    batch_size=Config.INGEST_BATCH_SIZE,
+    batch_wait=Config.INGEST_BATCH_WAIT
+)
+
+def _online_by_type():
+    with storage._online_lock:
+        return dict(storage.online_by_type)
+
+def _scheduler_stat(name):
+    scheduler = command_publisher.scheduler
+    return getattr(scheduler, name) if scheduler is not None else 0
+
+# Значения компонентов, которые читаются только при запросе /metrics
+metrics.gauge('esp_devices_online', 'Устройства онлайн по типу', _online_by_type, ('type',))
+metrics.gauge('esp_devices_total', 'Устройства в реестре', lambda: len(storage.devices))
+metrics.gauge('esp_ingest_queue_depth', 'Сообщения в очередях конвейера обработки', ingest.get_queue_depth)
+metrics.counter_callback('esp_ingest_dropped_total', 'Сообщения, отброшенные при переполнении конвейера',
+                         lambda: ingest.dropped_count)
+metrics.gauge('esp_command_backlog', 'Команды в очередях устройств', lambda: _scheduler_stat('backlog'))
+metrics.counter_callback('esp_command_coalesced_total', 'Команды, замененные более новыми в очереди',
+                         lambda: _scheduler_stat('coalesced_count'))
+metrics.counter_callback('esp_command_dropped_total', 'Команды, отклоненные из-за переполнения очереди устройства',
+                         lambda: _scheduler_stat('dropped_count'))
+metrics.gauge('esp_commands_pending', 'Команды, ожидающие подтверждения', lambda: len(command_tracker))
+metrics.counter_callback('esp_command_results_total', 'Завершенные команды по результату', lambda: {
+    'acked': command_tracker.acked_count,
+    'rejected': command_tracker.rejected_count,
+    'failed': command_tracker.failed_count,
+    'unconfirmed': command_tracker.unconfirmed_count
+}, ('result',))
+metrics.counter_callback('esp_command_retries_total', 'Повторные публикации неподтвержденных команд',
+                         lambda: command_tracker.retry_count)
+metrics.gauge('esp_stream_subscribers', 'Подключенные клиенты /api/stream', lambda: storage.feed.get_stats()['subscribers'])
+metrics.gauge('esp_log_queue_depth', 'Записи в очереди логирования', lambda: log_pipeline.queue.qsize())
+metrics.gauge('esp_mqtt_connected', 'Подключение к MQTT брокеру', lambda: bool(mqtt_client and mqtt_client.is_connected()))
+
+def create_mqtt_client():
+    """MQTT клиент с обработчиками и запущенный конвейер обработки (без подключения)"""
     global mqtt_client
     
+    ingest.start()
+    command_tracker.start()
+    command_publisher.start()
+    
     mqtt_client = mqtt.Client()
     mqtt_client.on_connect = on_mqtt_connect
     mqtt_client.on_message = on_mqtt_message
+    return mqtt_client
+
+def setup_mqtt():
+    """Настройка MQTT клиента"""
+    create_mqtt_client()
     
     try:
         logger.info(f"🔄 Подключение к MQTT брокеру: {Config.MQTT_BROKER_HOST}:{Config.MQTT_BROKER_PORT}")
@@ -486,7 +1318,7 @@ def setup_mqtt():
                 mqtt_client.loop_forever()
             except Exception as e:
                 logger.error(f"❌ Ошибка MQTT loop: {e}")
-                storage.error_count += 1
+                storage.count_error()
         
         mqtt_thread = threading.Thread(target=mqtt_loop, daemon=True)
         mqtt_thread.start()
@@ -496,7 +1328,7 @@ def setup_mqtt():
         
     except Exception as e:
         logger.error(f"❌ Ошибка подключения MQTT: {e}")
-        storage.error_count += 1
+        storage.count_error()
         return False
 
 # Flask маршруты
@@ -520,21 +1352,136 @@ def devices_page():
     """Страница управления устройствами"""
     return render_template('devices.html', local_ip=LOCAL_IP)
 
+def parse_device_filters(source):
+    """Фильтры выборки устройств из JSON тела или query-параметров"""
+    filters = {}
+    for name in ('type', 'status', 'available', 'firmware', 'version'):
+        value = source.get(name)
+        if value is None:
+            continue
+        if name == 'available' and isinstance(value, str):
+            value = value.lower() in ('1', 'true', 'yes')
+        filters[name] = value
+    return filters
+
 # API endpoints
-@app.route('/api/devices')
-def api_get_devices():
-    """API: Получение списка устройств"""
+@app.route('/api/devices/query')
+def api_query_devices():
+    """API: Выборка устройств по индексам (type, status, available, firmware, version)"""
     try:
-        online_devices = storage.get_online_devices()
+        filters = parse_device_filters(request.args)
+        if not filters:
+            return jsonify({'status': 'error', 'message': 'No filters specified'}), 400
         
+        devices = storage.find(**filters)
         return jsonify({
             'status': 'success',
-            'devices': online_devices,
-            'stats': storage.get_device_stats(),
-            'timestamp': time.time(),
-            'mqtt_broker': Config.MQTT_BROKER_HOST
+            'devices': [device.to_dict() for device in devices],
+            'count': len(devices),
+            'filters': filters
         })
         
+    except Exception as e:
+        logger.error(f"❌ Ошибка выборки устройств: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def parse_fields(value):
+    """Список полей для проекции из параметра ?fields=id,status,rgb_color"""
+    if not value:
+        return None
+    return [field.strip() for field in value.split(',') if field.strip()]
+
+def cached_json_response(entry):
+    """Ответ из заранее закодированных байт (gzip, если клиент его принимает)"""
+    if entry.gzipped is not None and 'gzip' in request.accept_encodings:
+        response = Response(entry.gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(entry.body, mimetype='application/json')
+    
+    if entry.gzipped is not None:
+        response.headers['Vary'] = 'Accept-Encoding'
+    if entry.etag is not None:
+        response.set_etag(entry.etag)
+    return response
+
+def not_modified(version):
+    """Ответ 304, если клиент уже получил эту версию"""
+    if request.if_none_match.contains(str(version)):
+        response = Response(status=304)
+        response.set_etag(str(version))
+        return response
+    return None
+
+def build_devices_payload(args):
+    """Данные ответа /api/devices для заданных параметров запроса"""
+    fields = parse_fields(args.get('fields'))
+    since = args.get('since', type=int)
+    
+    if since is not None:
+        changes = storage.changes.changes_since(since)
+        if changes is not None:
+            version, changed_ids, removed_ids = changes
+            snapshot = storage.devices.snapshot()
+            return {
+                'status': 'success',
+                'version': version,
+                'since': since,
+                'full': False,
+                'devices': [snapshot[device_id].to_dict(fields)
+                            for device_id in changed_ids if device_id in snapshot],
+                'removed': removed_ids,
+                'stats': storage.get_device_stats(),
+                'timestamp': time.time()
+            }
+        # История изменений неполна - отдаем полный список (full=True)
+    
+    limit = args.get('limit', type=int)
+    next_cursor = None
+    if limit:
+        online_devices, next_cursor = storage.get_online_page(args.get('cursor'), limit)
+    else:
+        online_devices = storage.get_online_devices()
+    
+    payload = {
+        'status': 'success',
+        'devices': [device.to_dict(fields) for device in online_devices],
+        'stats': storage.get_device_stats(),
+        'timestamp': time.time(),
+        'mqtt_broker': Config.MQTT_BROKER_HOST,
+        'version': storage.version
+    }
+    if limit:
+        payload['next_cursor'] = next_cursor
+    if since is not None:
+        payload['full'] = True
+    
+    return payload
+
+@app.route('/api/devices')
+def api_get_devices():
+    """API: Получение списка устройств
+
+    Поддерживает ETag/If-None-Match, ?since=<version> (только изменения),
+    пагинацию ?limit=&cursor= и проекцию ?fields=id,status,rgb_color
+    """
+    try:
+        version = storage.version
+        cached = not_modified(version)
+        if cached is not None:
+            return cached
+        
+        entry = response_cache.get_or_build(
+            ('devices', request.query_string),
+            version,
+            lambda: build_devices_payload(request.args),
+            etag=str(version)
+        )
+        return cached_json_response(entry)
+        
     except Exception as e:
         logger.error(f"❌ Ошибка получения устройств: {e}")
         return jsonify({
@@ -542,6 +1489,38 @@ def api_get_devices():
             'message': str(e)
         }), 500
 
+def build_stream_snapshot():
+    """Начальный снимок для потокового клиента (тот же состав, что у /api/devices)"""
+    return format_sse('snapshot', json.dumps({
+        'devices': [device.to_dict() for device in storage.get_online_devices()],
+        'stats': storage.get_device_stats(),
+        'timestamp': time.time(),
+        'mqtt_broker': Config.MQTT_BROKER_HOST
+    }))
+
+@app.route('/api/stream')
+def api_stream():
+    """API: Поток изменений устройств (Server-Sent Events)"""
+    subscription = storage.feed.subscribe()
+    
+    def generate():
+        try:
+            yield build_stream_snapshot()
+            while True:
+                if subscription.resync:
+                    subscription.resync = False
+                    yield build_stream_snapshot()
+                
+                message = subscription.get(timeout=Config.STREAM_KEEPALIVE)
+                yield message if message is not None else b": keepalive\n\n"
+        finally:
+            storage.feed.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/device/<device_id>/command', methods=['POST'])
 def api_send_command(device_id):
     """API: Отправка команды устройству"""
@@ -558,13 +1537,13 @@ def api_send_command(device_id):
         if device_id not in storage.devices:
             return jsonify({'status': 'error', 'message': f'Device {device_id} not found'}), 404
         
-        # Отправляем команду через MQTT
-        topic = f"{Config.DEVICE_TOPIC_PREFIX}/{device_id}/command"
-        mqtt_client.publish(topic, json.dumps({
-            'command': command,
-            'timestamp': time.time(),
-            'source': 'web'
-        }))
+        # Отправляем команду через MQTT (с id для подтверждения)
+        result = command_publisher.publish_many([{'device_id': device_id, 'command': command}], source='web')[0]
+        if result['status'] == 'dropped':
+            # Очередь устройства переполнена - клиенту стоит повторить позже
+            return jsonify({'status': 'error', 'message': result['error'], 'device_id': device_id}), 429
+        if result['status'] not in ACCEPTED_STATUSES:
+            raise RuntimeError(result.get('error', 'publish failed'))
         
         storage.log_event(f"Команда отправлена: {device_id} -> {command}")
         logger.info(f"✅ Команда отправлена: {device_id} -> {command}")
@@ -573,12 +1552,14 @@ def api_send_command(device_id):
             'status': 'success',
             'message': f'Command sent to {device_id}',
             'device_id': device_id,
-            'command': command
+            'command': command,
+            'command_id': result['command_id'],
+            'delivery': result['status']
         })
         
     except Exception as e:
         logger.error(f"❌ Ошибка отправки команды: {e}")
-        storage.error_count += 1
+        storage.count_error()
         return jsonify({
             'status': 'error', 
             'message': str(e)
@@ -596,18 +1577,19 @@ def api_broadcast_command():
         if not command:
             return jsonify({'status': 'error', 'message': 'Command not specified'}), 400
         
-        # Отправляем команду всем онлайн устройствам
-        online_devices = storage.get_online_devices()
-        sent_count = 0
+        # Отправляем команду всем онлайн устройствам (или только подходящим под фильтр)
+        filters = parse_device_filters(data)
+        if filters:
+            online_devices = storage.find(status='connected', **filters)
+        else:
+            online_devices = storage.get_online_devices()
         
-        for device in online_devices:
-            topic = f"{Config.DEVICE_TOPIC_PREFIX}/{device['id']}/command"
-            mqtt_client.publish(topic, json.dumps({
-                'command': command,
-                'timestamp': time.time(),
-                'source': 'broadcast'
-            }))
-            sent_count += 1
+        # Общий payload кодируется один раз на всю рассылку
+        results = command_publisher.publish_many(
+            [{'device_id': device.device_id, 'command': command} for device in online_devices],
+            source='broadcast'
+        )
+        sent_count = sum(1 for result in results if result['status'] in ACCEPTED_STATUSES)
         
         storage.log_event(f"Broadcast команда: {command} -> {sent_count} устройств")
         logger.info(f"📢 Broadcast команда: {command} -> {sent_count} устройств")
@@ -621,38 +1603,271 @@ def api_broadcast_command():
         
     except Exception as e:
         logger.error(f"❌ Ошибка broadcast команды: {e}")
-        storage.error_count += 1
+        storage.count_error()
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
 
+@app.route('/api/commands/bulk', methods=['POST'])
+def api_bulk_commands():
+    """API: Пакетная отправка команд
+
+    {"items": [{"device_id": "...", "command": "...", "args": {...}}, ...], "qos": 0}
+    или {"group": "all", "command": "...", "args": {...}} - одна публикация в групповой топик
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'status': 'error', 'message': 'No JSON data provided'}), 400
+        
+        qos = data.get('qos', Config.COMMAND_QOS)
+        if qos not in (0, 1, 2):
+            return jsonify({'status': 'error', 'message': 'qos must be 0, 1 or 2'}), 400
+        
+        started = time.perf_counter()
+        
+        group = data.get('group')
+        if group:
+            command = data.get('command')
+            if not command:
+                return jsonify({'status': 'error', 'message': 'Command not specified'}), 400
+            if not str(group).replace('_', '').replace('-', '').isalnum():
+                return jsonify({'status': 'error', 'message': f'Invalid group name: {group}'}), 400
+            
+            result = command_publisher.publish_group(group, command, data.get('args'), qos=qos)
+            storage.log_event(f"Групповая команда: {command} -> группа {group}")
+            logger.info(f"📢 Групповая команда: {command} -> группа {group}")
+            
+            return jsonify({
+                'status': 'success' if result['status'] == 'sent' else 'error',
+                'result': result,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+            })
+        
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'status': 'error', 'message': 'items must be a non-empty list'}), 400
+        
+        # Проверяем элементы; невалидные и неизвестные устройства не публикуем
+        results = [None] * len(items)
+        valid_items = []
+        valid_positions = []
+        for position, item in enumerate(items):
+            if (not isinstance(item, dict) or not item.get('device_id') or not item.get('command') or
+                    not isinstance(item.get('args') or {}, dict)):
+                results[position] = {'item': position, 'status': 'invalid'}
+            elif item['device_id'] not in storage.devices:
+                results[position] = {'device_id': item['device_id'], 'command': item['command'], 'status': 'not_found'}
+            else:
+                valid_items.append(item)
+                valid_positions.append(position)
+        
+        for position, result in zip(valid_positions, command_publisher.publish_many(valid_items, qos=qos)):
+            results[position] = result
+        
+        sent_count = sum(1 for result in results if result['status'] in ACCEPTED_STATUSES)
+        storage.log_event(f"Пакет команд: отправлено {sent_count} из {len(items)}")
+        logger.info(f"📦 Пакет команд: отправлено {sent_count} из {len(items)}")
+        
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'sent_count': sent_count,
+            'error_count': len(items) - sent_count,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка пакетной отправки команд: {e}")
+        storage.count_error()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/commands/queue')
+def api_command_queue():
+    """API: Очереди исходящих команд по устройствам (глубина, объединенные и отброшенные команды)"""
+    try:
+        scheduler = command_publisher.scheduler
+        if scheduler is None:
+            return jsonify({'status': 'success', 'enabled': False})
+        limit = request.args.get('limit', 20, type=int)
+        return jsonify({
+            'status': 'success',
+            'enabled': True,
+            'stats': scheduler.get_stats(),
+            'devices': [
+                {'device_id': device_id, 'depth': depth, 'commands': commands}
+                for device_id, depth, commands in scheduler.get_backlog(max(0, limit))
+            ]
+        })
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/commands/latency')
+def api_command_latency():
+    """API: Задержка доставки команд (от публикации до подтверждения) и доля недоставленных
+
+    ?device_id=... - одно устройство, иначе парк и limit худших устройств
+    """
+    try:
+        limit = request.args.get('limit', 100, type=int)
+        return jsonify({
+            'status': 'success',
+            **command_tracker.get_latency(request.args.get('device_id'), limit=max(0, limit)),
+            'stats': command_tracker.get_stats()
+        })
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/api/system/status')
 def api_system_status():
     """API: Статус системы"""
     try:
-        system_info = storage.get_system_info()
-        device_stats = storage.get_device_stats()
-        
-        # Проверяем MQTT соединение
-        mqtt_connected = mqtt_client and mqtt_client.is_connected()
+        entry = response_cache.get_or_build(
+            ('system_status',),
+            None,
+            build_system_status_payload,
+            max_age=Config.STATUS_CACHE_MAX_AGE
+        )
+        return cached_json_response(entry)
         
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статуса системы: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def build_system_status_payload():
+    """Данные ответа /api/system/status"""
+    system_info = storage.get_system_info()
+    device_stats = storage.get_device_stats()
+    
+    # Проверяем MQTT соединение
+    mqtt_connected = bool(mqtt_client and mqtt_client.is_connected())
+    
+    return {
+        'status': 'success',
+        'system': {
+            'mqtt_connected': mqtt_connected,
+            'web_server': True,
+            'uptime': system_info['uptime'],
+            'message_count': system_info['message_count'],
+            'error_count': system_info['error_count'],
+            'mqtt_broker': Config.MQTT_BROKER_HOST,
+            'ingest': ingest.get_stats(),
+            'stream': storage.feed.get_stats(),
+            'response_cache': response_cache.get_stats(),
+            'commands': {**command_publisher.get_stats(), 'delivery': command_tracker.get_stats()},
+            'telemetry': telemetry.get_stats(),
+            'health': storage.health.get_stats(),
+            'journal': journal.get_stats(),
+            'logging': {**log_pipeline.get_stats(), 'suppressed': dict(message_sampler.suppressed)}
+        },
+        'devices': device_stats,
+        'timestamp': time.time()
+    }
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if span_tracer.enabled:
+        g.request_span = span_tracer.begin('http ' + (request.url_rule.rule if request.url_rule is not None else 'unmatched'))
+
+@app.teardown_request
+def end_request_span(exc=None):
+    span_tracer.end(g.pop('request_span', None))
+
+@app.after_request
+def observe_request(response):
+    """Длительность запроса и код ответа по шаблону маршрута (а не по пути - число меток ограничено)"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_seconds.labels(route, request.method).observe(time.perf_counter() - started)
+        http_responses.labels(route, str(response.status_code)).inc()
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.Registry.CONTENT_TYPE)
+
+def profiling_disabled():
+    return jsonify({'status': 'error', 'message': 'Profiling is disabled (Config.PROFILING_ENABLED)'}), 403
+
+@app.route('/api/admin/profile', methods=['POST'])
+def api_admin_profile():
+    """API: Сэмплирование стеков всех потоков на seconds секунд, ответ - свернутые стеки
+
+    ?seconds=5&interval=0.005&idle=1 (idle - включая простаивающие потоки).
+    Ответ можно передать в flamegraph.pl или открыть в speedscope.
+    """
+    if not Config.PROFILING_ENABLED:
+        return profiling_disabled()
+    seconds = request.args.get('seconds', 5.0, type=float)
+    interval = request.args.get('interval', Config.PROFILE_INTERVAL, type=float)
+    include_idle = request.args.get('idle', '0').lower() in ('1', 'true', 'yes')
+    if seconds <= 0:
+        return jsonify({'status': 'error', 'message': 'seconds must be positive'}), 400
+
+    result = sampler.profile(seconds, interval, include_idle)
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'Profiler is already running'}), 409
+    stacks, snapshots = result
+    logger.info(f"🔬 Профилирование: {snapshots} снимков, {len(stacks)} уникальных стеков")
+    return Response(profiling.format_collapsed(stacks), content_type='text/plain; charset=utf-8',
+                    headers={'X-Profile-Snapshots': str(snapshots)})
+
+@app.route('/api/admin/trace', methods=['POST'])
+def api_admin_trace():
+    """API: Трассировка этапов (MQTT, конвейер, хранилище, HTTP) на seconds секунд
+
+    Свернутые стеки спанов с весом в микросекундах собственного времени.
+    """
+    if not Config.PROFILING_ENABLED:
+        return profiling_disabled()
+    seconds = request.args.get('seconds', 5.0, type=float)
+    if seconds <= 0:
+        return jsonify({'status': 'error', 'message': 'seconds must be positive'}), 400
+
+    spans = span_tracer.trace(seconds)
+    if spans is None:
+        return jsonify({'status': 'error', 'message': 'Trace is already running'}), 409
+    return Response(profiling.format_collapsed(spans), content_type='text/plain; charset=utf-8')
+
+@app.route('/api/admin/slow_messages', methods=['GET', 'DELETE'])
+def api_admin_slow_messages():
+    """API: Журнал сообщений, разбор которых (или применение пачки) занял больше SLOW_MESSAGE_MS"""
+    if not Config.PROFILING_ENABLED:
+        return profiling_disabled()
+    if request.method == 'DELETE':
+        slow_messages.clear()
+        return jsonify({'status': 'success'})
+    limit = max(0, request.args.get('limit', 50, type=int))
+    return jsonify({
+        'status': 'success',
+        'stats': slow_messages.get_stats(),
+        'entries': slow_messages.get_entries(limit)
+    })
+
+@app.route('/api/system/ingest')
+def api_system_ingest():
+    """API: Метрики конвейера обработки MQTT сообщений"""
+    try:
         return jsonify({
             'status': 'success',
-            'system': {
-                'mqtt_connected': mqtt_connected,
-                'web_server': True,
-                'uptime': system_info['uptime'],
-                'message_count': system_info['message_count'],
-                'error_count': system_info['error_count'],
-                'mqtt_broker': Config.MQTT_BROKER_HOST
-            },
-            'devices': device_stats,
+            'ingest': ingest.get_stats(),
+            'decoder': payload_schema.get_stats(),
+            'statuses': dict(storage.status_counts),
             'timestamp': time.time()
         })
         
     except Exception as e:
-        logger.error(f"❌ Ошибка получения статуса системы: {e}")
+        logger.error(f"❌ Ошибка получения метрик конвейера: {e}")
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -660,15 +1875,28 @@ def api_system_status():
 
 @app.route('/api/system/events')
 def api_system_events():
-    """API: Получение событий системы"""
+    """API: Получение событий системы
+
+    Параметры: limit, level (info/warning/error), after - номер последнего
+    полученного события: вернутся только более новые (для чтения "хвоста").
+    """
     try:
-        limit = request.args.get('limit', 50, type=int)
-        events = storage.event_log[-limit:] if storage.event_log else []
+        limit = max(1, min(request.args.get('limit', 50, type=int), Config.EVENT_LOG_CAPACITY))
+        after = request.args.get('after', type=int)
+        level = request.args.get('level')
+        
+        event_log = storage.event_log
+        events = event_log.read(after=after, level=level, limit=limit)
         
         return jsonify({
             'status': 'success',
             'events': events,
-            'total_count': len(storage.event_log)
+            'total_count': len(event_log),
+            'last_seq': event_log.last_seq,
+            # Курсор для следующего запроса ?after=
+            'next_after': events[-1]['seq'] if events else (event_log.last_seq if after is None else after),
+            # Клиент пропустил события, вытесненные из журнала
+            'truncated': after is not None and after + 1 < event_log.first_seq
         })
         
     except Exception as e:
@@ -682,17 +1910,127 @@ def api_system_events():
 def api_device_info(device_id):
     """API: Подробная информация об устройстве"""
     try:
-        if device_id not in storage.devices:
+        # Версия читается раньше записи: реестр публикует запись до того, как поднять
+        # версию, поэтому под версией никогда не кэшируется более старое тело
+        version = storage.changes.version_of(device_id)
+        device = storage.devices.get(device_id)
+        if device is None:
             return jsonify({'status': 'error', 'message': 'Device not found'}), 404
         
-        device = storage.devices[device_id]
+        cached = not_modified(version)
+        if cached is not None:
+            return cached
+        
+        entry = response_cache.get_or_build(
+            ('device', device_id),
+            version,
+            lambda: {'status': 'success', 'device': device.to_dict()},
+            etag=str(version)
+        )
+        return cached_json_response(entry)
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения информации об устройстве: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/device/<device_id>/series')
+def api_device_series(device_id):
+    """API: История показателя устройства с прореживанием на сервере
+
+    Параметры: metric (rssi, free_heap, temperature, ...), from/to (unix время,
+    по умолчанию последний час), step (секунды агрегации, необязательно).
+    """
+    try:
+        metric = request.args.get('metric')
+        if not metric:
+            return jsonify({
+                'status': 'error',
+                'message': 'Parameter metric is required',
+                'metrics': telemetry.metrics_of(device_id)
+            }), 400
+        
+        try:
+            end = float(request.args.get('to', time.time()))
+            start = float(request.args.get('from', end - 3600))
+            step = request.args.get('step', type=float)
+        except ValueError:
+            return jsonify({'status': 'error', 'message': 'Parameters from/to/step must be numbers'}), 400
+        if end <= start or (step is not None and step <= 0):
+            return jsonify({'status': 'error', 'message': 'Invalid time range or step'}), 400
+        
+        series = telemetry.series(device_id, metric, start, end, step)
         return jsonify({
             'status': 'success',
-            'device': device
+            'device_id': device_id,
+            'metric': metric,
+            'from': start,
+            'to': end,
+            **series
         })
         
     except Exception as e:
-        logger.error(f"❌ Ошибка получения информации об устройстве: {e}")
+        logger.error(f"❌ Ошибка получения истории {device_id}: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/device/<device_id>/health')
+def api_device_health(device_id):
+    """API: Скользящая статистика RSSI, памяти и аптайма устройства (1m/1h/1d)"""
+    try:
+        health = storage.health.get_device(device_id)
+        if health is None:
+            return jsonify({
+                'status': 'error',
+                'message': f'No statistics for {device_id}'
+            }), 404
+        
+        return jsonify({
+            'status': 'success',
+            'device_id': device_id,
+            'health': health,
+            'timestamp': time.time()
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения статистики {device_id}: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/devices/top')
+def api_devices_top():
+    """API: Устройства с самым слабым WiFi (metric=rssi) или меньше всего памяти (metric=free_heap)
+
+    Параметры: metric, k (по умолчанию 10), online=1 - только подключенные устройства.
+    """
+    try:
+        metric = request.args.get('metric', 'rssi')
+        if metric not in ('rssi', 'free_heap'):
+            return jsonify({'status': 'error', 'message': 'metric must be rssi or free_heap'}), 400
+        
+        k = max(1, min(request.args.get('k', 10, type=int), 1000))
+        predicate = None
+        if request.args.get('online') in ('1', 'true'):
+            predicate = lambda device_id: device_id in storage.online_devices
+        
+        return jsonify({
+            'status': 'success',
+            'metric': metric,
+            'devices': [
+                {'device_id': device_id, 'value': value}
+                for device_id, value in storage.health.lowest(metric, k, predicate)
+            ],
+            'timestamp': time.time()
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка получения рейтинга устройств: {e}")
         return jsonify({
             'status': 'error',
             'message': str(e)
@@ -753,16 +2091,68 @@ def api_mix_colors():
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/devices/set_all_color', methods=['POST'])
+def api_set_all_color():
+    """API: Установка одного цвета для всех доступных RGB контроллеров"""
+    try:
+        data = request.get_json() or {}
+        result = storage.set_all_colors(data.get('red', 0), data.get('green', 0), data.get('blue', 0))
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/devices/colors', methods=['POST'])
+def api_fleet_colors():
+    """API: Групповая операция с цветами (rotate, gradient, brightness, random, set_all)
+
+    Параметры: {"operation": "gradient", "start": [r, g, b], "end": [r, g, b]},
+    {"operation": "brightness", "factor": 0.5}, {"operation": "rotate", "shift": 1},
+    {"operation": "random", "palette": [[r, g, b], ...], "seed": 1}, {"operation": "set_all", "color": [r, g, b]}
+    """
+    try:
+        data = request.get_json() or {}
+        operation = data.get('operation')
+        params = {key: value for key, value in data.items() if key != 'operation'}
+        
+        try:
+            for key in ('color', 'start', 'end'):
+                if key in params:
+                    params[key] = [max(0, min(255, int(c))) for c in params[key]][:3]
+                    if len(params[key]) != 3:
+                        raise ValueError(f"{key} должен быть [r, g, b]")
+            if 'palette' in params:
+                params['palette'] = [[max(0, min(255, int(c))) for c in color][:3] for color in params['palette']]
+            if 'factor' in params:
+                params['factor'] = float(params['factor'])
+            if 'shift' in params:
+                params['shift'] = int(params['shift'])
+            
+            started = time.perf_counter()
+            success_count, total = storage.apply_color_operation(operation, params, source=f"colors:{operation}")
+        except (KeyError, ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': f'Invalid parameters: {e}'}), 400
+        
+        storage.log_event(f"Групповая операция с цветами {operation}: {success_count} из {total} устройств")
+        return jsonify({
+            'status': 'success',
+            'operation': operation,
+            'updated_count': success_count,
+            'total_available': total,
+            'backend': storage.colors.backend,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        })
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/api/device/<device_id>/reset_button', methods=['POST'])
 def api_reset_button(device_id):
     """API: Сброс состояния кнопки"""
     try:
-        topic = f"{Config.DEVICE_TOPIC_PREFIX}/{device_id}/command"
-        mqtt_client.publish(topic, json.dumps({
-            'command': 'RESET_BUTTON',
-            'timestamp': time.time()
-        }))
-        return jsonify({'status': 'success', 'message': f'Button reset for {device_id}'})
+        result = command_publisher.publish_many([{'device_id': device_id, 'command': 'RESET_BUTTON'}], source='web')[0]
+        if result['status'] not in ACCEPTED_STATUSES:
+            raise RuntimeError(result.get('error', 'publish failed'))
+        return jsonify({'status': 'success', 'message': f'Button reset for {device_id}',
+                        'command_id': result['command_id']})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -782,9 +2172,21 @@ def internal_error(error):
     logger.error(f"500 Internal Server Error: {error}")
     return jsonify({'status': 'error', 'message': 'Internal server error'}), 500
 
+def start_services():
+    """Восстановление состояния и фоновые службы (общая часть потокового и асинхронного режимов)"""
+    # Поднимаем сохраненное состояние до подключения устройств
+    restore_state()
+    
+    # Запускаем контроль сроков жизни устройств и поток изменений
+    storage.expiry.start()
+    storage.feed.start()
+    telemetry.start()
+
 def start_web_server():
     """Запуск веб-сервера"""
     try:
+        start_services()
+        
         # Настраиваем MQTT клиент
         if not setup_mqtt():
             logger.error("❌ Не удалось запустить MQTT клиент")